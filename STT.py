@@ -1,78 +1,274 @@
-# stt_module.py (使用 Whisper 離線辨識)
-
-import speech_recognition as sr
-import whisper
-import os
-
-# --- 配置參數 ---
-LISTENING_TIMEOUT = 86000
-PAUSE_THRESHOLD = 1.0
-TEMP_AUDIO_FILE = "temp_audio.wav"
-LANGUAGE = 'zh'
-
-# --- 1. 全域載入 Whisper 模型 ---
-try:
-    WHISPER_MODEL_NAME = "small" # 可以改成 'small' 追求更高準確性
-    print(f"🧠 [Whisper] 正在載入 '{WHISPER_MODEL_NAME}' 模型... (首次運行耗時較久)")
-    model = whisper.load_model(WHISPER_MODEL_NAME) 
-except Exception as e:
-    print(f"❌ [Whisper] 載入模型失敗: {e}")
-    model = None
-
-
-def speech_to_text():
-    """從麥克風錄音並將其轉換為文字，使用 Whisper 離線辨識。"""
-    
-    if model is None:
-        return None
-
-    r = sr.Recognizer()
-    r.energy_threshold = 1000  
-    r.dynamic_energy_threshold = False # 建議設為 False 以固定該數值
-    r.pause_threshold = PAUSE_THRESHOLD
-    
-    with sr.Microphone() as source:
-        print(f"[STT] 請說話... (等待 {LISTENING_TIMEOUT} 秒後超時)")
-        
-        # 解決 AssertionError：避免在設定 pause_threshold 後調用 adjust_for_ambient_noise 帶 duration 參數的衝突
-        try:
-             r.adjust_for_ambient_noise(source) 
-        except AssertionError:
-             print("[STT] adjust_for_ambient_noise 衝突，跳過校準。")
-             pass 
-        
-        try:
-            audio = r.listen(source, timeout=LISTENING_TIMEOUT)
-        except sr.WaitTimeoutError:
-            print(f"[STT] 超時 ({LISTENING_TIMEOUT} 秒)，沒有偵測到語音。")
-            return None
-
-    try:
-        print("[Whisper] 正在進行離線辨識...")
-        
-        # 1. 存為臨時 WAV 檔案
-        with open(TEMP_AUDIO_FILE, "wb") as f:
-            f.write(audio.get_wav_data())
-
-        # 2. 使用 Whisper 轉錄
-        result = model.transcribe(
-            TEMP_AUDIO_FILE, 
-            fp16=False, 
-            language=LANGUAGE,
-            # initial_prompt 幫助 Whisper 更好地開始辨識
-            initial_prompt="你好，請問"
-        )
-        text = result["text"].strip()
-        
-        # 3. 清理臨時檔案
-        if os.path.exists(TEMP_AUDIO_FILE):
-            os.remove(TEMP_AUDIO_FILE)
-
-        print(f"[STT] 您說了: {text}")
-        return text, TEMP_AUDIO_FILE
-        
-    except Exception as e:
-        print(f"❌ [Whisper] 辨識過程中發生錯誤: {e}")
-        if os.path.exists(TEMP_AUDIO_FILE):
-             os.remove(TEMP_AUDIO_FILE)
-        return None
\ No newline at end of file
+# stt_module.py (使用 Whisper 離線辨識 + 串流 VAD 分段)
+
+import speech_recognition as sr
+import whisper
+import numpy as np
+import queue
+import threading
+import time
+from collections import deque
+
+# webrtcvad 是選配：有裝就用它判斷人聲，沒裝就用音量 (RMS) 判斷
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+# --- 配置參數 ---
+LISTENING_TIMEOUT = 86000
+PAUSE_THRESHOLD = 1.0
+LANGUAGE = 'zh'
+
+# --- 串流 / VAD 參數 ---
+SAMPLE_RATE = 16000           # Whisper 需要 16kHz 單聲道
+FRAME_MS = 30                 # 每個 frame 30ms (webrtcvad 支援 10/20/30ms)
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+ENERGY_THRESHOLD = 1000       # 沒有 webrtcvad 時的最低音量門檻 (int16 RMS)
+NOISE_FLOOR_MULTIPLIER = 1.5  # 音量超過「環境噪音 x 倍數」才算說話
+NOISE_FLOOR_ALPHA = 0.05      # 噪音基準的更新速度 (沒人說話時持續更新)
+PRE_ROLL_SECONDS = 0.3        # 偵測到說話前先保留一小段，避免吃掉第一個字
+SPEECH_START_SECONDS = 0.09   # 連續有聲多久才算「開始說話」
+SEGMENT_PAUSE_SECONDS = 0.4   # 句中短暫停頓：先把這一段辨識掉 (partial)
+PARTIAL_INTERVAL_SECONDS = 1.5  # 一直沒停頓時，每隔多久出一次 partial
+MAX_UTTERANCE_SECONDS = 30    # Whisper 一次最多處理 30 秒
+VAD_AGGRESSIVENESS = 2
+
+# --- 1. 全域載入 Whisper 模型 ---
+try:
+    WHISPER_MODEL_NAME = "small" # 可以改成 'small' 追求更高準確性
+    print(f"🧠 [Whisper] 正在載入 '{WHISPER_MODEL_NAME}' 模型... (首次運行耗時較久)")
+    model = whisper.load_model(WHISPER_MODEL_NAME)
+except Exception as e:
+    print(f"❌ [Whisper] 載入模型失敗: {e}")
+    model = None
+
+_vad = webrtcvad.Vad(VAD_AGGRESSIVENESS) if webrtcvad else None
+
+
+def _frames(seconds):
+    return max(1, int(seconds * 1000 / FRAME_MS))
+
+
+def _frame_energy(frame):
+    samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+    return float(np.sqrt(np.mean(samples ** 2))) if len(samples) else 0.0
+
+
+def _is_speech(frame, energy_threshold):
+    if _vad is not None:
+        try:
+            return _vad.is_speech(frame, SAMPLE_RATE)
+        except Exception:
+            pass
+    return _frame_energy(frame) > energy_threshold
+
+
+def _frames_to_array(frames):
+    """int16 PCM frames -> Whisper 需要的 float32 [-1, 1] numpy array"""
+    pcm = np.frombuffer(b"".join(frames), dtype=np.int16)
+    return pcm.astype(np.float32) / 32768.0
+
+
+def _transcribe(audio, prompt=""):
+    result = model.transcribe(
+        audio,
+        fp16=False,
+        language=LANGUAGE,
+        # initial_prompt 幫助 Whisper 更好地開始辨識；帶入前文讓分段之間比較連貫
+        initial_prompt="你好，請問" + prompt
+    )
+    return result["text"].strip()
+
+
+class MicrophoneSession:
+    """
+    常駐的麥克風收音 session：
+    - 麥克風只開一次，整個對話期間保持開啟 (不再每輪重開 + 校準 1 秒)
+    - 背景執行緒持續讀 frame、做 VAD 分段，沒人說話時持續更新環境噪音
+    - 切好的音訊片段透過佇列交給辨識端；只有在 listen 期間開始的說話才會送出
+      (避免把 AI 自己播放的聲音當成使用者的話)
+    事件格式: (種類, frames)
+      "segment": 句中停頓，這一段已確定
+      "preview": 一直沒停頓，目前這一段的暫時內容
+      "end":     說完了，frames 是最後一段；另附整句話的 frames
+    """
+
+    def __init__(self):
+        self._events = queue.Queue()
+        self._listening = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.noise_floor = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def begin_listening(self):
+        """開始收一句話 (清掉之前殘留的事件)"""
+        self.start()
+        while not self._events.empty():
+            try:
+                self._events.get_nowait()
+            except queue.Empty:
+                break
+        self._listening.set()
+
+    def end_listening(self):
+        self._listening.clear()
+
+    def get_event(self, timeout):
+        return self._events.get(timeout=timeout)
+
+    def _energy_threshold(self):
+        if self.noise_floor is None:
+            return ENERGY_THRESHOLD
+        return max(ENERGY_THRESHOLD, self.noise_floor * NOISE_FLOOR_MULTIPLIER)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                with sr.Microphone(sample_rate=SAMPLE_RATE, chunk_size=FRAME_SAMPLES) as source:
+                    print("🎙️ [STT] 麥克風已開啟 (常駐收音)")
+                    self._segment_loop(source)
+            except Exception as e:
+                print(f"❌ [STT] 麥克風讀取失敗: {e}，1 秒後重試")
+                time.sleep(1.0)
+
+    def _segment_loop(self, source):
+        pre_roll = deque(maxlen=_frames(PRE_ROLL_SECONDS))
+        utterance, segment = [], []
+        in_speech = False
+        emitting = False
+        voiced_run = silence_run = frames_since_preview = 0
+
+        while not self._stop_event.is_set():
+            frame = source.stream.read(FRAME_SAMPLES)
+            speech = _is_speech(frame, self._energy_threshold())
+
+            if not in_speech:
+                if not speech:
+                    # 背景持續更新噪音基準 (指數移動平均)
+                    energy = _frame_energy(frame)
+                    if self.noise_floor is None:
+                        self.noise_floor = energy
+                    else:
+                        self.noise_floor += NOISE_FLOOR_ALPHA * (energy - self.noise_floor)
+                pre_roll.append(frame)
+                voiced_run = voiced_run + 1 if speech else 0
+                if voiced_run >= _frames(SPEECH_START_SECONDS):
+                    in_speech = True
+                    emitting = self._listening.is_set()
+                    utterance = list(pre_roll)
+                    segment = list(pre_roll)
+                    silence_run = frames_since_preview = 0
+                continue
+
+            utterance.append(frame)
+            segment.append(frame)
+            frames_since_preview += 1
+            silence_run = 0 if speech else silence_run + 1
+
+            if silence_run >= _frames(PAUSE_THRESHOLD) or len(utterance) >= _frames(MAX_UTTERANCE_SECONDS):
+                if emitting:
+                    has_speech = len(segment) > silence_run
+                    self._events.put(("end", segment if has_speech else [], utterance))
+                in_speech = False
+                voiced_run = 0
+                pre_roll.clear()
+            elif silence_run >= _frames(SEGMENT_PAUSE_SECONDS) and len(segment) > silence_run:
+                if emitting:
+                    self._events.put(("segment", segment, None))
+                segment = []
+                frames_since_preview = 0
+            elif frames_since_preview >= _frames(PARTIAL_INTERVAL_SECONDS):
+                if emitting:
+                    self._events.put(("preview", list(segment), None))
+                frames_since_preview = 0
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_microphone_session():
+    """取得 (必要時建立並啟動) 全域共用的麥克風 session"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = MicrophoneSession()
+        _session.start()
+        return _session
+
+
+def stream_speech_to_text(timeout=LISTENING_TIMEOUT):
+    """
+    串流語音辨識 (generator)：
+    - 常駐麥克風 session 負責收音與 VAD 分段，這裡只負責 Whisper 辨識
+    - 句中停頓就先辨識那一段，產生 {"type": "partial", "text": 目前為止的文字}
+    - 說完 (停頓超過 PAUSE_THRESHOLD) 產生 {"type": "final", "text": 全文, "audio": float32 array}
+    全程不寫暫存 wav 檔；超時或失敗時不產生 final。
+    """
+    if model is None:
+        return
+
+    session = get_microphone_session()
+    session.begin_listening()
+    try:
+        print(f"[STT] 請說話... (等待 {timeout} 秒後超時)")
+        deadline = time.time() + timeout
+        started = False
+        committed = []       # 已經辨識好的片段文字
+
+        while True:
+            try:
+                kind, segment, utterance = session.get_event(timeout=1.0)
+            except queue.Empty:
+                # 已經開始說話，就不再受等待逾時限制
+                if not started and time.time() > deadline:
+                    print(f"[STT] 超時 ({timeout} 秒)，沒有偵測到語音。")
+                    return
+                continue
+            started = True
+
+            if kind == "segment":
+                text = _transcribe(_frames_to_array(segment), "".join(committed))
+                if text:
+                    committed.append(text)
+                    yield {"type": "partial", "text": "".join(committed)}
+            elif kind == "preview":
+                text = _transcribe(_frames_to_array(segment), "".join(committed))
+                yield {"type": "partial", "text": "".join(committed) + text}
+            else:
+                break
+    finally:
+        session.end_listening()
+
+    print("[Whisper] 正在進行離線辨識...")
+    if segment:
+        text = _transcribe(_frames_to_array(segment), "".join(committed))
+        if text:
+            committed.append(text)
+
+    yield {"type": "final", "text": "".join(committed).strip(), "audio": _frames_to_array(utterance)}
+
+
+def speech_to_text():
+    """
+    從麥克風錄音並將其轉換為文字，使用 Whisper 離線辨識。
+    回傳 (文字, 音訊 float32 array @16kHz)；沒有聽到或失敗時回傳 None。
+    """
+    try:
+        for event in stream_speech_to_text():
+            if event["type"] == "final" and event["text"]:
+                print(f"[STT] 您說了: {event['text']}")
+                return event["text"], event["audio"]
+    except Exception as e:
+        print(f"❌ [Whisper] 辨識過程中發生錯誤: {e}")
+    return None
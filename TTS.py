@@ -1,141 +1,351 @@
-# tts_module.py (Session加速 + 詳細Debug版)
-
-import random
-import requests
-import pygame
-import os
-import re
-import time
-
-# ==========================================
-# 🔧 配置區域
-# ==========================================
-
-API_URL = "http://127.0.0.1:9880"
-LANGUAGE = 'zh'
-TTS_VOLUME = 0.6
-
-# ❗ 請確認路徑
-REF_AUDIO_PATH = r"D:\ai_vtuber\GPT_SoVITS\GPT-SoVITS_MyGO-\参考音频\Anon干声素材\参考音频\サンキュー、あの頃の私なんだかこの辺.wav" 
-
-EMOTION_SAMPLES = {
-    "normal": [
-        {"path": r"D:\ai_vtuber\GPT_SoVITS\GPT-SoVITS_MyGO-\参考音频\Anon干声素材\参考音频\サンキュー、あの頃の私なんだかこの辺.wav", "text": "こんにちは、今日はいい天気ですね。", "lang": LANGUAGE},
-        # ... (請保留您原本完整的字典內容，這裡省略以節省篇幅) ...
-    ]
-}
-
-# 補上預設值，避免 KeyError
-if "normal" not in EMOTION_SAMPLES:
-    EMOTION_SAMPLES["normal"] = [{"path": REF_AUDIO_PATH, "text": "你好", "lang": "zh"}]
-
-DEFAULT_EMOTION = "normal"
-GPT_MODEL_PATH = r"D:\ai_vtuber\GPT_SoVITS\GPT-SoVITS_MyGO-\SoVITS_weights\anon1_e8_s2184.pth"
-SOVITS_MODEL_PATH = r"D:\ai_vtuber\GPT_SoVITS\GPT-SoVITS_MyGO-\SoVITS_weights\anon1_e8_s2184.pth"
-TTS_TEMP_FILE = "tts_sovits_output.wav"
-
-# 🔥 優化 1: 使用 Session，保持 HTTP 連線，減少延遲
-session = requests.Session()
-
-def load_character_model():
-    if not os.path.exists(GPT_MODEL_PATH) or not os.path.exists(SOVITS_MODEL_PATH):
-        return
-
-    print(f"⏳ [SoVITS] 請求切換模型...")
-    url = f"{API_URL}/set_model"
-    params = {"gpt_model_path": GPT_MODEL_PATH, "sovits_model_path": SOVITS_MODEL_PATH}
-    
-    try:
-        resp = session.get(url, params=params, timeout=60)
-        if resp.status_code == 200:
-            print("✅ [SoVITS] 模型就緒")
-    except Exception as e:
-        print(f"❌ [SoVITS] API 未啟動或連線失敗: {e}")
-
-load_character_model()
-
-def text_to_speech(text: str, emotion: str = None, lang: str = LANGUAGE):
-    if not text: return
-    
-    # 簡單過濾
-    text = text.replace("，", ",")
-    if not any(c.isalnum() for c in text): return
-
-    # 選擇情感音訊
-    target_list = EMOTION_SAMPLES.get(emotion, EMOTION_SAMPLES[DEFAULT_EMOTION])
-    try:
-        target_sample = random.choice(target_list)
-    except:
-        # 如果選不到，用預設的第一個
-        target_sample = EMOTION_SAMPLES["normal"][0]
-
-    payload = {
-        "text": text,
-        "text_language": LANGUAGE,
-        "refer_wav_path": target_sample["path"],
-        "prompt_text": target_sample["text"],
-        "prompt_language": 'ja',
-        "text_split_method": "cut0", 
-        "batch_size": 1,
-        "media_type": "wav",
-        "streaming_mode": False,
-        "top_k": 5, 
-        "top_p": 0.8,
-        "temperature": 0.8
-    }
-
-    url = f"{API_URL}/"
-
-    #print(f"🔄 [TTS] 正在發送請求給 SoVITS... (Text: {text[:10]}...)")
-    start_time = time.time()
-
-    try:
-        # 🔥 優化 2: 使用 session 發送，並加入超時保護 (120s)
-        response = session.post(url, json=payload, timeout=120)
-        
-        duration = time.time() - start_time
-        #print(f"✅ [TTS] 生成完畢! 耗時: {duration:.2f}秒")
-
-        if response.status_code == 200:
-            with open(TTS_TEMP_FILE, "wb") as f:
-                f.write(response.content)
-            
-            # 只有檔案大於 1KB 才播放
-            if os.path.getsize(TTS_TEMP_FILE) > 1000:
-                _play_audio(TTS_TEMP_FILE)
-            else:
-                print("⚠️ [TTS] 生成的音訊檔案太小 (可能失敗)")
-        
-        elif response.status_code == 400:
-            print(f"❌ [TTS] 參數錯誤 (400)。請檢查參考音訊路徑是否正確。")
-            print(f"   路徑: {target_sample['path']}")
-        else:
-            print(f"❌ [TTS] 伺服器錯誤: {response.status_code}")
-
-    except requests.exceptions.ReadTimeout:
-        print("❌ [TTS] 逾時 (Timeout)! GPT-SoVITS 兩分鐘內沒有回應。")
-        print("💡 建議: 請檢查您的顯卡 VRAM 是否已滿，或 GPT-SoVITS視窗是否被凍結。")
-    except Exception as e:
-        print(f"❌ [TTS] 連線錯誤: {e}")
-
-def _play_audio(file_path):
-    try:
-        if not pygame.mixer.get_init():
-            pygame.mixer.init()
-        
-        pygame.mixer.music.load(file_path)
-        pygame.mixer.music.set_volume(TTS_VOLUME) 
-        pygame.mixer.music.play()
-        
-        # 這裡會卡住主程式直到播放完畢，這是正常的
-        while pygame.mixer.music.get_busy():
-            pygame.time.Clock().tick(10)
-            
-        time.sleep(0.3)
-        pygame.mixer.music.unload()
-    except Exception as e:
-        print(f"❌ 播放失敗: {e}")
-
-def split_into_sentences(text: str) -> list[str]:
-    sentences = re.split(r'[。？！;；]', text)
-    return [s.strip() for s in sentences if s.strip()]
\ No newline at end of file
+# tts_module.py (Session加速 + 詳細Debug版)
+
+import random
+import requests
+import pygame
+import os
+import io
+import time
+import queue
+import threading
+import json
+import hashlib
+from collections import OrderedDict
+from stream_parser import split_sentences
+
+# ==========================================
+# 🔧 配置區域
+# ==========================================
+
+API_URL = "http://127.0.0.1:9880"
+LANGUAGE = 'zh'
+TTS_VOLUME = 0.6
+
+# ❗ 請確認路徑
+REF_AUDIO_PATH = r"D:\ai_vtuber\GPT_SoVITS\GPT-SoVITS_MyGO-\参考音频\Anon干声素材\参考音频\サンキュー、あの頃の私なんだかこの辺.wav" 
+
+EMOTION_SAMPLES = {
+    "normal": [
+        {"path": r"D:\ai_vtuber\GPT_SoVITS\GPT-SoVITS_MyGO-\参考音频\Anon干声素材\参考音频\サンキュー、あの頃の私なんだかこの辺.wav", "text": "こんにちは、今日はいい天気ですね。", "lang": LANGUAGE},
+        # ... (請保留您原本完整的字典內容，這裡省略以節省篇幅) ...
+    ]
+}
+
+# 補上預設值，避免 KeyError
+if "normal" not in EMOTION_SAMPLES:
+    EMOTION_SAMPLES["normal"] = [{"path": REF_AUDIO_PATH, "text": "你好", "lang": "zh"}]
+
+DEFAULT_EMOTION = "normal"
+GPT_MODEL_PATH = r"D:\ai_vtuber\GPT_SoVITS\GPT-SoVITS_MyGO-\SoVITS_weights\anon1_e8_s2184.pth"
+SOVITS_MODEL_PATH = r"D:\ai_vtuber\GPT_SoVITS\GPT-SoVITS_MyGO-\SoVITS_weights\anon1_e8_s2184.pth"
+
+# 💾 語音快取 (招呼語、固定台詞不用每次都重新合成)
+TTS_CACHE_DIR = "./tts_cache"
+TTS_CACHE_MEMORY_BYTES = 64 * 1024 * 1024      # 記憶體層上限 64MB
+TTS_CACHE_DISK_BYTES = 1024 * 1024 * 1024      # 磁碟層上限 1GB
+
+# 🔥 優化 1: 使用 Session，保持 HTTP 連線，減少延遲
+session = requests.Session()
+
+class _AudioCache:
+    """
+    以內容雜湊為鍵的音訊快取 (記憶體 LRU + 磁碟，皆有容量上限)
+    鍵 = 正規化文字 + 參考音訊 + 語言 + 取樣參數，任何一項不同都不會誤用。
+    """
+
+    def __init__(self, cache_dir, memory_limit, disk_limit):
+        self.cache_dir = cache_dir
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._disk_bytes = sum(
+            os.path.getsize(os.path.join(cache_dir, name))
+            for name in os.listdir(cache_dir) if name.endswith(".wav")
+        )
+
+    @staticmethod
+    def make_key(payload):
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def _read(self, key):
+        """不計入統計；找不到回傳 None (呼叫前要先拿到 self._lock)"""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio_bytes = f.read()
+            os.utime(path)  # 更新時間，淘汰時當作「最近使用」
+        except OSError:
+            return None
+
+        self._remember(key, audio_bytes)
+        return audio_bytes
+
+    def lookup(self, keys):
+        """依序找第一個有快取的鍵；不管試了幾個鍵，一次查詢只算一次命中或未命中"""
+        with self._lock:
+            for key in keys:
+                audio_bytes = self._read(key)
+                if audio_bytes:
+                    self.hits += 1
+                    return audio_bytes
+            self.misses += 1
+            return None
+
+    def get(self, key):
+        return self.lookup([key])
+
+    def put(self, key, audio_bytes):
+        with self._lock:
+            self._remember(key, audio_bytes)
+
+            path = self._path(key)
+            if os.path.exists(path):
+                return
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio_bytes)
+            os.replace(tmp_path, path)
+            self._disk_bytes += len(audio_bytes)
+            if self._disk_bytes > self.disk_limit:
+                self._evict_disk()
+
+    def _remember(self, key, audio_bytes):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = audio_bytes
+        self._memory_bytes += len(audio_bytes)
+        while self._memory_bytes > self.memory_limit and self._memory:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+
+    def _evict_disk(self):
+        """刪掉最久沒用的檔案，直到低於上限的 90%"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".wav"):
+                path = os.path.join(self.cache_dir, name)
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+        entries.sort()
+        self._disk_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._disk_bytes <= self.disk_limit * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._disk_bytes -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+        }
+
+audio_cache = _AudioCache(TTS_CACHE_DIR, TTS_CACHE_MEMORY_BYTES, TTS_CACHE_DISK_BYTES)
+
+def get_tts_cache_stats():
+    """語音快取命中統計"""
+    return audio_cache.stats()
+
+def load_character_model():
+    if not os.path.exists(GPT_MODEL_PATH) or not os.path.exists(SOVITS_MODEL_PATH):
+        return
+
+    print(f"⏳ [SoVITS] 請求切換模型...")
+    url = f"{API_URL}/set_model"
+    params = {"gpt_model_path": GPT_MODEL_PATH, "sovits_model_path": SOVITS_MODEL_PATH}
+    
+    try:
+        resp = session.get(url, params=params, timeout=60)
+        if resp.status_code == 200:
+            print("✅ [SoVITS] 模型就緒")
+    except Exception as e:
+        print(f"❌ [SoVITS] API 未啟動或連線失敗: {e}")
+
+load_character_model()
+
+def _build_payload(text: str, sample: dict, lang: str = LANGUAGE):
+    """組合 SoVITS 請求內容 (也用來計算快取鍵，所以語言也在鍵裡)"""
+    return {
+        "text": text,
+        "text_language": lang,
+        "refer_wav_path": sample["path"],
+        "prompt_text": sample["text"],
+        "prompt_language": 'ja',
+        "text_split_method": "cut0", 
+        "batch_size": 1,
+        "media_type": "wav",
+        "streaming_mode": False,
+        "top_k": 5, 
+        "top_p": 0.8,
+        "temperature": 0.8
+    }
+
+def _synthesize(text: str, emotion: str = None, lang: str = LANGUAGE):
+    """向 GPT-SoVITS 請求合成，成功回傳 wav bytes，失敗回傳 None (不播放)"""
+    if not text: return None
+    
+    # 簡單過濾 (同時正規化空白，讓快取鍵穩定)
+    text = " ".join(text.replace("，", ",").split())
+    if not any(c.isalnum() for c in text): return None
+
+    # 選擇情感音訊
+    target_list = EMOTION_SAMPLES.get(emotion, EMOTION_SAMPLES[DEFAULT_EMOTION])
+    if not target_list:
+        # 如果選不到，用預設的第一個
+        target_list = EMOTION_SAMPLES["normal"][:1]
+
+    # 快取感知的樣本選擇：這句話用哪個參考音訊合成過，就優先用那個 (不讓 random 打散快取)
+    candidates = [(sample, _build_payload(text, sample, lang)) for sample in target_list]
+    audio_bytes = audio_cache.lookup([_AudioCache.make_key(payload) for _, payload in candidates])
+    if audio_bytes:
+        return audio_bytes
+
+    target_sample, payload = random.choice(candidates)
+    cache_key = _AudioCache.make_key(payload)
+
+    url = f"{API_URL}/"
+
+    #print(f"🔄 [TTS] 正在發送請求給 SoVITS... (Text: {text[:10]}...)")
+    start_time = time.time()
+
+    try:
+        # 🔥 優化 2: 使用 session 發送，並加入超時保護 (120s)
+        response = session.post(url, json=payload, timeout=120)
+        
+        duration = time.time() - start_time
+        #print(f"✅ [TTS] 生成完畢! 耗時: {duration:.2f}秒")
+
+        if response.status_code == 200:
+            # 只有檔案大於 1KB 才算成功
+            if len(response.content) > 1000:
+                audio_cache.put(cache_key, response.content)
+                return response.content
+            print("⚠️ [TTS] 生成的音訊檔案太小 (可能失敗)")
+        
+        elif response.status_code == 400:
+            print(f"❌ [TTS] 參數錯誤 (400)。請檢查參考音訊路徑是否正確。")
+            print(f"   路徑: {target_sample['path']}")
+        else:
+            print(f"❌ [TTS] 伺服器錯誤: {response.status_code}")
+
+    except requests.exceptions.ReadTimeout:
+        print("❌ [TTS] 逾時 (Timeout)! GPT-SoVITS 兩分鐘內沒有回應。")
+        print("💡 建議: 請檢查您的顯卡 VRAM 是否已滿，或 GPT-SoVITS視窗是否被凍結。")
+    except Exception as e:
+        print(f"❌ [TTS] 連線錯誤: {e}")
+    return None
+
+def text_to_speech(text: str, emotion: str = None, lang: str = LANGUAGE, play: bool = True):
+    """
+    合成一句話，回傳 wav bytes (失敗回傳 None)。
+    play=True 時會直接播放 (卡住直到播放完畢)；網頁 /tts 用 play=False 只拿音訊。
+    全程在記憶體中處理，不寫暫存檔，多個請求同時合成也不會互相覆蓋。
+    """
+    audio_bytes = _synthesize(text, emotion, lang)
+    if audio_bytes and play:
+        _play_audio(audio_bytes)
+    return audio_bytes
+
+class SpeechPipeline:
+    """
+    🔥 優化 3: 管線化語音輸出 (生產者 / 消費者)
+    - say() 只把句子丟進佇列，立刻返回，LLM 串流可以繼續讀
+    - 合成執行緒：預先合成後面的句子，放進有上限的音訊佇列 (prefetch)
+    - 播放執行緒：依序播放
+    目前這句在播的時候，下一句已經在合成，句子之間不會有空白。
+    """
+
+    def __init__(self, prefetch: int = 2):
+        self._text_queue = queue.Queue()
+        # 上限避免合成跑太前面、佔用太多記憶體
+        self._audio_queue = queue.Queue(maxsize=prefetch)
+        self._synth_thread = threading.Thread(target=self._synth_worker, daemon=True)
+        self._play_thread = threading.Thread(target=self._play_worker, daemon=True)
+        self._synth_thread.start()
+        self._play_thread.start()
+
+    def say(self, text: str, emotion: str = None, lang: str = LANGUAGE):
+        """排入一句話 (不等待)"""
+        if text and text.strip():
+            self._text_queue.put((text, emotion, lang))
+
+    def wait(self):
+        """等到所有排入的句子都播完 (例如要開始收音前)"""
+        self._text_queue.join()
+        self._audio_queue.join()
+
+    def close(self):
+        """播完剩下的句子後結束兩個執行緒"""
+        self._text_queue.put(None)
+        self._synth_thread.join()
+        self._play_thread.join()
+
+    def _synth_worker(self):
+        while True:
+            item = self._text_queue.get()
+            try:
+                if item is None:
+                    self._audio_queue.put(None)
+                    return
+                audio_bytes = _synthesize(*item)
+                if audio_bytes:
+                    # 佇列滿了就在這裡等，播放端消化後才繼續合成
+                    self._audio_queue.put(audio_bytes)
+            finally:
+                self._text_queue.task_done()
+
+    def _play_worker(self):
+        while True:
+            audio_bytes = self._audio_queue.get()
+            try:
+                if audio_bytes is None:
+                    return
+                _play_audio(audio_bytes)
+            finally:
+                self._audio_queue.task_done()
+
+def _play_audio(audio_bytes):
+    """直接從記憶體中的 wav bytes 播放"""
+    try:
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        
+        # buffer 要活到 unload 之後，播放中 pygame 會持續從裡面讀資料
+        buffer = io.BytesIO(audio_bytes)
+        pygame.mixer.music.load(buffer, "wav")
+        pygame.mixer.music.set_volume(TTS_VOLUME) 
+        pygame.mixer.music.play()
+        
+        # 這裡會卡住主程式直到播放完畢，這是正常的
+        while pygame.mixer.music.get_busy():
+            pygame.time.Clock().tick(10)
+            
+        time.sleep(0.3)
+        pygame.mixer.music.unload()
+    except Exception as e:
+        print(f"❌ 播放失敗: {e}")
+
+def split_into_sentences(text: str) -> list[str]:
+    # 和串流斷句同一套規則 (保留句尾標點，3.14 這類小數點不會被切開)
+    return split_sentences(text)
\ No newline at end of file
@@ -1,209 +1,339 @@
-from flask import Flask, render_template, request, Response, stream_with_context, jsonify
-import json
-import atexit
-import sys
-import os # 記得導入 os
-
-# --- 導入模組 ---
-# 假設 main_app 中包含了所有核心邏輯和模型配置
-from main_app import (
-    chat_with_dual_brain, 
-    unload_model,
-    text_to_speech,    
-    speech_to_text,    
-    identify_speaker,  
-    search_memory,     
-    add_memory         
-)
-
-# 導入圖片與PDF處理函數
-from mcp_handler import process_uploaded_image, process_pdf_pipeline
-
-app = Flask(__name__)
-app.secret_key = 'your_secret_key' 
-
-# ==============================================================================
-# 🚨【終極解法】暴力解除大小限制 (確保能上傳大型檔案/Base64)
-# ==============================================================================
-# 將總上傳限制設為一個極大值 (16GB)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 * 1024 
-# 將表單記憶體限制 (處理 Base64 字串) 設為 1GB
-app.config['MAX_FORM_MEMORY_SIZE'] = 1024 * 1024 * 1024 
-app.config['MAX_HEADERS_LIST'] = 1024 * 1024 
-
-# ------------------------------------------------------------------------------
-
-chat_history = [] 
-atexit.register(unload_model) 
-
-@app.route("/")
-def index():
-    return render_template("index.html", history=chat_history)
-
-@app.route("/chat", methods=["POST"])
-def chat():
-    # 1. 獲取輸入
-    try:
-        user_text = request.form.get("user_input", "").strip()
-        image_base64 = request.form.get("image_base64", "").strip()
-        pdf_file = request.files.get("pdf_file")
-        pdf_page = request.form.get("pdf_page", "1")
-    except Exception as e:
-        print(f"❌ 接收資料失敗: {e}")
-        return Response(json.dumps({"text": f"❌ 資料傳輸失敗: {e}", "done": True}) + "\n", mimetype='application/jsonlines')
-    
-    audio_file_path = None
-    identity_context = "使用者正在使用文字介面與你交談" 
-    
-    # --- 混合輸入邏輯 ---
-    if user_text and not image_base64 and not pdf_file:
-        print(f" [Web文字輸入]: {user_text}")
-    elif not user_text and not image_base64 and not pdf_file: 
-        print(" [Web語音模式]...")
-        stt_result = speech_to_text() 
-        if not stt_result:
-            return Response(json.dumps({"text": "❌ (未偵測到語音)", "done": True}) + "\n", mimetype='application/jsonlines')
-        user_text, audio_file_path = stt_result
-        if audio_file_path:
-            is_master, score = identify_speaker(audio_file_path)
-            identity_context = "認識的人" if is_master else "陌生訪客"
-
-    # --- 圖片處理 ---
-    if image_base64:
-        vision_analysis = process_uploaded_image(image_base64, user_text)
-        user_text = vision_analysis
-        print(" [Web圖片] 已轉換為文字描述")
-
-    # --- PDF 處理 ---
-    if pdf_file:
-        try:
-            page_num = int(pdf_page)
-            pdf_bytes = pdf_file.read() 
-            print(f" 📄 [Web PDF] 接收到檔案，大小: {len(pdf_bytes)/1024/1024:.2f} MB")
-            pdf_analysis = process_pdf_pipeline(pdf_bytes, page_num, user_text)
-            user_text = pdf_analysis
-        except Exception as e:
-            print(f"PDF 錯誤: {e}")
-            user_text = f"PDF 處理發生錯誤: {str(e)}"
-
-    if "退出" in user_text:
-        return Response(json.dumps({"text": "掰掰！", "done": True}) + "\n", mimetype='application/jsonlines')
-
-    # 2. Prompt
-    found_memories = search_memory(user_text, n_results=2)
-    memory_str = "\n".join([f"- {m}" for m in found_memories]) if found_memories else "無相關回憶"
-    recent_msgs = chat_history[-100:] 
-    recent_chat_str = "\n".join([f"{msg['speaker']}: {msg['text']}" for msg in recent_msgs])
-
-    system_prompt = (
-        "你喜歡解數學題目，看到題目會喜歡推導，並擅長使用 WolframAlpha\n"
-        f"=== 對話場景資訊 ===\n"
-        f"身份: {identity_context}\n"
-        f"長期記憶:\n{memory_str}\n"
-        f"最近對話:\n{recent_chat_str}\n"
-    )
-
-    history_log = "[使用者上傳檔案]" if (image_base64 or pdf_file) else user_text
-    chat_history.append({"speaker": "user", "text": history_log})
-
-    # 3. 雙腦生成
-    try:
-        response_stream = chat_with_dual_brain(system_prompt, user_text)
-    except Exception as e:
-        return Response(json.dumps({"text": f"❌ Error: {e}", "done": True}) + "\n", status=500, mimetype='application/jsonlines')
-
-    # 4. 串流回應
-    def generate_response(stream):
-        full_ai_response = ""
-        in_think_block = False 
-        
-        if stream and hasattr(stream, 'iter_lines'):
-            for line in stream.iter_lines():
-                if line:
-                    try:
-                        json_data = json.loads(line.decode('utf-8'))
-                        chunk = json_data.get("message", {}).get("content", "")
-                        
-                        if chunk:
-                            # --- <think> 過濾演算法 ---
-                            content_to_yield = ""
-                            temp_chunk = chunk
-                            
-                            while len(temp_chunk) > 0:
-                                if not in_think_block:
-                                    start_idx = temp_chunk.find("<think>")
-                                    if start_idx != -1:
-                                        content_to_yield += temp_chunk[:start_idx]
-                                        in_think_block = True
-                                        temp_chunk = temp_chunk[start_idx + 7:]
-                                    else:
-                                        content_to_yield += temp_chunk
-                                        temp_chunk = ""
-                                else:
-                                    end_idx = temp_chunk.find("</think>")
-                                    if end_idx != -1:
-                                        in_think_block = False
-                                        temp_chunk = temp_chunk[end_idx + 8:]
-                                    else:
-                                        temp_chunk = ""
-                            
-                            if content_to_yield:
-                                full_ai_response += content_to_yield
-                                yield json.dumps({"text": content_to_yield, "done": False}) + "\n"
-                        if json_data.get("done"): break
-                    except: break
-        
-        if full_ai_response.strip():
-            chat_history.append({"speaker": "ai", "text": full_ai_response})
-            add_memory(user_text, "User")
-            add_memory(full_ai_response, "AI")
-            yield json.dumps({"text": "", "done": True, "full_text": full_ai_response}) + "\n"
-        else:
-            yield json.dumps({"text": "(AI 無回應)", "done": True}) + "\n"
-
-    return Response(stream_with_context(generate_response(response_stream)), mimetype='application/jsonlines')
-
-@app.route("/tts", methods=["POST"])
-def generate_audio():
-    """生成音訊檔並傳回 (含防呆檢查)"""
-    data = request.json
-    text_to_speak = data.get("text", "")
-    
-    if not text_to_speak:
-        return jsonify({"error": "No text provided"}), 400
-
-    try:
-        # 呼叫 TTS
-        audio_file_path = text_to_speech(text_to_speak)
-        
-        # 檢查是否真的有回傳路徑，以及檔案是否存在
-        if not audio_file_path or not isinstance(audio_file_path, str):
-            print(f"⚠️ TTS 生成失敗: text_to_speech 回傳了 {type(audio_file_path)}")
-            return jsonify({"error": "TTS generation failed (Internal Error)"}), 500
-            
-        if not os.path.exists(audio_file_path):
-            print(f"⚠️ TTS 檔案找不到: {audio_file_path}")
-            return jsonify({"error": "TTS file not found"}), 500
-
-        # 讀取檔案
-        with open(audio_file_path, 'rb') as f:
-            audio_data = f.read()
-            
-        return Response(audio_data, mimetype="audio/wav")
-        
-    except Exception as e:
-        print(f"❌ TTS 路由發生錯誤: {e}")
-        return jsonify({"error": f"TTS exception: {str(e)}"}), 500
-
-@app.errorhandler(413)
-def request_entity_too_large(error):
-    return jsonify({"error": "檔案太大", "detail": "Server rejected payload (413)"}), 413
-
-if __name__ == "__main__":
-    print("="*50)
-    print(f"🚀 Flask 伺服器啟動中...")
-    print(f"📂 MAX_CONTENT_LENGTH 設定為: {app.config['MAX_CONTENT_LENGTH']}")
-    print(f"🧠 MAX_FORM_MEMORY_SIZE 設定為: {app.config['MAX_FORM_MEMORY_SIZE'] / (1024*1024):.2f} MB")
-    print("="*50)
-    
-    app.run(debug=True, port=5000, threaded=False, use_reloader=False)
\ No newline at end of file
+from flask import Flask, render_template, request, Response, stream_with_context, jsonify, session
+import json
+import atexit
+import sys
+import os # 記得導入 os
+import threading
+
+# --- 導入模組 ---
+# 假設 main_app 中包含了所有核心邏輯和模型配置
+from main_app import (
+    chat_with_dual_brain, 
+    unload_model,
+    text_to_speech,    
+    speech_to_text,    
+    identify_speaker,  
+    search_memory,     
+    add_memory,
+    CHAT_MODEL
+)
+
+# 導入圖片與PDF處理函數
+from mcp_handler import process_uploaded_image, process_pdf_pipeline, process_stored_pdf, VISION_MODEL
+import base64
+import upload_store
+import ollama_client
+from session_store import SessionStore
+from prompt_builder import build_messages, warm_up as warm_up_tokenizer
+from stream_parser import StreamProcessor
+
+app = Flask(__name__)
+app.secret_key = 'your_secret_key' 
+
+# ==============================================================================
+# 📦 上傳大小限制
+# ==============================================================================
+# 大檔案請走 /upload 分段上傳 (每段直接寫進磁碟，不會整份放在記憶體)；
+# /chat 的 image_base64 / pdf_file 欄位只保留給小檔案，單一請求上限 32MB
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
+# 表單欄位 (Base64 字串) 在記憶體中的上限
+app.config['MAX_FORM_MEMORY_SIZE'] = 16 * 1024 * 1024
+app.config['MAX_HEADERS_LIST'] = 1024 * 1024 
+
+# ------------------------------------------------------------------------------
+
+# ==============================================================================
+# 👥 多使用者設定
+# ==============================================================================
+# 同時送給 Ollama 的對話請求上限 (含圖片 / PDF 視覺分析)；
+# 超過的請求排隊等待，不會全部擠進 Ollama 讓每個人都變慢
+LLM_MAX_CONCURRENCY = 2
+# 排隊最多等幾秒，等不到就回覆「忙碌中」
+LLM_QUEUE_TIMEOUT = 120
+
+# 固定的人設與規則：每一輪逐字相同 (不要放時間、身份等會變的內容)，
+# Ollama 才能重用上一輪已經算好的前綴 (KV cache)
+SYSTEM_PROMPT = (
+    "你喜歡解數學題目，看到題目會喜歡推導，並擅長使用 WolframAlpha\n"
+    "重要：如果涉及數學公式，請務必使用 LaTeX 格式 (例如 $x^2$) 輸出，以便網頁渲染。"
+)
+
+# 每個瀏覽器 (session cookie) 各自一份對話紀錄
+sessions = SessionStore(prompt_model=CHAT_MODEL)
+# token 計數用的 tokenizer 在背景載入，不拖慢第一個請求
+warm_up_tokenizer(CHAT_MODEL)
+_llm_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+# 伺服器只有一支麥克風，同一時間只能一個人用語音模式
+_microphone_lock = threading.Lock()
+
+atexit.register(unload_model) 
+
+def _current_session():
+    """依 cookie 取得這個使用者的對話狀態 (第一次來就發一個新的 session id)"""
+    state = sessions.get(session.get("sid"))
+    session["sid"] = state.session_id
+    return state
+
+def _jsonl_message(text, status=200):
+    return Response(json.dumps({"text": text, "done": True}) + "\n", status=status, mimetype='application/jsonlines')
+
+@app.route("/")
+def index():
+    return render_template("index.html", history=_current_session().recent())
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    # 1. 獲取輸入
+    try:
+        user_text = request.form.get("user_input", "").strip()
+        image_base64 = request.form.get("image_base64", "").strip()
+        pdf_file = request.files.get("pdf_file")
+        pdf_page = request.form.get("pdf_page", "1")
+        # 用 /upload 傳好的檔案只帶代號 (content hash，統一轉小寫，和存檔名稱一致)
+        upload_handle = request.form.get("upload_handle", "").strip().lower()
+    except Exception as e:
+        print(f"❌ 接收資料失敗: {e}")
+        return Response(json.dumps({"text": f"❌ 資料傳輸失敗: {e}", "done": True}) + "\n", mimetype='application/jsonlines')
+    
+    upload_kind, upload_path = upload_store.resolve_handle(upload_handle) if upload_handle else (None, None)
+    if upload_handle and upload_kind is None:
+        return _jsonl_message("❌ 找不到上傳的檔案，請重新上傳", status=404)
+
+    state = _current_session()
+    # 一收到圖片就在背景載入視覺模型，和排隊 / 前處理的時間重疊
+    if image_base64 or upload_kind == "image":
+        ollama_client.prewarm(VISION_MODEL)
+    user_audio = None
+    identity_context = "使用者正在使用文字介面與你交談" 
+    
+    # --- 混合輸入邏輯 ---
+    has_file = bool(image_base64 or pdf_file or upload_kind)
+    if user_text and not has_file:
+        print(f" [Web文字輸入]: {user_text}")
+    elif not user_text and not has_file: 
+        print(" [Web語音模式]...")
+        if not _microphone_lock.acquire(blocking=False):
+            return _jsonl_message("❌ (麥克風正在被其他人使用，請改用文字輸入)")
+        try:
+            stt_result = speech_to_text() 
+        finally:
+            _microphone_lock.release()
+        if not stt_result:
+            return Response(json.dumps({"text": "❌ (未偵測到語音)", "done": True}) + "\n", mimetype='application/jsonlines')
+        user_text, user_audio = stt_result
+        if user_audio is not None:
+            is_master, score = identify_speaker(user_audio)
+            identity_context = "認識的人" if is_master else "陌生訪客"
+
+    # 從這裡開始會用到 Ollama (視覺 / 左腦 / 右腦)：先排隊拿到名額
+    if not _llm_slots.acquire(timeout=LLM_QUEUE_TIMEOUT):
+        return _jsonl_message("❌ 目前使用人數太多，請稍後再試", status=503)
+    release_once = threading.Lock()
+    def release_slot():
+        # 串流結束 / 連線關閉都會呼叫，只歸還一次
+        if release_once.acquire(blocking=False):
+            _llm_slots.release()
+
+    try:
+        return _chat_with_slot(state, user_text, user_audio, identity_context, image_base64, pdf_file, pdf_page,
+                               upload_handle, upload_kind, upload_path, release_slot)
+    except Exception:
+        release_slot()
+        raise
+
+def _chat_with_slot(state, user_text, user_audio, identity_context, image_base64, pdf_file, pdf_page,
+                    upload_handle, upload_kind, upload_path, release_slot):
+    """持有 Ollama 名額時的處理流程；名額在串流結束 (或提早返回) 時歸還"""
+    # --- 分段上傳的檔案 (以代號引用) ---
+    if upload_kind == "image":
+        with open(upload_path, "rb") as f:
+            image_base64 = base64.b64encode(f.read()).decode("utf-8")
+    elif upload_kind == "pdf":
+        try:
+            print(f" 📄 [Web PDF] 使用已上傳的檔案 {upload_handle[:12]}，頁數: {pdf_page}")
+            user_text = process_stored_pdf(upload_handle, pdf_page, user_text)
+        except Exception as e:
+            print(f"PDF 錯誤: {e}")
+            user_text = f"PDF 處理發生錯誤: {str(e)}"
+
+    # --- 圖片處理 ---
+    if image_base64:
+        vision_analysis = process_uploaded_image(image_base64, user_text)
+        user_text = vision_analysis
+        print(" [Web圖片] 已轉換為文字描述")
+
+    # --- PDF 處理 ---
+    if pdf_file:
+        try:
+            pdf_bytes = pdf_file.read() 
+            print(f" 📄 [Web PDF] 接收到檔案，大小: {len(pdf_bytes)/1024/1024:.2f} MB")
+            # pdf_page 可以是 "3" 或 "1-3,5" 這種多頁格式
+            pdf_analysis = process_pdf_pipeline(pdf_bytes, pdf_page, user_text)
+            user_text = pdf_analysis
+        except Exception as e:
+            print(f"PDF 錯誤: {e}")
+            user_text = f"PDF 處理發生錯誤: {str(e)}"
+
+    if "退出" in user_text:
+        release_slot()
+        return Response(json.dumps({"text": "掰掰！", "done": True}) + "\n", mimetype='application/jsonlines')
+
+    # 2. Prompt
+    found_memories = search_memory(user_text, n_results=2)
+    # 多輪 messages：固定前綴在前、這一輪的身份 / 記憶放在最後一則 (token 預算內)
+    chat_messages, _ = build_messages(
+        SYSTEM_PROMPT,
+        state.conversation,
+        identity_context,
+        found_memories,
+        user_text,
+    )
+
+    history_log = "[使用者上傳檔案]" if (image_base64 or pdf_file or upload_kind) else user_text
+    state.append("user", history_log)
+
+    # 3. 雙腦生成
+    try:
+        response_stream = chat_with_dual_brain(chat_messages, user_text)
+    except Exception as e:
+        release_slot()
+        return Response(json.dumps({"text": f"❌ Error: {e}", "done": True}) + "\n", status=500, mimetype='application/jsonlines')
+
+    # 4. 串流回應 (每個請求各自一個 generator，互不影響)
+    def generate_response(stream):
+        try:
+            yield from _stream_reply(stream)
+        finally:
+            # 使用者中途關掉網頁也會走到這裡：關閉 Ollama 串流並歸還名額
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            release_slot()
+
+    def _stream_reply(stream):
+        full_ai_response = ""
+        # 過濾 <think> 區塊 (標籤被切在兩個 chunk 之間也能正確處理)；網頁不需要斷句
+        parser = StreamProcessor(split_sentences=False)
+
+        def visible(events):
+            return "".join(event["text"] for event in events if event["type"] == "text")
+
+        if stream and hasattr(stream, 'iter_lines'):
+            for line in stream.iter_lines():
+                if line:
+                    try:
+                        json_data = json.loads(line.decode('utf-8'))
+                        chunk = json_data.get("message", {}).get("content", "")
+                        
+                        content_to_yield = visible(parser.feed(chunk))
+                        if content_to_yield:
+                            full_ai_response += content_to_yield
+                            yield json.dumps({"text": content_to_yield, "done": False}) + "\n"
+                        if json_data.get("done"): break
+                    except: break
+
+        content_to_yield = visible(parser.flush())
+        if content_to_yield:
+            full_ai_response += content_to_yield
+            yield json.dumps({"text": content_to_yield, "done": False}) + "\n"
+
+        if full_ai_response.strip():
+            state.append("ai", full_ai_response)
+            add_memory(user_text, "User")
+            add_memory(full_ai_response, "AI")
+            yield json.dumps({"text": "", "done": True, "full_text": full_ai_response}) + "\n"
+        else:
+            yield json.dumps({"text": "(AI 無回應)", "done": True}) + "\n"
+
+    response = Response(stream_with_context(generate_response(response_stream)), mimetype='application/jsonlines')
+    # generator 還沒開始就被關閉時 finally 不會執行，這裡再保險一次
+    response.call_on_close(release_slot)
+    return response
+
+# ==============================================================================
+# 📦 分段上傳 API (PDF / 圖片)
+# ==============================================================================
+# 1. POST /upload/init             {"filename", "size"}     -> {"upload_id", "chunk_size"}
+# 2. PUT  /upload/<id>?offset=N    body = 原始二進位 (不要 Base64) -> {"received"}
+#    斷線後 GET /upload/<id> 取得 received，從那個 offset 繼續傳
+# 3. POST /upload/<id>/complete    {"sha256"} (選填)        -> {"handle", "kind", "size"}
+# 之後 /chat 帶 upload_handle=<handle> 即可，不用再傳一次檔案
+
+def _upload_error(e):
+    body = {"error": str(e)}
+    if e.received is not None:
+        body["received"] = e.received
+    return jsonify(body), e.status
+
+@app.route("/upload/init", methods=["POST"])
+def upload_init():
+    data = request.get_json(silent=True) or {}
+    try:
+        upload_id = upload_store.init_upload(data.get("filename", ""), data.get("size"))
+    except upload_store.UploadError as e:
+        return _upload_error(e)
+    return jsonify({"upload_id": upload_id, "chunk_size": upload_store.CHUNK_SIZE})
+
+@app.route("/upload/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    try:
+        offset = int(request.args.get("offset", "0"))
+    except ValueError:
+        return jsonify({"error": "offset 必須是整數"}), 400
+    try:
+        # request.stream 邊收邊寫進磁碟，不經過 form parser
+        received = upload_store.write_chunk(upload_id, offset, request.stream, request.content_length)
+    except upload_store.UploadError as e:
+        return _upload_error(e)
+    return jsonify({"received": received})
+
+@app.route("/upload/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    try:
+        return jsonify(upload_store.get_status(upload_id))
+    except upload_store.UploadError as e:
+        return _upload_error(e)
+
+@app.route("/upload/<upload_id>/complete", methods=["POST"])
+def upload_complete(upload_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(upload_store.complete_upload(upload_id, data.get("sha256")))
+    except upload_store.UploadError as e:
+        return _upload_error(e)
+
+@app.route("/tts", methods=["POST"])
+def generate_audio():
+    """生成音訊檔並傳回 (含防呆檢查)"""
+    data = request.json
+    text_to_speak = data.get("text", "")
+    
+    if not text_to_speak:
+        return jsonify({"error": "No text provided"}), 400
+
+    try:
+        # 呼叫 TTS (只合成不播放，音訊直接在記憶體中回傳，不經過暫存檔)
+        audio_data = text_to_speech(text_to_speak, play=False)
+        
+        if not audio_data:
+            print(f"⚠️ TTS 生成失敗: text_to_speech 回傳了 {type(audio_data)}")
+            return jsonify({"error": "TTS generation failed (Internal Error)"}), 500
+            
+        return Response(audio_data, mimetype="audio/wav")
+        
+    except Exception as e:
+        print(f"❌ TTS 路由發生錯誤: {e}")
+        return jsonify({"error": f"TTS exception: {str(e)}"}), 500
+
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    return jsonify({"error": "檔案太大", "detail": "Server rejected payload (413)"}), 413
+
+if __name__ == "__main__":
+    print("="*50)
+    print(f"🚀 Flask 伺服器啟動中...")
+    print(f"📂 MAX_CONTENT_LENGTH 設定為: {app.config['MAX_CONTENT_LENGTH']}")
+    print(f"🧠 MAX_FORM_MEMORY_SIZE 設定為: {app.config['MAX_FORM_MEMORY_SIZE'] / (1024*1024):.2f} MB")
+    print("="*50)
+    
+    # threaded=True：每個請求一個執行緒，多個學生可以同時使用；Ollama 負載由 _llm_slots 控制
+    app.run(debug=True, port=5000, threaded=True, use_reloader=False)
\ No newline at end of file
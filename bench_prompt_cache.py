@@ -0,0 +1,159 @@
+# bench_prompt_cache.py (測試 Ollama 前綴快取：舊版單一 system prompt vs 固定前綴多輪 messages)
+#
+# 用法: python bench_prompt_cache.py --model qwen2.5:7b --turns 30
+# 需要 Ollama 在本機執行。每一輪會記錄 Ollama 回報的 prompt_eval_count
+# (實際重新計算的 prompt token 數)；前綴命中時這個數字只會包含新增的訊息。
+# 舊對話併入摘要 (或歷史被截掉) 的那幾輪前綴會改變，也算沒命中；輪數要夠多才會遇到。
+
+import argparse
+import datetime
+import sys
+
+import ollama_client
+from prompt_builder import ConversationContext, build_messages, count_tokens, warm_up
+
+SYSTEM_PROMPT = (
+    "你喜歡解數學題目，看到題目會喜歡推導，並擅長使用 WolframAlpha\n"
+    "重要：如果涉及數學公式，請務必使用 LaTeX 格式 (例如 $x^2$) 輸出，以便網頁渲染。"
+)
+
+USER_TURNS = [
+    "幫我算 x^2 + 5x + 6 = 0 的解",
+    "那 x^2 - 4 呢？",
+    "積分 x sin x 怎麼做",
+    "為什麼要用分部積分？",
+    "sin x / x 在 x 趨近 0 的極限是多少",
+    "可以用泰勒展開解釋嗎",
+    "矩陣 [[1,2],[3,4]] 的行列式",
+    "那它的反矩陣呢",
+    "謝謝你，今天先到這裡",
+    "明天再繼續",
+]
+
+FAKE_MEMORIES = [
+    ["[2026-10-01 20:11:02] User: 我下週要考微積分"],
+    ["[2026-10-02 19:40:55] User: 我比較喜歡用圖形理解", "[2026-09-28 21:03:12] AI: 分部積分口訣是 LIATE"],
+    [],
+]
+
+# 每一輪回答只要短短一段，重點是 prompt 的 prefill
+REPLY_OPTIONS = {"temperature": 0.0, "num_predict": 64}
+
+
+def _legacy_messages(history, identity, memories, user_text):
+    """原本的格式：會變的內容放最前面，每輪重新送出兩則訊息"""
+    memory_str = "\n".join(f"- {m}" for m in memories) if memories else "無相關回憶"
+    recent_chat_str = "\n".join(f"{speaker}: {text}" for speaker, text in history[-100:])
+    system_prompt = (
+        "你喜歡解數學題目，看到題目會喜歡推導，並擅長使用 WolframAlpha\n"
+        f"=== 對話場景資訊 ===\n"
+        f"身份: {identity}\n"
+        f"長期記憶:\n{memory_str}\n"
+        f"最近對話:\n{recent_chat_str}\n"
+        "\n重要：如果涉及數學公式，請務必使用 LaTeX 格式 (例如 $x^2$) 輸出，以便網頁渲染。"
+    )
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_text}]
+
+
+def _first_changed(previous_sent, messages):
+    """和上一輪 (送出的 messages + 模型回答) 逐則比對，回傳第一則不同的位置；從那裡開始都需要重新計算"""
+    i = 0
+    while i < len(messages) and i < len(previous_sent) and messages[i] == previous_sent[i]:
+        i += 1
+    return i
+
+
+def run_layout(layout, model, turns):
+    print(f"\n=== {layout} ===")
+    # 摘要用截短串接，避免額外的 LLM 呼叫干擾量測
+    context = ConversationContext(
+        summarizer=lambda prev, msgs: (prev + "\n" + "\n".join(m["text"][:40] for m in msgs))[-400:],
+        model=model,
+    )
+    history = []
+    rows = []
+    previous_sent = []
+
+    for turn in range(1, turns + 1):
+        user_text = USER_TURNS[(turn - 1) % len(USER_TURNS)]
+        identity = f"使用者正在使用文字介面與你交談 ({datetime.datetime.now():%H:%M:%S})"
+        memories = FAKE_MEMORIES[turn % len(FAKE_MEMORIES)]
+        if layout == "stable":
+            messages, _ = build_messages(SYSTEM_PROMPT, context, identity, memories, user_text)
+        else:
+            messages = _legacy_messages(history, identity, memories, user_text)
+        prompt_tokens = sum(count_tokens(m["content"], model) + 4 for m in messages)
+        changed = _first_changed(previous_sent, messages)
+        expected_new = sum(count_tokens(m["content"], model) + 4 for m in messages[changed:])
+        # 上一輪的 messages (最後那則本輪內容除外) + 回答都原封不動才算前綴保留；
+        # 摘要更新或歷史被截掉的那一輪開頭會變
+        prefix_changed = turn > 1 and changed < len(previous_sent) - 2
+
+        response = ollama_client.chat(
+            {"model": model, "messages": messages, "stream": False, "options": REPLY_OPTIONS},
+            timeout=300,
+        )
+        response.raise_for_status()
+        data = response.json()
+        reply = data.get("message", {}).get("content", "")
+        evaluated = data.get("prompt_eval_count", 0)
+        eval_ms = data.get("prompt_eval_duration", 0) / 1e6
+
+        previous_sent = messages + [{"role": "assistant", "content": reply}]
+        context.append("user", user_text)
+        context.append("ai", reply)
+        history.append(("user", user_text))
+        history.append(("ai", reply))
+
+        reused = max(0.0, 1 - evaluated / prompt_tokens) if prompt_tokens else 0.0
+        rows.append((turn, prompt_tokens, evaluated, eval_ms, reused, prefix_changed, expected_new))
+        print(f"第 {turn:2d} 輪: prompt ≈ {prompt_tokens:5d} tokens | 新增 ≈ {expected_new:5d} | 重新計算 {evaluated:5d} tokens | "
+              f"prefill {eval_ms:7.1f} ms | 前綴重用 ≈ {reused:.0%}" + (" (前綴改變)" if prefix_changed else ""))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama prompt prefix cache benchmark")
+    parser.add_argument("--model", default="qwen2.5:7b")
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--layout", choices=["stable", "legacy", "both"], default="both")
+    # 重新計算的 token 數 <= 預期新增 token 數 x (1 + tolerance) + 32 (chat template 的特殊 token) 才算命中
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    # 固定前綴版面允許沒命中的輪數比例 (摘要更新 / 截斷歷史的那幾輪也算)
+    parser.add_argument("--max-miss-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if not ollama_client.is_healthy(force=True):
+        print(f"❌ 連不上 Ollama ({ollama_client.OLLAMA_HOST})")
+        return 1
+
+    # 量測前先把這個模型的 tokenizer 載好，token 數才準
+    warm_up(args.model, wait=True)
+
+    layouts = ["legacy", "stable"] if args.layout == "both" else [args.layout]
+    results = {layout: run_layout(layout, args.model, args.turns) for layout in layouts}
+
+    print("\n=== 總結 ===")
+    for layout, rows in results.items():
+        later = rows[1:]
+        total_eval = sum(r[2] for r in later)
+        total_prompt = sum(r[1] for r in later)
+        total_ms = sum(r[3] for r in later)
+        print(f"{layout:7s}: 第 2 輪起共重新計算 {total_eval} / {total_prompt} tokens, prefill 合計 {total_ms:.0f} ms")
+
+    if "stable" in results:
+        later = results["stable"][1:]
+        changed = [r[0] for r in later if r[5]]
+        not_reused = [r[0] for r in later if not r[5] and r[2] > r[6] * (1 + args.tolerance) + 32]
+        misses = sorted(changed + not_reused)
+        print(f"固定前綴版面: 前綴改變 (摘要 / 截斷) {len(changed)} 輪 {changed}，"
+              f"Ollama 沒有重用 {len(not_reused)} 輪 {not_reused}")
+        if not_reused or len(misses) > len(later) * args.max_miss_ratio:
+            print(f"❌ 固定前綴版面有 {len(misses)} / {len(later)} 輪沒有命中前綴快取")
+            return 1
+        print(f"✅ 固定前綴版面 {len(later) - len(misses)} / {len(later)} 輪命中前綴快取")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
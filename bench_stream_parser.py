@@ -0,0 +1,167 @@
+# bench_stream_parser.py (串流解析器的正確性與吞吐量：舊版 <think> 過濾迴圈 vs StreamProcessor)
+#
+# 用法:
+#   python bench_stream_parser.py                        # 用內建範例合成串流
+#   python bench_stream_parser.py --record out.jsonl     # 向 Ollama 錄一段真實串流
+#   python bench_stream_parser.py --replay out.jsonl     # 重播錄下來的串流 (Ollama /api/chat 的逐行 JSON)
+# 合成模式會把同一段文字切成不同大小的 chunk (含把標籤 / 標點切在中間)，
+# 檢查每種切法解析出來的結果都和一次整段餵入相同。
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from stream_parser import StreamProcessor
+
+SAMPLE_TEXT = (
+    "<think>使用者問的是二次方程式。判別式 b^2-4ac = 25-24 = 1 > 0，所以有兩個實根。"
+    "可以用因式分解：(x+2)(x+3)。</think>\n\n"
+    "這題可以用因式分解！$x^2 + 5x + 6 = (x+2)(x+3) = 0$，所以 $x = -2$ 或 $x = -3$。\n"
+    "驗算一下：代入 $x=-2$，得到 4 - 10 + 6 = 0，正確！需要我再示範公式解嗎？"
+    "「公式解」是 $x = \\frac{-b \\pm \\sqrt{b^2-4ac}}{2a}$；其中 π ≈ 3.14 不會被切開。"
+)
+
+
+def legacy_filter(chunks):
+    """app.py 原本的 <think> 過濾迴圈 (只看單一 chunk，標籤被切開就會漏掉)"""
+    in_think_block = False
+    output = ""
+    for chunk in chunks:
+        temp_chunk = chunk
+        while len(temp_chunk) > 0:
+            if not in_think_block:
+                start_idx = temp_chunk.find("<think>")
+                if start_idx != -1:
+                    output += temp_chunk[:start_idx]
+                    in_think_block = True
+                    temp_chunk = temp_chunk[start_idx + 7:]
+                else:
+                    output += temp_chunk
+                    temp_chunk = ""
+            else:
+                end_idx = temp_chunk.find("</think>")
+                if end_idx != -1:
+                    in_think_block = False
+                    temp_chunk = temp_chunk[end_idx + 8:]
+                else:
+                    temp_chunk = ""
+    return output
+
+
+def run_processor(chunks):
+    """回傳 (可見內容, 推理內容, 句子 list)"""
+    processor = StreamProcessor()
+    events = []
+    for chunk in chunks:
+        events.extend(processor.feed(chunk))
+    events.extend(processor.flush())
+    visible = "".join(e["text"] for e in events if e["type"] == "text")
+    think = "".join(e["text"] for e in events if e["type"] == "think")
+    sentences = [e["text"] for e in events if e["type"] == "sentence"]
+    return visible, think, sentences
+
+
+def chunk_text(text, min_size, max_size, rng):
+    chunks = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(min_size, max_size)
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+def load_recording(path):
+    chunks = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                chunks.append(json.loads(line).get("message", {}).get("content", ""))
+    return chunks
+
+
+def record(path, model, prompt):
+    import ollama_client
+    payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": True}
+    response = ollama_client.chat(payload, stream=True, timeout=300)
+    response.raise_for_status()
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for line in response.iter_lines():
+            if line:
+                f.write(line.decode("utf-8") + "\n")
+                count += 1
+    print(f"💾 已錄下 {count} 個 chunk -> {path}")
+
+
+def throughput(func, chunks, rounds):
+    total_chars = sum(len(c) for c in chunks) * rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(chunks)
+    elapsed = time.perf_counter() - start
+    return total_chars / elapsed / 1e6, elapsed / rounds * 1e3
+
+
+def check_streams(name, streams):
+    """每種切法的結果都要和整段餵入相同；回傳舊版過濾出錯的次數"""
+    reference = run_processor(["".join(streams[0])])
+    legacy_reference = reference[0]
+    legacy_errors = 0
+    for chunks in streams:
+        result = run_processor(chunks)
+        if result != reference:
+            print(f"❌ [{name}] 切法不同結果就不同: {chunks[:8]}...")
+            return None
+        if legacy_filter(chunks) != legacy_reference:
+            legacy_errors += 1
+    return legacy_errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="stream parser benchmark")
+    parser.add_argument("--replay", action="append", default=[], help="錄下來的 Ollama 串流 (JSONL)，可指定多個")
+    parser.add_argument("--record", help="向 Ollama 錄一段串流存到這個路徑後結束")
+    parser.add_argument("--model", default="qwen2.5:7b")
+    parser.add_argument("--prompt", default="請一步一步解 x^2 + 5x + 6 = 0，並說明每一步。")
+    parser.add_argument("--variants", type=int, default=500, help="每段文字隨機切幾種 chunk")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.model, args.prompt)
+        return 0
+
+    rng = random.Random(args.seed)
+    if args.replay:
+        recordings = [(path, load_recording(path)) for path in args.replay]
+    else:
+        # 沒有錄音檔時合成：像 LLM token 一樣 1~6 字一個 chunk
+        recordings = [("synthetic", chunk_text(SAMPLE_TEXT * 20, 1, 6, rng))]
+
+    failed = False
+    for name, chunks in recordings:
+        text = "".join(chunks)
+        streams = [chunks, list(text)] + [chunk_text(text, 1, 12, rng) for _ in range(args.variants)]
+        legacy_errors = check_streams(name, streams)
+        if legacy_errors is None:
+            failed = True
+            continue
+
+        visible, think, sentences = run_processor(chunks)
+        legacy_mbps, legacy_ms = throughput(legacy_filter, chunks, args.rounds)
+        new_mbps, new_ms = throughput(run_processor, chunks, args.rounds)
+        print(f"\n=== {name} ===")
+        print(f"{len(chunks)} chunks / {len(text)} 字 -> 可見 {len(visible)} 字、推理 {len(think)} 字、{len(sentences)} 句")
+        print(f"✅ {len(streams)} 種切法結果一致 (舊版過濾在 {legacy_errors} 種切法下漏掉被切開的標籤)")
+        print(f"舊版過濾      : {legacy_mbps:7.2f} M 字/秒 ({legacy_ms:.3f} ms/串流，不含斷句)")
+        print(f"StreamProcessor: {new_mbps:7.2f} M 字/秒 ({new_ms:.3f} ms/串流，含斷句)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# cache_store.py (SQLite 持久化快取)
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 💾 快取資料夾 (各個工具各自一個 .sqlite3 檔)
+CACHE_DIR = "./cache"
+
+
+class PersistentCache:
+    """
+    簡單的磁碟快取 (SQLite)：
+    - ttl: 存活秒數，過期自動失效 (None = 永不過期)
+    - max_entries: 筆數上限，超過時淘汰「最久沒被讀取」的資料
+    - memory_size: 記憶體 LRU 層的筆數 (0 = 不使用)，熱門資料連磁碟都不用讀
+    - 值以 JSON 儲存，所以只能放 str / list / dict 這類可序列化的東西
+    程式重啟後資料仍然存在；多執行緒共用同一個物件是安全的。
+    """
+
+    def __init__(self, name, ttl=None, max_entries=1000, memory_size=0):
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_size = memory_size
+        self._memory = OrderedDict()  # key -> (value, created)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(os.path.join(CACHE_DIR, f"{name}.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key, count=True):
+        """
+        讀取快取，找不到或已過期時回傳 None。
+        count=False 不計入命中統計 (一次查詢要讀好幾個鍵時，只讓其中一次算數)
+        """
+        now = time.time()
+        with self._lock:
+            # 1. 記憶體 LRU
+            if key in self._memory:
+                value, created = self._memory[key]
+                if self.ttl is None or now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += count
+                    return value
+                del self._memory[key]
+
+            # 2. 磁碟
+            row = self._conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+
+            if row is None:
+                self.misses += count
+                return None
+
+            self._conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += count
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            return value
+
+    def set(self, key, value):
+        """寫入快取，並在超過上限時淘汰最舊的資料"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            if self.ttl is not None:
+                self._conn.execute("DELETE FROM cache WHERE created < ?", (now - self.ttl,))
+
+            count = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+            self._remember(key, value, now)
+
+    def _remember(self, key, value, created):
+        """放進記憶體 LRU 層 (呼叫端需持有 lock)"""
+        if self.memory_size <= 0:
+            return
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        """回傳命中統計 (給 log 或除錯用)"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+        }
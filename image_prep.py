@@ -0,0 +1,166 @@
+# image_prep.py (視覺模型前處理：裁白邊 / 縮圖 / 壓縮)
+
+import base64
+import io
+import math
+import threading
+import time
+
+# Pillow 是選配：沒裝就只去掉 data URL 前綴，原圖照送
+try:
+    from PIL import Image, ImageChops, ImageOps
+except ImportError:
+    Image = None
+
+# ==========================================
+# 🔧 設定區
+# ==========================================
+# qwen2.5-vl 以 28x28 patch 切圖，每個 patch 一個視覺 token；
+# 超過這個像素數只會讓 prefill 變慢，模型看到的細節不會更多
+VISION_PATCH_SIZE = 28
+VISION_MAX_PIXELS = 1600 * VISION_PATCH_SIZE * VISION_PATCH_SIZE   # 約 1.25 MP
+# 像素下限 (qwen2.5-vl 的 min_pixels 概念)：公式截圖這類小圖會放大到這個像素數，
+# 太小的圖上下標和分數線會糊掉
+VISION_MIN_PIXELS = 256 * VISION_PATCH_SIZE * VISION_PATCH_SIZE   # 約 0.2 MP
+# 送出的 JPEG 大小上限 (bytes)，會先降畫質再縮尺寸
+VISION_BYTE_BUDGET = 400 * 1024
+JPEG_QUALITIES = (90, 82, 74, 66)
+# 裁白邊：和背景色差超過這個值才算內容；裁完四周留一點邊
+CROP_DIFF_THRESHOLD = 24
+CROP_PADDING = 16
+
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0, "total_ms": 0.0}
+
+
+def _decode(image_base64):
+    """去掉 data URL 前綴後解碼 (只解一次)"""
+    if image_base64.startswith("data:"):
+        image_base64 = image_base64.split(",", 1)[1]
+    return base64.b64decode(image_base64)
+
+
+def _flatten(img):
+    """轉成 RGB；透明背景鋪白色 (截圖 / PNG 公式常見)"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        return background
+    return img.convert("RGB")
+
+
+def _auto_crop(img):
+    """以四個角落的顏色當背景，裁掉周圍空白"""
+    gray = img.convert("L")
+    w, h = gray.size
+    corners = sorted(gray.getpixel(p) for p in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1)))
+    background = Image.new("L", gray.size, (corners[1] + corners[2]) // 2)
+    mask = ImageChops.difference(gray, background).point(lambda v: 255 if v > CROP_DIFF_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return img
+    left, top, right, bottom = bbox
+    bbox = (max(0, left - CROP_PADDING), max(0, top - CROP_PADDING),
+            min(w, right + CROP_PADDING), min(h, bottom + CROP_PADDING))
+    if bbox == (0, 0, w, h):
+        return img
+    return img.crop(bbox)
+
+
+def _target_size(w, h, max_pixels, min_pixels=None):
+    """
+    縮放後的尺寸 (和 qwen2.5-vl 的 smart_resize 同樣的算法)：
+    像素數已經在 [min_pixels, max_pixels] 內就維持原尺寸；
+    否則依比例縮放 (太大縮小、太小放大)，兩邊再一起對齊 patch 大小，長寬比不變。
+    """
+    if min_pixels is None:
+        min_pixels = VISION_MIN_PIXELS
+    pixels = w * h
+    if min_pixels <= pixels <= max_pixels:
+        return w, h
+    scale = math.sqrt((max_pixels if pixels > max_pixels else min_pixels) / float(pixels))
+    new_w = max(VISION_PATCH_SIZE, round(w * scale / VISION_PATCH_SIZE) * VISION_PATCH_SIZE)
+    new_h = max(VISION_PATCH_SIZE, round(h * scale / VISION_PATCH_SIZE) * VISION_PATCH_SIZE)
+    # 四捨五入後可能稍微超出範圍：縮小時往下取、放大時往上取
+    if new_w * new_h > max_pixels:
+        new_w = max(VISION_PATCH_SIZE, math.floor(w * scale / VISION_PATCH_SIZE) * VISION_PATCH_SIZE)
+        new_h = max(VISION_PATCH_SIZE, math.floor(h * scale / VISION_PATCH_SIZE) * VISION_PATCH_SIZE)
+    elif new_w * new_h < min_pixels:
+        new_w = math.ceil(w * scale / VISION_PATCH_SIZE) * VISION_PATCH_SIZE
+        new_h = math.ceil(h * scale / VISION_PATCH_SIZE) * VISION_PATCH_SIZE
+    return new_w, new_h
+
+
+def _encode_within_budget(img, byte_budget):
+    """先依序降 JPEG 畫質；還是太大就再縮 15% 重來"""
+    while True:
+        for quality in JPEG_QUALITIES:
+            buffered = io.BytesIO()
+            img.save(buffered, format="JPEG", quality=quality, optimize=True)
+            data = buffered.getvalue()
+            if len(data) <= byte_budget:
+                return data, img
+        w, h = img.size
+        if w * h * 0.85 * 0.85 < VISION_MIN_PIXELS:
+            return data, img
+        img = img.resize(_target_size(w, h, w * h * 0.85 * 0.85), Image.LANCZOS)
+
+
+def prepare_image(image_base64, max_pixels=None, byte_budget=None):
+    """
+    給視覺模型前的前處理，回傳新的 Base64 字串 (不含 data URL 前綴)：
+    解碼一次 -> 轉正 (EXIF) -> 裁白邊 -> 縮到模型有效解析度 -> JPEG 壓到 byte_budget 以下
+    已經夠小、也沒有白邊可裁的圖會原樣送出，避免重複壓縮。
+    """
+    if max_pixels is None:
+        max_pixels = VISION_MAX_PIXELS
+    if byte_budget is None:
+        byte_budget = VISION_BYTE_BUDGET
+
+    start_time = time.time()
+    raw = _decode(image_base64)
+    if Image is None:
+        return base64.b64encode(raw).decode("utf-8")
+
+    try:
+        with Image.open(io.BytesIO(raw)) as original:
+            original_size = original.size
+            original_format = original.format
+            img = _auto_crop(_flatten(ImageOps.exif_transpose(original)))
+    except Exception as e:
+        print(f"⚠️ [影像前處理] 無法解碼圖片，原圖照送: {e}")
+        return base64.b64encode(raw).decode("utf-8")
+
+    target = _target_size(img.size[0], img.size[1], max_pixels)
+    untouched = (
+        img.size == original_size
+        and target == img.size
+        and len(raw) <= byte_budget
+        and original_format in ("JPEG", "PNG")
+    )
+    if untouched:
+        data = raw
+    else:
+        if target != img.size:
+            img = img.resize(target, Image.LANCZOS)
+        data, img = _encode_within_budget(img, byte_budget)
+
+    elapsed_ms = (time.time() - start_time) * 1000
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["bytes_in"] += len(raw)
+        _stats["bytes_out"] += len(data)
+        _stats["total_ms"] += elapsed_ms
+    print(f"🪄 [影像前處理] {original_size[0]}x{original_size[1]} {len(raw) / 1024:.0f} KB -> "
+          f"{img.size[0]}x{img.size[1]} {len(data) / 1024:.0f} KB ({elapsed_ms:.0f} ms)")
+    return base64.b64encode(data).decode("utf-8")
+
+
+def get_image_prep_stats():
+    """累計前處理統計 (saved_ratio = 省下的傳輸量比例)"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["saved_ratio"] = 1 - stats["bytes_out"] / stats["bytes_in"] if stats["bytes_in"] else 0.0
+    stats["avg_ms"] = stats["total_ms"] / stats["images"] if stats["images"] else 0.0
+    return stats
@@ -0,0 +1,119 @@
+# intent_router.py (本地意圖路由：決定要不要跑左腦)
+
+import threading
+
+import numpy as np
+
+# 直接沿用記憶系統已經載入的多語言 sentence-transformer，不再額外載入模型
+from memory_chroma import emb_fn
+
+# ==========================================
+# 🔧 設定區
+# ==========================================
+# 信心門檻 (餘弦相似度 0~1)：最像的工具範例超過此值才呼叫左腦
+# 左腦常常沒被叫到 -> 調低；閒聊也一直跑左腦 -> 調高
+INTENT_THRESHOLD = 0.5
+
+# 每個工具的範例句 (中英混合，使用者常見說法)
+TOOL_EXEMPLARS = {
+    "get_current_time": [
+        "現在幾點", "現在幾點了", "今天幾月幾號", "今天星期幾", "現在時間", "what time is it",
+    ],
+    "search_wikipedia": [
+        "什麼是量子力學", "三體問題是什麼", "介紹一下牛頓", "幫我查一下維基百科",
+        "畢氏定理的由來", "歐拉是誰", "what is a group in abstract algebra",
+    ],
+    "ask_wolfram_alpha": [
+        "積分 x平方 sin x", "把 x^2 + 5x + 6 因式分解", "解方程式 2x + 3 = 7", "求 x^3 的導數",
+        "sin x 除以 x 在 x 趨近 0 的極限", "算一下 123 乘 456", "這個矩陣的行列式是多少",
+        "水的密度是多少", "拋體運動 初速度 20m/s 角度 30度", "integrate x^2 from 0 to 1",
+        "幫我算這題", "這題數學怎麼解",
+    ],
+}
+
+# 閒聊範例 (對照組)：比較像這些就不呼叫左腦
+CHAT_EXEMPLARS = [
+    "你好", "早安", "晚安", "謝謝你", "你好可愛", "今天好累喔", "我們來聊天吧",
+    "你喜歡什麼", "哈哈哈好好笑", "你是誰", "我剛剛在打電動", "拜拜",
+]
+
+# 出現這些字樣 (圖片 / PDF 分析結果) 一律交給左腦，不做相似度判斷
+FORCE_TOOL_MARKERS = ["圖片內容分析", "PDF 第"]
+
+_lock = threading.Lock()
+_exemplar_matrix = None   # [N, D] 已正規化的範例向量
+_exemplar_labels = None   # 長度 N，對應的工具名稱 (閒聊為 None)
+
+_stats_lock = threading.Lock()
+_stats = {"total": 0, "routed": 0, "skipped": 0, "forced": 0}
+
+
+def _count(*keys):
+    with _stats_lock:
+        for key in keys:
+            _stats[key] += 1
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _load_exemplars():
+    """第一次使用時把所有範例句一次 batch 編碼，之後重複使用"""
+    global _exemplar_matrix, _exemplar_labels
+    with _lock:
+        if _exemplar_matrix is not None:
+            return
+        texts, labels = [], []
+        for tool_name, examples in TOOL_EXEMPLARS.items():
+            texts.extend(examples)
+            labels.extend([tool_name] * len(examples))
+        texts.extend(CHAT_EXEMPLARS)
+        labels.extend([None] * len(CHAT_EXEMPLARS))
+
+        _exemplar_matrix = _normalize(emb_fn(texts))
+        _exemplar_labels = labels
+
+
+def route_intent(user_text, threshold=None):
+    """
+    判斷使用者這句話可能需要哪個工具。
+    回傳 (工具名稱 或 None, 分數)；None 代表可以直接跳過左腦。
+    """
+    if threshold is None:
+        threshold = INTENT_THRESHOLD
+
+    if any(marker in user_text for marker in FORCE_TOOL_MARKERS):
+        _count("total", "forced", "routed")
+        return "forced", 1.0
+
+    try:
+        _load_exemplars()
+        query = _normalize(emb_fn([user_text]))[0]
+        scores = _exemplar_matrix @ query
+    except Exception as e:
+        # 路由器壞掉時保守一點：照舊交給左腦判斷
+        print(f"⚠️ [路由] 相似度計算失敗，改由左腦判斷: {e}")
+        _count("total", "routed")
+        return "unknown", 0.0
+
+    best_idx = int(np.argmax(scores))
+    best_label = _exemplar_labels[best_idx]
+    best_score = float(scores[best_idx])
+
+    if best_label is not None and best_score >= threshold:
+        _count("total", "routed")
+        return best_label, best_score
+
+    _count("total", "skipped")
+    return None, best_score
+
+
+def get_router_stats():
+    """路由統計：skip_rate 越高代表省下越多次左腦呼叫"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["skip_rate"] = stats["skipped"] / stats["total"] if stats["total"] else 0.0
+    return stats
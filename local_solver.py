@@ -0,0 +1,427 @@
+# local_solver.py (SymPy 本地解題：WolframAlpha 前的快速通道)
+
+import json
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import sympy
+
+# ==========================================
+# 🔧 設定區
+# ==========================================
+# 每題的計算時間上限 (秒)；超過就砍掉子行程，改交給 WolframAlpha
+LOCAL_SOLVER_TIME_BUDGET = 3.0
+# 子行程啟動 (載入 sympy) 的等待上限，不計入上面的時間預算
+LOCAL_SOLVER_STARTUP_TIMEOUT = 30.0
+
+# 算式由下面的小 parser 直接組成 SymPy 物件，不會 eval 任何字串 (查詢是工具模型寫的)：
+# 只認得數字、字母變數、白名單函數和 + - * / ^ ( ) , !，其他字元 (_ . 引號 ...) 一律拒絕
+_CONSTANTS = {
+    "e": sympy.E, "pi": sympy.pi,
+    "inf": sympy.oo, "infinity": sympy.oo, "oo": sympy.oo,
+}
+_FUNCTIONS = {
+    "sin": sympy.sin, "cos": sympy.cos, "tan": sympy.tan, "cot": sympy.cot, "sec": sympy.sec, "csc": sympy.csc,
+    "asin": sympy.asin, "acos": sympy.acos, "atan": sympy.atan,
+    "arcsin": sympy.asin, "arccos": sympy.acos, "arctan": sympy.atan,
+    "sinh": sympy.sinh, "cosh": sympy.cosh, "tanh": sympy.tanh,
+    "log": sympy.log, "ln": sympy.log, "exp": sympy.exp, "sqrt": sympy.sqrt, "abs": sympy.Abs,
+}
+_TOKEN_PATTERN = re.compile(r"\s*(?:(\d+\.\d*|\.\d+|\d+)|([a-z][a-z0-9]*)|(\*\*|[-+*/^(),!]))")
+_CHAR_REPLACEMENTS = {"−": "-", "×": "*", "÷": "/", "²": "^2", "³": "^3", "π": "pi", "∞": "oo", "→": "->"}
+
+# 各類題型的句型 (輸入已轉小寫、空白已整理)
+_SIMPLE_PATTERN = re.compile(r"^(simplify|factor|expand)\s+(.+)$")
+_SOLVE_PATTERN = re.compile(r"^solve\s+(.+?)(?:\s+for\s+([a-z]))?$")
+_INTEGRATE_PATTERN = re.compile(
+    r"^(?:integrate|integral of|integral|∫)\s+(.+?)(?:\s*d([a-z]))?(?:\s+from\s+(.+?)\s+to\s+(.+))?$"
+)
+_DIFF_PATTERN = re.compile(
+    r"^(?:differentiate|derivative of|derivative|d/d([a-z]))\s+(.+?)(?:\s+(?:with respect to|wrt)\s+([a-z]))?$"
+)
+_LIMIT_PATTERN = re.compile(
+    r"^(?:limit of|limit|lim)\s+(.+?)\s+as\s+([a-z])\s*(?:->|approaches|to)\s*(.+)$"
+)
+_SERIES_PATTERN = re.compile(
+    r"^(?:taylor series of|taylor series|maclaurin series of|series of|series)\s+(.+?)"
+    r"(?:\s+(?:at|around|about)\s+([a-z])\s*=\s*(.+?))?(?:\s+(?:to order|up to order|order)\s+(\d+))?$"
+)
+
+
+class _ParseError(ValueError):
+    pass
+
+
+class _ExpressionParser:
+    """
+    遞迴下降 parser：支援省略乘號 (2x、(x+1)(x-1))、^ 與 ** 次方、
+    sin x 這種省略括號的函數、階乘 !。
+    不是白名單函數的名字一律當變數，後面接括號視為相乘。
+    """
+
+    def __init__(self, text):
+        self.tokens = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            match = _TOKEN_PATTERN.match(text, pos)
+            if not match:
+                raise _ParseError(text[pos:])
+            number, name, op = match.groups()
+            if number:
+                self.tokens.append(("num", number))
+            elif name:
+                self.tokens.append(("name", name))
+            else:
+                self.tokens.append(("op", "^" if op == "**" else op))
+            pos = match.end()
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _take(self, value=None):
+        kind, token = self._peek()
+        if kind is None or (value is not None and token != value):
+            raise _ParseError(token)
+        self.pos += 1
+        return kind, token
+
+    def parse(self):
+        result = self._expression()
+        if self.pos != len(self.tokens):
+            raise _ParseError(self._peek()[1])
+        return result
+
+    def _expression(self):
+        result = self._term()
+        while self._peek() in (("op", "+"), ("op", "-")):
+            _, op = self._take()
+            right = self._term()
+            result = result + right if op == "+" else result - right
+        return result
+
+    def _term(self):
+        result = self._unary()
+        while True:
+            kind, token = self._peek()
+            if kind == "op" and token in ("*", "/"):
+                self._take()
+                right = self._unary()
+                result = result * right if token == "*" else result / right
+            elif kind in ("num", "name") or (kind, token) == ("op", "("):
+                result = result * self._unary()   # 省略的乘號
+            else:
+                return result
+
+    def _unary(self):
+        if self._peek() in (("op", "-"), ("op", "+")):
+            _, op = self._take()
+            operand = self._unary()
+            return -operand if op == "-" else operand
+        return self._power()
+
+    def _power(self):
+        result = self._postfix()
+        if self._peek() == ("op", "^"):
+            self._take("^")
+            result = result ** self._unary()
+        return result
+
+    def _postfix(self):
+        result = self._primary()
+        while self._peek() == ("op", "!"):
+            self._take("!")
+            result = sympy.factorial(result)
+        return result
+
+    def _primary(self):
+        kind, token = self._take()
+        if kind == "num":
+            return sympy.Float(token) if "." in token else sympy.Integer(token)
+        if kind == "name":
+            if token in _FUNCTIONS:
+                func = _FUNCTIONS[token]
+                if self._peek() != ("op", "("):
+                    return func(self._power())   # sin x、ln x^2
+                self._take("(")
+                args = [self._expression()]
+                while self._peek() == ("op", ","):
+                    self._take(",")
+                    args.append(self._expression())
+                self._take(")")
+                return func(*args)
+            if token in _CONSTANTS:
+                return _CONSTANTS[token]
+            return sympy.Symbol(token)
+        if token == "(":
+            inner = self._expression()
+            self._take(")")
+            return inner
+        raise _ParseError(token)
+
+
+def _parse(text):
+    return _ExpressionParser(text).parse()
+
+
+def _pick_variable(expr, name=None):
+    """指定變數優先；否則有 x 用 x，沒有就取第一個自由變數"""
+    if name:
+        return sympy.Symbol(name)
+    symbols = sorted(expr.free_symbols, key=lambda s: s.name)
+    if not symbols:
+        return None
+    for s in symbols:
+        if s.name == "x":
+            return s
+    return symbols[0]
+
+
+def _parse_equation(text):
+    if "=" in text:
+        lhs, rhs = text.split("=", 1)
+        return sympy.Eq(_parse(lhs), _parse(rhs))
+    return sympy.Eq(_parse(text), 0)
+
+
+def _solve_single(equation, var):
+    """
+    單一方程式用 solveset 求「完整」解集合 (sympy.solve 對 sin(x)=0 只給 [0, pi])：
+    週期解會是 ImageSet，例如 {2nπ | n ∈ Z} ∪ {2nπ + π | n ∈ Z}。
+    先找實數解，沒有實數解再找複數解；solveset 也解不完 (ConditionSet) 就交給 WolframAlpha。
+    """
+    solutions = sympy.solveset(equation, var, domain=sympy.S.Reals)
+    domain = "Reals"
+    if solutions is sympy.S.EmptySet:
+        solutions = sympy.solveset(equation, var, domain=sympy.S.Complexes)
+        domain = "Complexes"
+    if solutions is sympy.S.EmptySet or solutions.has(sympy.ConditionSet):
+        return None
+    return f"solveset({sympy.sstr(equation)}, {var}, domain={domain})", solutions
+
+
+def _solve(query):
+    """在目前行程內計算；看不懂或算不出來就回傳 None"""
+    text = query.lower().strip()
+    for old, new in _CHAR_REPLACEMENTS.items():
+        text = text.replace(old, new)
+    text = " ".join(text.split())
+
+    match = _SIMPLE_PATTERN.match(text)
+    if match:
+        op, expr_text = match.groups()
+        expr = _parse(expr_text)
+        func = {"simplify": sympy.simplify, "factor": sympy.factor, "expand": sympy.expand}[op]
+        return f"{op}({sympy.sstr(expr)})", func(expr)
+
+    match = _SOLVE_PATTERN.match(text)
+    if match:
+        eq_text, var_name = match.groups()
+        equations = [_parse_equation(part) for part in re.split(r",|\s+and\s+", eq_text) if part.strip()]
+        if var_name:
+            unknowns = [sympy.Symbol(var_name)]
+        else:
+            unknowns = sorted(set().union(*(eq.free_symbols for eq in equations)), key=lambda s: s.name)
+        if not unknowns:
+            return None
+        if len(equations) == 1 and len(unknowns) == 1:
+            return _solve_single(equations[0], unknowns[0])
+        # 聯立方程式：sympy.solve 對三角 / 超越方程只會回傳部分解，只處理多項式
+        if not all((eq.lhs - eq.rhs).is_polynomial(*unknowns) for eq in equations):
+            return None
+        solutions = sympy.solve(equations, unknowns, dict=True)
+        if not solutions:
+            return None
+        return f"solve({sympy.sstr(equations)}, {sympy.sstr(unknowns)})", solutions
+
+    match = _INTEGRATE_PATTERN.match(text)
+    if match:
+        expr_text, var_name, lower, upper = match.groups()
+        expr = _parse(expr_text)
+        var = _pick_variable(expr, var_name)
+        if var is None:
+            return None
+        if lower is not None:
+            result = sympy.integrate(expr, (var, _parse(lower), _parse(upper)))
+            label = f"integrate({sympy.sstr(expr)}, ({var}, {lower}, {upper}))"
+        else:
+            result = sympy.integrate(expr, var)
+            label = f"integrate({sympy.sstr(expr)}, {var})"
+        if result.has(sympy.Integral):
+            return None
+        return label, result
+
+    match = _DIFF_PATTERN.match(text)
+    if match:
+        var_prefix, expr_text, var_suffix = match.groups()
+        expr = _parse(expr_text)
+        var = _pick_variable(expr, var_prefix or var_suffix)
+        if var is None:
+            return None
+        return f"diff({sympy.sstr(expr)}, {var})", sympy.diff(expr, var)
+
+    match = _LIMIT_PATTERN.match(text)
+    if match:
+        expr_text, var_name, point_text = match.groups()
+        expr = _parse(expr_text)
+        result = sympy.limit(expr, sympy.Symbol(var_name), _parse(point_text))
+        if result.has(sympy.Limit):
+            return None
+        return f"limit({sympy.sstr(expr)}, {var_name}, {point_text})", result
+
+    match = _SERIES_PATTERN.match(text)
+    if match:
+        expr_text, var_name, point_text, order = match.groups()
+        expr = _parse(expr_text)
+        var = _pick_variable(expr, var_name)
+        if var is None:
+            return None
+        point = _parse(point_text) if point_text else 0
+        n = int(order) if order else 6
+        return f"series({sympy.sstr(expr)}, {var}, {point}, {n})", sympy.series(expr, var, point, n)
+
+    return None
+
+
+def solve_locally(query):
+    """
+    直接在目前行程用 SymPy 解題 (沒有時間限制，給子行程或測試用)。
+    成功回傳格式化後的文字，否則回傳 None。
+    """
+    try:
+        solved = _solve(query)
+    except Exception:
+        return None
+    if solved is None:
+        return None
+
+    label, result = solved
+    try:
+        latex = sympy.latex(result)
+    except Exception:
+        latex = ""
+
+    parts = [
+        "【SymPy 本地計算結果】\n",
+        f"--- Input ---\n{label}\n",
+        f"--- Result ---\n{sympy.sstr(result)}\n",
+    ]
+    if latex:
+        parts.append(f"--- LaTeX ---\n{latex}\n")
+    return "\n".join(parts)
+
+
+# ==========================================
+# 🧵 子行程：真正能「砍掉」超時的計算
+# ==========================================
+# 執行緒沒辦法強制中止，sympy 卡在大積分時會一直佔住 CPU，
+# 所以計算放在常駐子行程，超時就 kill 掉，下次再重新啟動。
+
+class _SolverWorker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._proc = None
+        self._lines = None
+
+    def _start(self):
+        self._proc = subprocess.Popen(
+            [sys.executable, "-u", __file__, "--worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+        )
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_lines, args=(self._proc, self._lines), daemon=True).start()
+
+        # 等子行程載入 sympy 完成 (不計入解題時間預算)
+        ready = self._lines.get(timeout=LOCAL_SOLVER_STARTUP_TIMEOUT)
+        if ready is None:
+            raise RuntimeError("local solver worker exited during startup")
+
+    @staticmethod
+    def _read_lines(proc, lines):
+        for line in proc.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    def _kill(self):
+        if self._proc is not None:
+            self._proc.kill()
+        self._proc = None
+
+    def ensure_started(self):
+        with self._lock:
+            if self._proc is None or self._proc.poll() is not None:
+                self._start()
+
+    def solve(self, query, budget):
+        if not self._lock.acquire(timeout=budget):
+            return None
+        try:
+            if self._proc is None or self._proc.poll() is not None:
+                self._start()
+
+            self._proc.stdin.write(json.dumps({"query": query}) + "\n")
+            self._proc.stdin.flush()
+            try:
+                line = self._lines.get(timeout=budget)
+            except queue.Empty:
+                print(f"⏰ [SymPy] 超過 {budget} 秒，中止本地計算")
+                self._kill()
+                return None
+            if line is None:
+                self._kill()
+                return None
+            return json.loads(line).get("result")
+        except Exception as e:
+            print(f"⚠️ [SymPy] 本地計算子行程錯誤: {e}")
+            self._kill()
+            return None
+        finally:
+            self._lock.release()
+
+
+_worker = _SolverWorker()
+
+
+def warm_up():
+    """背景啟動子行程，讓第一題不用等 sympy 載入"""
+    def _run():
+        try:
+            _worker.ensure_started()
+        except Exception as e:
+            print(f"⚠️ [SymPy] 本地解題器啟動失敗: {e}")
+    threading.Thread(target=_run, daemon=True).start()
+
+
+def solve_with_budget(query, budget=None):
+    """在時間預算內本地解題；失敗、看不懂或超時都回傳 None (呼叫端改用 WolframAlpha)"""
+    if budget is None:
+        budget = LOCAL_SOLVER_TIME_BUDGET
+    start_time = time.time()
+    result = _worker.solve(query, budget)
+    if result:
+        print(f"⚡ [SymPy] 本地解題成功，耗時 {(time.time() - start_time) * 1000:.0f} ms")
+    return result
+
+
+def _worker_loop():
+    """子行程主迴圈：一行 JSON 進、一行 JSON 出"""
+    print(json.dumps({"ready": True}), flush=True)
+    for line in sys.stdin:
+        try:
+            query = json.loads(line).get("query", "")
+        except json.JSONDecodeError:
+            query = ""
+        print(json.dumps({"result": solve_locally(query)}), flush=True)
+
+
+if __name__ == "__main__" and "--worker" in sys.argv:
+    _worker_loop()
@@ -1,474 +1,918 @@
-# tool_registry.py
-import inspect
-import json
-import functools
-from pdf2image import convert_from_bytes # 新增：PDF 轉圖片庫
-import base64
-import fitz 
-
-# 儲存工具定義 (給 Ollama 看)
-TOOLS_SCHEMA = []
-# 儲存實際函數 (給 Python 執行)
-TOOLS_MAPPING = {}
-
-def get_type_name(t):
-    """將 Python type 轉為 JSON schema type"""
-    if t == str: return "string"
-    if t == int: return "integer"
-    if t == float: return "number"
-    if t == bool: return "boolean"
-    return "string" # 預設
-
-def register_tool(func):
-    """
-    這是一個裝飾器 (@register_tool)。
-    只要掛在函數上，就會自動讀取函數的名稱、參數和註解，
-    生成 Ollama 需要的 JSON Schema。
-    """
-    # 1. 取得函數資訊
-    func_name = func.__name__
-    doc = func.__doc__.strip() if func.__doc__ else "無描述"
-    sig = inspect.signature(func)
-    
-    # 2. 構建參數 Schema
-    properties = {}
-    required = []
-    
-    for param_name, param in sig.parameters.items():
-        # 忽略 self, cls 等參數 (如果有)
-        if param_name in ['self', 'cls']: continue
-        
-        # 取得參數型別 (預設為 str)
-        param_type = param.annotation if param.annotation != inspect.Parameter.empty else str
-        
-        # 嘗試從 docstring 或是簡單設定描述 (這裡簡化處理，不強制解析 docstring 中的參數說明)
-        # 如果您想要更完美的描述，建議參數名稱取直觀一點
-        
-        properties[param_name] = {
-            "type": get_type_name(param_type),
-            "description": f"Parameter: {param_name}" 
-        }
-        
-        # 如果沒有預設值，就是必填
-        if param.default == inspect.Parameter.empty:
-            required.append(param_name)
-
-    # 3. 組合完整的 Tool Definition
-    tool_def = {
-        "type": "function",
-        "function": {
-            "name": func_name,
-            "description": doc,
-            "parameters": {
-                "type": "object",
-                "properties": properties,
-                "required": required
-            }
-        }
-    }
-    
-    # 4. 註冊
-    TOOLS_SCHEMA.append(tool_def)
-    TOOLS_MAPPING[func_name] = func
-    
-    print(f"🔧 [系統] 已註冊工具: {func_name}")
-    
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        return func(*args, **kwargs)
-    return wrapper
-
-def execute_tool(tool_name, arguments):
-    """通用執行入口"""
-    func = TOOLS_MAPPING.get(tool_name)
-    if not func:
-        return f"錯誤: 找不到工具 '{tool_name}'"
-    
-    try:
-        # 處理參數格式 (有時是 JSON 字串，有時是 dict)
-        if isinstance(arguments, str):
-            args = json.loads(arguments)
-        else:
-            args = arguments or {}
-            
-        print(f"⚙️ [執行工具] {tool_name} | 參數: {args}")
-        return func(**args)
-    except Exception as e:
-        return f"執行工具發生錯誤: {e}"
-    
-
-    # mcp_handler.py
-import datetime
-import requests
-
-
-# === 您的工具定義區 (盡情發揮！) ===
-
-@register_tool
-def get_current_time():
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    return f"現在時間: {now}"
-
-def _analyze_image_with_ollama(image_base64, instruction=""):
-    """
-    內部共用函數：將 Base64 圖片發送給 Ollama 視覺模型
-    """
-    # 針對 Moondream 優化 Prompt
-    final_prompt = "Describe this image." 
-    if instruction:
-        final_prompt = f"Describe this image. Focus on: {instruction}"
-
-    payload = {
-        "model": VISION_MODEL,
-        "prompt": final_prompt,
-        "images": [image_base64],
-        "stream": False,
-        "options": {"num_predict": 4096} # 限制輸出長度
-    }
-
-    try:
-        response = requests.post(OLLAMA_API_URL, json=payload, timeout=30)
-        if response.status_code == 200:
-            result = response.json()
-            description = result.get("response", "").strip()
-            return description
-        else:
-            return f"Error: Vision model returned status {response.status_code}"
-    except Exception as e:
-        return f"Error: Connection failed {e}"
-
-def process_uploaded_image(image_base64, user_text):
-    """
-    給網頁上傳專用的函數
-    """
-    print(f"🖼️ [系統] 收到網頁上傳圖片，正在分析...")
-    description = _analyze_image_with_ollama(image_base64, user_text)
-    
-    return (
-        f"【使用者上傳了一張圖片】\n"
-        f"視覺模型描述(英文): {description}\n"
-        f"----------------------------------\n"
-        f"使用者問題: {user_text}\n"
-        f"(請根據圖片描述回答使用者的問題)"
-    )
-
-from duckduckgo_search import DDGS
-
-
-# --- 設定區 ---
-# 建議使用 moondream (快且準) 或 qwen2.5vl
-VISION_MODEL = "qwen2.5vl:3b" 
-OLLAMA_API_URL = "http://127.0.0.1:11434/api/generate"
-
-def _capture_window_to_base64():
-    """內部函數：截取當前活動視窗並轉為 Base64"""
-    try:
-        screenshot = None
-        
-        # 嘗試鎖定當前視窗
-        if gw:
-            active_window = gw.getActiveWindow()
-            if active_window:
-                # 加一點邊距修正，避免切到邊框陰影
-                screenshot = pyautogui.screenshot(region=(
-                    active_window.left, 
-                    active_window.top, 
-                    active_window.width, 
-                    active_window.height
-                ))
-                print(f"📸 [視覺] 已鎖定視窗: {active_window.title}")
-        
-        # 如果無法鎖定視窗或沒有安裝 gw，則全螢幕截圖
-        if screenshot is None:
-            print("⚠️ 無法鎖定視窗，進行全螢幕截圖。")
-            screenshot = pyautogui.screenshot()
-
-        # 圖片縮放 (Moondream 不需要太大張，512x512 效果最佳且快)
-        screenshot.thumbnail((512, 512))
-        
-        buffered = io.BytesIO()
-        screenshot.save(buffered, format="JPEG", quality=85)
-        img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        return img_str
-        
-    except Exception as e:
-        print(f"❌ 截圖失敗: {e}")
-        return None
-
-#@register_tool
-def look_at_screen(instruction: str = "描述畫面"):
-    """
-    (System Action) 視覺能力：觀看使用者的電腦螢幕。
-    當用戶說「你看」、「這張圖」、「畫面」時，【必須】使用此工具。
-    instruction: (選填) 重點，例如 "這張圖" 或 "翻譯文字"。
-    """
-    print(f"👀 [視覺] 正在觀察: {instruction} ...")
-    
-    image_base64 = _capture_window_to_base64()
-    if not image_base64:
-        return "錯誤：無法截取畫面。"
-
-    # 針對 Moondream 優化 Prompt
-    # Moondream 對英文指令反應較好
-    final_prompt = f"Describe this image briefly. Focus on: {instruction}"
-    if VISION_MODEL == "moondream":
-        final_prompt = "Describe this image." # Moondream 喜歡簡單指令
-
-    payload = {
-        "model": VISION_MODEL,
-        "prompt": final_prompt,
-        "images": [image_base64],
-        "stream": False,
-        "options": {
-            "num_predict": 100, # 限制輸出長度，避免廢話
-            "repeat_penalty": 1.2
-        }
-    }
-
-    try:
-        # 直接呼叫 Ollama API (獨立於主對話模型)
-        response = requests.post(OLLAMA_API_URL, json=payload, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            description = result.get("response", "").strip()
-            
-            print(f"👀 [視覺結果]: {description[:100]}...")
-            
-            # 回傳給主模型 (Qwen/DeepSeek) 讓它翻譯並吐槽
-            return (
-                f"【視覺模組回傳的畫面描述 (英文)】\n{description}\n"
-                f"(請根據以上描述，假裝是你親眼看到的，用中文回答用戶問題: '{instruction}')"
-            )
-        else:
-            return f"視覺模型錯誤: {response.status_code}"
-            
-    except Exception as e:
-        return f"視覺連線失敗: {e} (請確認 ollama pull {VISION_MODEL} 已執行)"
-    
-import wikipedia
-try:
-    wikipedia.set_lang("zh")
-except:
-    print("設定維基百科語言失敗，預設使用英文")
-
-@register_tool
-def search_wikipedia(query: str):
-    """
-    (System Action) 查詢維基百科 (Wikipedia)。
-    適用情境：
-    1. 用戶詢問「定義」類問題 (例如: 什麼是量子力學? 什麼是三體問題?)。
-    2. 查詢歷史事件、人物介紹、科學名詞。
-    3. 當 search_web (搜尋引擎) 資訊太雜亂時，使用此工具可獲得精準定義。
-    """
-    print(f"📖 [Wiki] 正在查閱: {query} ...")
-    
-    try:
-        # 1. 搜尋條目 (Search)
-        search_results = wikipedia.search(query)
-        
-        if not search_results:
-            return "維基百科找不到相關條目。"
-        
-        # 2. 獲取最接近的頁面摘要 (Summary)
-        # sentences=3 表示只抓前 3 句，避免內容太長爆字數
-        # auto_suggest=False 避免它自作聰明跳轉到錯誤頁面
-        try:
-            summary = wikipedia.summary(search_results[0], sentences=3, auto_suggest=False)
-            page_url = wikipedia.page(search_results[0], auto_suggest=False).url
-            
-            return (
-                f"【維基百科摘要 - {search_results[0]}】\n"
-                f"{summary}\n"
-                f"(來源: {page_url})"
-            )
-            
-        except wikipedia.exceptions.DisambiguationError as e:
-            # 如果這個詞有歧義 (例如 'Joker' 可以是電影、撲克牌、蝙蝠俠反派)
-            options = e.options[:5] # 只列出前 5 個選項
-            return f"這個詞有多種含義，請告訴我您是指哪一個：\n" + ", ".join(options)
-            
-        except wikipedia.exceptions.PageError:
-            return "找不到該具體頁面的內容。"
-
-    except Exception as e:
-        return f"維基百科查詢失敗: {e}"
-    
-
-
-    import sys
-import io
-import contextlib
-
-# 引入數學庫供 exec 使用
-import math
-import sympy
-import numpy as np
-import xml.etree.ElementTree as ET 
-WOLFRAM_APP_ID = 'TJE5A4WK2V'
-@register_tool
-def ask_wolfram_alpha(query: str):
-    """
-    (System Action) 使用 WolframAlpha 計算引擎解決數學、科學、物理、化學應用題。
-    
-    Args:
-        query: 要查詢的問題。
-        
-        🚨【重要指令 / IMPORTANT INSTRUCTION】🚨
-        WolframAlpha 只看懂英文！WolframAlpha ONLY understands ENGLISH!
-        如果用戶的問題是中文，你必須先將其「翻譯成英文關鍵字」後再傳入此參數。
-        不要傳入整句中文，請提取物理/數學關鍵字。
-
-        【範例 / Examples】:
-        - 用戶: "積分 x平方 sin x" 
-          -> 你的參數 query="integrate x^2 sin(x)"
-        - 用戶: "拋體運動 初速度 20m/s 角度 30度" 
-          -> 你的參數 query="projectile motion v0=20m/s angle=30 deg"
-        - 用戶: "水的密度"
-          -> 你的參數 query="density of water"
-        - 用戶: "把 x^2 + 5x + 6 因式分解"
-          -> 你的參數 query="factor x^2 + 5x + 6"
-    """
-    # 這裡的代碼不需要大改，因為翻譯工作已經由 LLM 在呼叫前完成了
-    # 我們只需要保留原本的邏輯即可
-    
-    print(f"🐺 [Wolfram] 正在計算 (Arg): {query}")
-    
-    if "YOUR_WOLFRAM_APP_ID" in WOLFRAM_APP_ID:
-        return "錯誤: 請先在 mcp_handler.py 設定 WOLFRAM_APP_ID"
-
-    # 使用 Full Results API (v2/query)
-    api_url = "http://api.wolframalpha.com/v2/query" 
-    
-    params = {
-        "appid": WOLFRAM_APP_ID,
-        "input": query, 
-        "units": "metric",
-        "format": "plaintext",
-        "output": "xml",
-        "podstate": "Step-by-step solution" 
-    }
-
-    try:
-        response = requests.get(api_url, params=params, timeout=None) # 延長一點時間給複雜運算
-        
-        if response.status_code == 200:
-            root = ET.fromstring(response.text)
-            
-            if root.attrib.get('success') != 'true':
-                didyoumeans = root.findall('.//didyoumean')
-                suggestions = [d.text for d in didyoumeans if d.text]
-                msg = "WolframAlpha 無法理解此問題 (可能翻譯不夠精準)。"
-                if suggestions:
-                    msg += f" 建議嘗試搜尋: {', '.join(suggestions)}"
-                return msg
-            
-            result_parts = []
-            
-            for pod in root.findall('.//pod'):
-                title = pod.attrib.get('title', 'Result')
-                
-                subpod_texts = []
-                for subpod in pod.findall('.//subpod'):
-                    plaintext = subpod.find('plaintext')
-                    if plaintext is not None and plaintext.text:
-                        text = plaintext.text.strip()
-                        if text:
-                            subpod_texts.append(text)
-                
-                if subpod_texts:
-                    content = "\n".join(subpod_texts)
-                    result_parts.append(f"--- {title} ---\n{content}\n")
-                        
-            if not result_parts:
-                return "WolframAlpha 執行成功，但未返回文字結果 (可能是純圖片)。"
-
-            combined_result = "【WolframAlpha 分析結果】\n\n" + "\n".join(result_parts)
-            return combined_result 
-
-        else:
-            return f"WolframAlpha API Error: {response.status_code}"
-            
-    except Exception as e:
-        return f"WolframAlpha Connection Failed: {e}"
-    
-def _analyze_image_with_ollama(image_base64, instruction=""):
-    """內部共用函數：將 Base64 圖片發送給 Ollama 視覺模型"""
-    final_prompt = (
-        "Please explicitly read and transcribe all text, numbers, and mathematical formulas in this image. "
-        "Do not summarize; provide the full content verbatim."
-    )
-    if instruction:
-        final_prompt += f" Focus on: {instruction}"
-
-    payload = {
-        "model": VISION_MODEL,
-        "prompt": final_prompt,
-        "images": [image_base64],
-        "stream": False,
-        "options": {"num_predict": 512} 
-    }
-
-    try:
-        response = requests.post(OLLAMA_API_URL, json=payload, timeout=None)
-        if response.status_code == 200:
-            return response.json().get("response", "").strip()
-        else:
-            return f"Error: Vision model status {response.status_code}"
-    except Exception as e:
-        return f"Error: Connection failed {e}"
-
-def process_uploaded_image(image_base64, user_text):
-    """給網頁上傳圖片專用"""
-    print(f"🖼️ [系統] 正在分析圖片...")
-    description = _analyze_image_with_ollama(image_base64, user_text)
-    print(description)
-    return f"【圖片內容分析】\n{description}\n---\n使用者問題: {user_text}"
-
-def process_pdf_pipeline(pdf_bytes, page_num, user_text):
-    """
-    新增：處理 PDF 檔案 (使用 PyMuPDF/fitz 引擎)
-    1. 將 PDF 的指定頁面 (page_num) 轉為圖片
-    2. 呼叫視覺模型分析該圖片
-    """
-    print(f"📄 [系統] 正在處理 PDF 第 {page_num} 頁...")
-    
-    if not fitz:
-        return "錯誤：伺服器缺少 pymupdf 套件。請執行 `pip install pymupdf`。"
-
-    try:
-        # 使用 fitz 開啟 PDF 串流
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        # 檢查頁碼 (注意：page_num 是從 1 開始，但 fitz 是從 0 開始)
-        total_pages = len(doc)
-        if page_num < 1 or page_num > total_pages:
-            return f"錯誤：PDF 只有 {total_pages} 頁，您要求的第 {page_num} 頁超出範圍。"
-
-        # 載入頁面 (0-indexed)
-        page = doc.load_page(page_num - 1)
-        
-        # 轉為圖片 (Pixmap)
-        # dpi=150 通常對於文字辨識已經足夠，若太模糊可調高到 300
-        pix = page.get_pixmap(dpi=300)
-        
-        # 轉為 bytes (JPEG 格式)
-        img_bytes = pix.tobytes("jpeg")
-        
-        # 轉為 Base64
-        img_base64 = base64.b64encode(img_bytes).decode("utf-8")
-        
-        # 呼叫視覺分析
-        description = _analyze_image_with_ollama(img_base64, user_text)
-        
-        return (
-            f"【PDF 第 {page_num} 頁內容分析】\n"
-            f"{description}\n"
-            f"----------------------------------\n"
-            f"使用者問題: {user_text}\n"
-            f"(請根據以上 PDF 頁面內容進行數學解題)"
-        )
-        
-    except Exception as e:
-        print(f"PDF 處理失敗: {e}")
-        return f"PDF 讀取失敗: {e}"
\ No newline at end of file
+# tool_registry.py
+import inspect
+import json
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from cache_store import PersistentCache
+import pdf_store
+import vision_cache
+import image_prep
+from pdf2image import convert_from_bytes # 新增：PDF 轉圖片庫
+import base64
+import fitz 
+
+# 儲存工具定義 (給 Ollama 看)
+TOOLS_SCHEMA = []
+# 儲存實際函數 (給 Python 執行)
+TOOLS_MAPPING = {}
+
+def get_type_name(t):
+    """將 Python type 轉為 JSON schema type"""
+    if t == str: return "string"
+    if t == int: return "integer"
+    if t == float: return "number"
+    if t == bool: return "boolean"
+    return "string" # 預設
+
+def register_tool(func):
+    """
+    這是一個裝飾器 (@register_tool)。
+    只要掛在函數上，就會自動讀取函數的名稱、參數和註解，
+    生成 Ollama 需要的 JSON Schema。
+    """
+    # 1. 取得函數資訊
+    func_name = func.__name__
+    doc = func.__doc__.strip() if func.__doc__ else "無描述"
+    sig = inspect.signature(func)
+    
+    # 2. 構建參數 Schema
+    properties = {}
+    required = []
+    
+    for param_name, param in sig.parameters.items():
+        # 忽略 self, cls 等參數 (如果有)
+        if param_name in ['self', 'cls']: continue
+        
+        # 取得參數型別 (預設為 str)
+        param_type = param.annotation if param.annotation != inspect.Parameter.empty else str
+        
+        # 嘗試從 docstring 或是簡單設定描述 (這裡簡化處理，不強制解析 docstring 中的參數說明)
+        # 如果您想要更完美的描述，建議參數名稱取直觀一點
+        
+        properties[param_name] = {
+            "type": get_type_name(param_type),
+            "description": f"Parameter: {param_name}" 
+        }
+        
+        # 如果沒有預設值，就是必填
+        if param.default == inspect.Parameter.empty:
+            required.append(param_name)
+
+    # 3. 組合完整的 Tool Definition
+    tool_def = {
+        "type": "function",
+        "function": {
+            "name": func_name,
+            "description": doc,
+            "parameters": {
+                "type": "object",
+                "properties": properties,
+                "required": required
+            }
+        }
+    }
+    
+    # 4. 註冊
+    TOOLS_SCHEMA.append(tool_def)
+    TOOLS_MAPPING[func_name] = func
+    
+    print(f"🔧 [系統] 已註冊工具: {func_name}")
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+    return wrapper
+
+def execute_tool(tool_name, arguments):
+    """通用執行入口"""
+    func = TOOLS_MAPPING.get(tool_name)
+    if not func:
+        return f"錯誤: 找不到工具 '{tool_name}'"
+    
+    try:
+        # 處理參數格式 (有時是 JSON 字串，有時是 dict)
+        if isinstance(arguments, str):
+            args = json.loads(arguments)
+        else:
+            args = arguments or {}
+            
+        print(f"⚙️ [執行工具] {tool_name} | 參數: {args}")
+        return func(**args)
+    except Exception as e:
+        return f"執行工具發生錯誤: {e}"
+
+# --- 工具並行執行設定 ---
+# 同時執行的工具數上限 (避免一次開太多連線)
+TOOL_MAX_WORKERS = 4
+# 單一工具的逾時秒數 (從工具「開始執行」起算；沒列出的用 DEFAULT_TOOL_TIMEOUT)
+# 執行緒沒辦法從外面中止，所以工具裡的每個網路請求都要有自己的逾時 (比這裡短)，
+# 逾時的工具才會真的結束、把執行緒還給後面的工具
+DEFAULT_TOOL_TIMEOUT = 30
+TOOL_TIMEOUTS = {
+    "get_current_time": 2,
+    "search_wikipedia": 15,
+    "ask_wolfram_alpha": 60,
+}
+# 工具排隊等執行緒的上限 (秒)；超過還沒開始就取消
+TOOL_QUEUE_TIMEOUT = 30
+
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
+
+def _run_tool(started, func_name, func_args):
+    """在執行緒裡記下開始時間再執行工具 (逾時從這裡起算)"""
+    started["at"] = time.time()
+    started["event"].set()
+    return execute_tool(func_name, func_args)
+
+def _wait_for_tool(future, started, timeout, submitted_at):
+    """等工具結果；還在排隊就先等它開始 (最多 TOOL_QUEUE_TIMEOUT 秒)，逾時會丟出 FutureTimeoutError"""
+    if not started["event"].wait(max(0, submitted_at + TOOL_QUEUE_TIMEOUT - time.time())):
+        if future.cancel():
+            raise FutureTimeoutError()
+    return future.result(timeout=max(0, started.get("at", time.time()) + timeout - time.time()))
+
+def execute_tool_calls(tool_calls):
+    """
+    並行執行左腦回傳的多個 tool_calls。
+    - 每個工具有各自的逾時 (TOOL_TIMEOUTS)，從工具開始執行才起算，排隊的時間不會吃掉它的額度
+    - 結果依照原本 tool_calls 的順序回傳: [(工具名稱, 結果字串), ...]
+    總等待時間約等於「最慢的那個工具」，而不是所有工具時間的總和
+    (工具數超過 TOOL_MAX_WORKERS 時，後面的工具要等前面的讓出執行緒)。
+    """
+    start_time = time.time()
+    jobs = []
+    for tool in tool_calls:
+        func_name = tool["function"]["name"]
+        func_args = tool["function"]["arguments"]
+        print(f"   └── 執行: {func_name} | 參數: {func_args}")
+
+        timeout = TOOL_TIMEOUTS.get(func_name, DEFAULT_TOOL_TIMEOUT)
+        started = {"event": threading.Event()}
+        future = _tool_executor.submit(_run_tool, started, func_name, func_args)
+        jobs.append((func_name, future, started, timeout))
+
+    results = []
+    for func_name, future, started, timeout in jobs:
+        try:
+            result = _wait_for_tool(future, started, timeout, start_time)
+        except FutureTimeoutError:
+            if started["event"].is_set():
+                # 已經在跑的沒辦法中止，靠工具自己的請求逾時結束；這裡不再等它
+                print(f"⏰ [工具逾時] {func_name} 執行超過 {timeout} 秒，已放棄")
+            else:
+                print(f"⏰ [工具逾時] {func_name} 排隊超過 {TOOL_QUEUE_TIMEOUT} 秒還沒開始，已取消")
+            result = f"錯誤: 工具 '{func_name}' 執行逾時"
+        except Exception as e:
+            print(f"❌ 工具執行錯誤: {e}")
+            result = f"執行工具發生錯誤: {e}"
+        results.append((func_name, result))
+
+    print(f"⏱️ [工具] {len(jobs)} 個工具完成，耗時 {time.time() - start_time:.2f} 秒")
+    return results
+    
+
+    # mcp_handler.py
+import datetime
+import requests
+import ollama_client
+
+# 外部 API (Wikipedia / WolframAlpha) 共用連線，保持 keep-alive
+_http_session = requests.Session()
+_http_session.headers.update({"User-Agent": "Ai_Math/1.0"})
+
+
+# === 您的工具定義區 (盡情發揮！) ===
+
+@register_tool
+def get_current_time():
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return f"現在時間: {now}"
+
+def _analyze_image_with_ollama(image_base64, instruction=""):
+    """
+    內部共用函數：將 Base64 圖片發送給 Ollama 視覺模型
+    """
+    # 針對 Moondream 優化 Prompt
+    final_prompt = "Describe this image." 
+    if instruction:
+        final_prompt = f"Describe this image. Focus on: {instruction}"
+
+    payload = {
+        "model": VISION_MODEL,
+        "prompt": final_prompt,
+        "images": [image_base64],
+        "stream": False,
+        "options": {"num_predict": 4096} # 限制輸出長度
+    }
+
+    try:
+        response = ollama_client.generate(payload, timeout=VISION_TIMEOUT)
+        if response.status_code == 200:
+            result = response.json()
+            description = result.get("response", "").strip()
+            return description
+        else:
+            return f"Error: Vision model returned status {response.status_code}"
+    except Exception as e:
+        return f"Error: Connection failed {e}"
+
+def process_uploaded_image(image_base64, user_text):
+    """
+    給網頁上傳專用的函數
+    """
+    print(f"🖼️ [系統] 收到網頁上傳圖片，正在分析...")
+    description = _analyze_image_with_ollama(image_base64, user_text)
+    
+    return (
+        f"【使用者上傳了一張圖片】\n"
+        f"視覺模型描述(英文): {description}\n"
+        f"----------------------------------\n"
+        f"使用者問題: {user_text}\n"
+        f"(請根據圖片描述回答使用者的問題)"
+    )
+
+from duckduckgo_search import DDGS
+
+
+# --- 設定區 ---
+# 建議使用 moondream (快且準) 或 qwen2.5vl
+VISION_MODEL = "qwen2.5vl:3b" 
+# 視覺模型讀取逾時 (秒)，大圖 / PDF 頁面需要比較久
+VISION_TIMEOUT = 120
+
+def _capture_window_to_base64():
+    """內部函數：截取當前活動視窗並轉為 Base64"""
+    try:
+        screenshot = None
+        
+        # 嘗試鎖定當前視窗
+        if gw:
+            active_window = gw.getActiveWindow()
+            if active_window:
+                # 加一點邊距修正，避免切到邊框陰影
+                screenshot = pyautogui.screenshot(region=(
+                    active_window.left, 
+                    active_window.top, 
+                    active_window.width, 
+                    active_window.height
+                ))
+                print(f"📸 [視覺] 已鎖定視窗: {active_window.title}")
+        
+        # 如果無法鎖定視窗或沒有安裝 gw，則全螢幕截圖
+        if screenshot is None:
+            print("⚠️ 無法鎖定視窗，進行全螢幕截圖。")
+            screenshot = pyautogui.screenshot()
+
+        # 圖片縮放 (Moondream 不需要太大張，512x512 效果最佳且快)
+        screenshot.thumbnail((512, 512))
+        
+        buffered = io.BytesIO()
+        screenshot.save(buffered, format="JPEG", quality=85)
+        img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        return img_str
+        
+    except Exception as e:
+        print(f"❌ 截圖失敗: {e}")
+        return None
+
+#@register_tool
+def look_at_screen(instruction: str = "描述畫面"):
+    """
+    (System Action) 視覺能力：觀看使用者的電腦螢幕。
+    當用戶說「你看」、「這張圖」、「畫面」時，【必須】使用此工具。
+    instruction: (選填) 重點，例如 "這張圖" 或 "翻譯文字"。
+    """
+    print(f"👀 [視覺] 正在觀察: {instruction} ...")
+    
+    image_base64 = _capture_window_to_base64()
+    if not image_base64:
+        return "錯誤：無法截取畫面。"
+
+    # 針對 Moondream 優化 Prompt
+    # Moondream 對英文指令反應較好
+    final_prompt = f"Describe this image briefly. Focus on: {instruction}"
+    if VISION_MODEL == "moondream":
+        final_prompt = "Describe this image." # Moondream 喜歡簡單指令
+
+    payload = {
+        "model": VISION_MODEL,
+        "prompt": final_prompt,
+        "images": [image_base64],
+        "stream": False,
+        "options": {
+            "num_predict": 100, # 限制輸出長度，避免廢話
+            "repeat_penalty": 1.2
+        }
+    }
+
+    # 畫面沒變 (hash 幾乎相同) 就不再問一次視覺模型
+    cache_key = f"{VISION_MODEL}|screen|{final_prompt}"
+    img_hash = vision_cache.image_hash(image_base64)
+    description = vision_cache.lookup(img_hash, cache_key)
+
+    try:
+        if description is not None:
+            print("⚡ [視覺快取] 畫面沒有變化，直接使用上次的描述")
+        else:
+            # 直接呼叫 Ollama API (獨立於主對話模型)
+            response = ollama_client.generate(payload, timeout=VISION_TIMEOUT)
+            if response.status_code != 200:
+                return f"視覺模型錯誤: {response.status_code}"
+            description = response.json().get("response", "").strip()
+            vision_cache.store(img_hash, cache_key, description)
+
+        print(f"👀 [視覺結果]: {description[:100]}...")
+        
+        # 回傳給主模型 (Qwen/DeepSeek) 讓它翻譯並吐槽
+        return (
+            f"【視覺模組回傳的畫面描述 (英文)】\n{description}\n"
+            f"(請根據以上描述，假裝是你親眼看到的，用中文回答用戶問題: '{instruction}')"
+        )
+            
+    except Exception as e:
+        return f"視覺連線失敗: {e} (請確認 ollama pull {VISION_MODEL} 已執行)"
+    
+import wikipedia
+WIKI_LANG = "zh"
+try:
+    wikipedia.set_lang(WIKI_LANG)
+except:
+    print("設定維基百科語言失敗，預設使用英文")
+    WIKI_LANG = "en"
+
+# 每個請求的逾時；一次查詢最多 3 個請求 (搜尋、頁面、歧義選項)，合計要短於工具逾時 (TOOL_TIMEOUTS)
+WIKI_TIMEOUT = 4
+WIKI_API_URL = f"https://{WIKI_LANG}.wikipedia.org/w/api.php"
+WIKI_SUMMARY_SENTENCES = 3
+# 維基百科快取：條目內容不常變，保留 30 天；記憶體層放最近 256 筆
+WIKI_CACHE_TTL = 30 * 24 * 60 * 60
+wiki_search_cache = PersistentCache("wiki_search", ttl=WIKI_CACHE_TTL, max_entries=5000, memory_size=256)
+wiki_page_cache = PersistentCache("wiki_page", ttl=WIKI_CACHE_TTL, max_entries=5000, memory_size=256)
+
+
+def _wiki_search(query):
+    """搜尋條目標題 (有快取；和抓頁面一樣走共用連線、有逾時)"""
+    cache_key = f"{WIKI_LANG}:{' '.join(query.lower().split())}"
+    results = wiki_search_cache.get(cache_key)
+    if results is None:
+        params = {
+            "action": "query",
+            "format": "json",
+            "list": "search",
+            "srsearch": query,
+            "srlimit": 10,
+            "srprop": "",
+        }
+        response = _http_session.get(WIKI_API_URL, params=params, timeout=WIKI_TIMEOUT)
+        response.raise_for_status()
+        results = [item["title"] for item in response.json().get("query", {}).get("search", [])]
+        wiki_search_cache.set(cache_key, results)
+    return results
+
+def _wiki_fetch_page(title):
+    """
+    一次請求同時拿到摘要 + 網址 + 是否為歧義頁 (取代 summary() + page() 兩三次往返)
+    以「重導向後的實際標題」為快取鍵；歧義頁的選項清單也一起快取。
+    回傳 dict: {"title", "summary", "url", "options"}，找不到頁面時回傳 None
+    """
+    alias_key = f"{WIKI_LANG}:alias:{title}"
+    # 別名只是查頁面的中間步驟，不計入命中統計；一次查詢只算頁面那一次
+    resolved_title = wiki_page_cache.get(alias_key, count=False) or title
+    page = wiki_page_cache.get(f"{WIKI_LANG}:page:{resolved_title}")
+    if page is not None:
+        return page
+
+    params = {
+        "action": "query",
+        "format": "json",
+        "titles": title,
+        "redirects": 1,
+        "prop": "extracts|info|pageprops",
+        "inprop": "url",
+        "ppprop": "disambiguation",
+        "exintro": 1,
+        "explaintext": 1,
+        "exsentences": WIKI_SUMMARY_SENTENCES,
+    }
+    response = _http_session.get(WIKI_API_URL, params=params, timeout=WIKI_TIMEOUT)
+    response.raise_for_status()
+    pages = response.json().get("query", {}).get("pages", {})
+    if not pages:
+        return None
+    data = next(iter(pages.values()))
+    if "missing" in data:
+        return None
+
+    page = {
+        "title": data.get("title", title),
+        "summary": data.get("extract", "").strip(),
+        "url": data.get("fullurl", ""),
+        "options": [],
+    }
+    if "disambiguation" in data.get("pageprops", {}):
+        # 歧義頁才需要額外請求一次，拿選項清單 (頁面上的條目連結，只列出前 5 個)
+        response = _http_session.get(WIKI_API_URL, params={
+            "action": "query",
+            "format": "json",
+            "titles": page["title"],
+            "prop": "links",
+            "plnamespace": 0,
+            "pllimit": 5,
+        }, timeout=WIKI_TIMEOUT)
+        response.raise_for_status()
+        for link_page in response.json().get("query", {}).get("pages", {}).values():
+            page["options"] = [link["title"] for link in link_page.get("links", [])][:5]
+
+    wiki_page_cache.set(alias_key, page["title"])
+    wiki_page_cache.set(f"{WIKI_LANG}:page:{page['title']}", page)
+    return page
+
+def get_wiki_cache_stats():
+    """維基百科快取命中統計"""
+    return {"search": wiki_search_cache.stats(), "page": wiki_page_cache.stats()}
+
+@register_tool
+def search_wikipedia(query: str):
+    """
+    (System Action) 查詢維基百科 (Wikipedia)。
+    適用情境：
+    1. 用戶詢問「定義」類問題 (例如: 什麼是量子力學? 什麼是三體問題?)。
+    2. 查詢歷史事件、人物介紹、科學名詞。
+    3. 當 search_web (搜尋引擎) 資訊太雜亂時，使用此工具可獲得精準定義。
+    """
+    print(f"📖 [Wiki] 正在查閱: {query} ...")
+    
+    try:
+        # 1. 搜尋條目 (Search)
+        search_results = _wiki_search(query)
+        
+        if not search_results:
+            return "維基百科找不到相關條目。"
+        
+        # 2. 一次取得最接近頁面的摘要 + 網址
+        # 只抓前 WIKI_SUMMARY_SENTENCES 句，避免內容太長爆字數
+        page = _wiki_fetch_page(search_results[0])
+        if page is None:
+            return "找不到該具體頁面的內容。"
+
+        if page["options"]:
+            # 如果這個詞有歧義 (例如 'Joker' 可以是電影、撲克牌、蝙蝠俠反派)
+            return f"這個詞有多種含義，請告訴我您是指哪一個：\n" + ", ".join(page["options"])
+
+        return (
+            f"【維基百科摘要 - {page['title']}】\n"
+            f"{page['summary']}\n"
+            f"(來源: {page['url']})"
+        )
+
+    except Exception as e:
+        return f"維基百科查詢失敗: {e}"
+    
+
+
+    import sys
+import io
+import contextlib
+
+# 引入數學庫供 exec 使用
+import math
+import sympy
+import numpy as np
+import xml.etree.ElementTree as ET 
+import re
+import local_solver
+WOLFRAM_APP_ID = 'TJE5A4WK2V'
+# Wolfram 請求逾時 (秒)：(連線, 讀取)；加上本地 SymPy 的時間預算仍要短於工具逾時 (TOOL_TIMEOUTS)
+WOLFRAM_TIMEOUT = (3, 50)
+# Wolfram 結果快取：同一題 7 天內直接回傳，最多保留 5000 題
+WOLFRAM_CACHE_TTL = 7 * 24 * 60 * 60
+WOLFRAM_CACHE_MAX_ENTRIES = 5000
+wolfram_cache = PersistentCache("wolfram", ttl=WOLFRAM_CACHE_TTL, max_entries=WOLFRAM_CACHE_MAX_ENTRIES)
+
+# 快取鍵正規化用：
+# 查詢 = 開頭的指令字 (factor / integrate of ...) + 「一整個」算式 時，才把算式寫法統一；
+# 其他情況 (算式中間夾著 from / to / for 等字、看不懂的符號) 只統一大小寫和空白。
+# 寧可少命中，也不能讓兩個不同的題目共用同一個鍵。
+# 算式只做語法層級的整理 (自己寫的小 parser，不會 eval 任何字串)。
+_QUERY_COMMAND_WORDS = {
+    "factor", "expand", "simplify", "solve", "integrate", "integral", "differentiate",
+    "derivative", "derive", "evaluate", "calculate", "compute", "plot", "of",
+}
+_MATH_FUNCTION_NAMES = {
+    "sin", "cos", "tan", "cot", "sec", "csc", "asin", "acos", "atan",
+    "sinh", "cosh", "tanh", "log", "ln", "exp", "sqrt", "abs",
+}
+# 出現在算式位置的這些字代表查詢還有其他條件 (solve ... for x / integrate ... from 0 to 1)
+_QUERY_CONNECTIVE_WORDS = {
+    "for", "from", "to", "as", "at", "with", "respect", "wrt", "and", "or", "in", "on",
+    "over", "where", "when", "approaches", "order", "about", "around", "of", "by", "is",
+}
+_MATH_TOKEN_PATTERN = re.compile(r"\s*(?:(\d+\.\d*|\.\d+|\d+)|([a-z][a-z0-9_]*)|(\*\*|[-+*/^=(),!]))")
+_MAX_CANONICAL_QUERY_CHARS = 200
+
+
+class _MathSyntaxError(Exception):
+    pass
+
+
+class _MathCanonicalizer:
+    """
+    把單一算式 (或一條等式) 整理成固定寫法：
+    ** -> ^、省略的乘號補上 * (5x -> 5*x, (x+1)(x-1) -> (x+1)*(x-1))、去掉多餘空白。
+    多個字母的變數 (xy) 保持一個名稱，不會被拆開或當成關鍵字；括號與運算子全部保留。
+    """
+
+    def __init__(self, text):
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = _MATH_TOKEN_PATTERN.match(text, pos)
+            if not match:
+                raise _MathSyntaxError(text[pos:])
+            number, name, op = match.groups()
+            if number:
+                self.tokens.append(("num", number))
+            elif name:
+                self.tokens.append(("name", name))
+            else:
+                self.tokens.append(("op", "^" if op == "**" else op))
+            pos = match.end()
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _take(self, value=None):
+        kind, token = self._peek()
+        if kind is None or (value is not None and token != value):
+            raise _MathSyntaxError(token)
+        self.pos += 1
+        return kind, token
+
+    def canonical(self):
+        result = self._expression()
+        if self._peek() == ("op", "="):
+            self._take("=")
+            result = f"{result} = {self._expression()}"
+        if self.pos != len(self.tokens):
+            raise _MathSyntaxError(self._peek()[1])
+        return result
+
+    def _expression(self):
+        result = self._term()
+        while self._peek() in (("op", "+"), ("op", "-")):
+            result += self._take()[1] + self._term()
+        return result
+
+    def _term(self):
+        result = self._unary()
+        divided = False
+        while True:
+            kind, token = self._peek()
+            if token in ("*", "/") and kind == "op":
+                self._take()
+                divided = divided or token == "/"
+                result += token + self._unary()
+            elif kind in ("num", "name") or (kind, token) == ("op", "("):
+                # 省略的乘號；1/2x 是 (1/2)x 還是 1/(2x) 各家解讀不同，不做整理
+                if divided:
+                    raise _MathSyntaxError(token)
+                result += "*" + self._unary()
+            else:
+                return result
+
+    def _unary(self):
+        if self._peek() in (("op", "-"), ("op", "+")):
+            return self._take()[1] + self._unary()
+        return self._power()
+
+    def _power(self):
+        result = self._postfix()
+        if self._peek() == ("op", "^"):
+            self._take("^")
+            result += "^" + self._unary()
+        return result
+
+    def _postfix(self):
+        result = self._primary()
+        while self._peek() == ("op", "!"):
+            self._take("!")
+            result += "!"
+        return result
+
+    def _primary(self):
+        kind, token = self._take()
+        if kind == "num":
+            return token
+        if kind == "name":
+            if self._peek() == ("op", "("):
+                # 函數呼叫 f(x) 和 f*(x) 意思可能不同，照原樣保留
+                self._take("(")
+                args = [self._expression()]
+                while self._peek() == ("op", ","):
+                    self._take(",")
+                    args.append(self._expression())
+                self._take(")")
+                return f"{token}({','.join(args)})"
+            if token in _QUERY_CONNECTIVE_WORDS or token in _QUERY_COMMAND_WORDS:
+                raise _MathSyntaxError(token)
+            if token in _MATH_FUNCTION_NAMES:
+                # sin x 這種省略括號的寫法不確定作用範圍，不做整理
+                raise _MathSyntaxError(token)
+            return token
+        if token == "(":
+            inner = self._expression()
+            self._take(")")
+            return f"({inner})"
+        raise _MathSyntaxError(token)
+
+
+def _canonicalize_wolfram_query(query):
+    """
+    產生 Wolfram 快取鍵：統一大小寫、空白；
+    「指令 + 單一算式」的查詢再把算式寫法統一，例如
+    "Factor x^2+5x+6" 與 "factor  x**2 + 5*x + 6" 會得到同一個鍵 "factor x^2+5*x+6"，
+    但 "factor xy+x" 和 "factor xy x" 不會。
+    """
+    text = " ".join(query.lower().split())
+    if len(text) > _MAX_CANONICAL_QUERY_CHARS:
+        return text
+    words = text.split(" ")
+    command = []
+    while words and words[0] in _QUERY_COMMAND_WORDS:
+        command.append(words.pop(0))
+    if not words:
+        return text
+    try:
+        expression = _MathCanonicalizer(" ".join(words)).canonical()
+    except (_MathSyntaxError, RecursionError):
+        return text
+    return " ".join(command + [expression])
+
+# 背景啟動 SymPy 子行程，第一題就不用等載入
+local_solver.warm_up()
+
+def get_wolfram_cache_stats():
+    """Wolfram 快取命中統計"""
+    return wolfram_cache.stats()
+@register_tool
+def ask_wolfram_alpha(query: str):
+    """
+    (System Action) 使用 WolframAlpha 計算引擎解決數學、科學、物理、化學應用題。
+    
+    Args:
+        query: 要查詢的問題。
+        
+        🚨【重要指令 / IMPORTANT INSTRUCTION】🚨
+        WolframAlpha 只看懂英文！WolframAlpha ONLY understands ENGLISH!
+        如果用戶的問題是中文，你必須先將其「翻譯成英文關鍵字」後再傳入此參數。
+        不要傳入整句中文，請提取物理/數學關鍵字。
+
+        【範例 / Examples】:
+        - 用戶: "積分 x平方 sin x" 
+          -> 你的參數 query="integrate x^2 sin(x)"
+        - 用戶: "拋體運動 初速度 20m/s 角度 30度" 
+          -> 你的參數 query="projectile motion v0=20m/s angle=30 deg"
+        - 用戶: "水的密度"
+          -> 你的參數 query="density of water"
+        - 用戶: "把 x^2 + 5x + 6 因式分解"
+          -> 你的參數 query="factor x^2 + 5x + 6"
+    """
+    # 這裡的代碼不需要大改，因為翻譯工作已經由 LLM 在呼叫前完成了
+    # 我們只需要保留原本的邏輯即可
+    
+    print(f"🐺 [Wolfram] 正在計算 (Arg): {query}")
+    
+    if "YOUR_WOLFRAM_APP_ID" in WOLFRAM_APP_ID:
+        return "錯誤: 請先在 mcp_handler.py 設定 WOLFRAM_APP_ID"
+
+    # 先查快取 (重複的作業題直接回傳，不用再等本地計算)
+    cache_key = _canonicalize_wolfram_query(query)
+    cached_result = wolfram_cache.get(cache_key)
+    if cached_result is not None:
+        stats = wolfram_cache.stats()
+        print(f"⚡ [Wolfram] 快取命中: {cache_key} (命中率 {stats['hit_rate']:.0%})")
+        return cached_result
+
+    # 常見代數 / 微積分題先在本地用 SymPy 算 (毫秒級、不需網路)，失敗或超時才查 Wolfram
+    local_result = local_solver.solve_with_budget(query)
+    if local_result:
+        wolfram_cache.set(cache_key, local_result)
+        return local_result
+
+    # 使用 Full Results API (v2/query)
+    api_url = "http://api.wolframalpha.com/v2/query" 
+    
+    params = {
+        "appid": WOLFRAM_APP_ID,
+        "input": query, 
+        "units": "metric",
+        "format": "plaintext",
+        "output": "xml",
+        "podstate": "Step-by-step solution" 
+    }
+
+    try:
+        response = _http_session.get(api_url, params=params, timeout=WOLFRAM_TIMEOUT) # 延長一點時間給複雜運算
+        
+        if response.status_code == 200:
+            root = ET.fromstring(response.text)
+            
+            if root.attrib.get('success') != 'true':
+                didyoumeans = root.findall('.//didyoumean')
+                suggestions = [d.text for d in didyoumeans if d.text]
+                msg = "WolframAlpha 無法理解此問題 (可能翻譯不夠精準)。"
+                if suggestions:
+                    msg += f" 建議嘗試搜尋: {', '.join(suggestions)}"
+                return msg
+            
+            result_parts = []
+            
+            for pod in root.findall('.//pod'):
+                title = pod.attrib.get('title', 'Result')
+                
+                subpod_texts = []
+                for subpod in pod.findall('.//subpod'):
+                    plaintext = subpod.find('plaintext')
+                    if plaintext is not None and plaintext.text:
+                        text = plaintext.text.strip()
+                        if text:
+                            subpod_texts.append(text)
+                
+                if subpod_texts:
+                    content = "\n".join(subpod_texts)
+                    result_parts.append(f"--- {title} ---\n{content}\n")
+                        
+            if not result_parts:
+                return "WolframAlpha 執行成功，但未返回文字結果 (可能是純圖片)。"
+
+            combined_result = "【WolframAlpha 分析結果】\n\n" + "\n".join(result_parts)
+            wolfram_cache.set(cache_key, combined_result)
+            return combined_result 
+
+        else:
+            return f"WolframAlpha API Error: {response.status_code}"
+            
+    except Exception as e:
+        return f"WolframAlpha Connection Failed: {e}"
+    
+def _analyze_image_with_ollama(image_base64, instruction=""):
+    """內部共用函數：將 Base64 圖片發送給 Ollama 視覺模型"""
+    final_prompt = (
+        "Please explicitly read and transcribe all text, numbers, and mathematical formulas in this image. "
+        "Do not summarize; provide the full content verbatim."
+    )
+    if instruction:
+        final_prompt += f" Focus on: {instruction}"
+
+    payload = {
+        "model": VISION_MODEL,
+        "prompt": final_prompt,
+        "images": [image_base64],
+        "stream": False,
+        "options": {"num_predict": 512} 
+    }
+
+    # 前處理：裁白邊 + 縮到模型有效解析度 + 壓縮 (上傳圖片 / PDF 頁面都會經過這裡)
+    try:
+        image_base64 = image_prep.prepare_image(image_base64)
+    except Exception as e:
+        # Base64 壞掉 / 圖片無法處理：和其他錯誤一樣回傳 "Error: ..." 字串，不讓整個請求失敗
+        return f"Error: Invalid image {e}"
+    payload["images"] = [image_base64]
+
+    # 同一張圖 (或幾乎一樣的圖) + 同樣的指令 -> 直接用上次的描述
+    cache_key = f"{VISION_MODEL}|{final_prompt}"
+    img_hash = vision_cache.image_hash(image_base64)
+    cached = vision_cache.lookup(img_hash, cache_key)
+    if cached is not None:
+        print("⚡ [視覺快取] 相同圖片，直接使用上次的描述")
+        return cached
+
+    try:
+        response = ollama_client.generate(payload, timeout=VISION_TIMEOUT)
+        if response.status_code == 200:
+            description = response.json().get("response", "").strip()
+            vision_cache.store(img_hash, cache_key, description)
+            return description
+        else:
+            return f"Error: Vision model status {response.status_code}"
+    except Exception as e:
+        return f"Error: Connection failed {e}"
+
+def process_uploaded_image(image_base64, user_text):
+    """給網頁上傳圖片專用"""
+    print(f"🖼️ [系統] 正在分析圖片...")
+    description = _analyze_image_with_ollama(image_base64, user_text)
+    print(description)
+    return f"【圖片內容分析】\n{description}\n---\n使用者問題: {user_text}"
+
+# 多頁 PDF 同時送給視覺模型的請求數 (Ollama 需設定 OLLAMA_NUM_PARALLEL 才會真的平行)
+PDF_VISION_WORKERS = 2
+
+def process_stored_pdf(pdf_hash, page_spec, user_text):
+    """
+    處理已存檔的 PDF (以內容 hash 指定)：
+    1. 解析頁碼 (例如 "3"、"1-3,5")
+    2. 先讀 PDF 原生文字層；文字層可用的頁面完全不經過 GPU
+    3. 掃描頁才整頁轉圖 (頁面快取 + 平行轉圖)，文字頁只把插圖區域送 OCR
+    4. 視覺請求同時送出，結果依頁碼順序組合
+    """
+    if pdf_store.fitz is None:
+        return "錯誤：伺服器缺少 pymupdf 套件。請執行 `pip install pymupdf`。"
+
+    try:
+        pages = pdf_store.parse_page_spec(page_spec, pdf_store.get_page_count(pdf_hash))
+    except ValueError as e:
+        return f"錯誤：{e}"
+    except (OSError, RuntimeError) as e:
+        # 檔案不見了 (被快取淘汰 / 代號錯誤) 或 PDF 損毀 (fitz 的錯誤都是 RuntimeError)
+        print(f"PDF 開啟失敗: {e}")
+        return f"錯誤：無法開啟這份 PDF，請重新上傳。({e})"
+
+    print(f"📄 [系統] 正在處理 PDF 第 {', '.join(map(str, pages))} 頁...")
+    try:
+        layers = [pdf_store.extract_page_layer(pdf_hash, page) for page in pages]
+
+        # 視覺工作: (頁碼, 區域編號 或 None=整頁, 區域座標, 圖片 bytes)
+        vision_jobs = []
+        ocr_results = {}
+        scanned_pages = [layer["page"] for layer in layers if not layer["usable"]]
+        region_jobs = []
+        for layer in layers:
+            for idx, rect in enumerate(layer["regions"], 1):
+                # 同一塊區域 (算式 / 插圖) 辨識過就直接用，不管這次問的是什麼
+                cached = pdf_store.get_region_ocr(pdf_hash, layer["page"], rect)
+                if cached is not None:
+                    ocr_results.setdefault(layer["page"], []).append((idx, cached))
+                else:
+                    region_jobs.append((layer["page"], idx, rect))
+        # 確定要用到視覺模型時，趁轉圖的時間先在背景載入
+        if scanned_pages or region_jobs:
+            ollama_client.prewarm(VISION_MODEL)
+        if scanned_pages:
+            for page, img in zip(scanned_pages, pdf_store.render_pages(pdf_hash, scanned_pages)):
+                vision_jobs.append((page, None, None, img))
+        for page, idx, rect in region_jobs:
+            vision_jobs.append((page, idx, rect, pdf_store.render_region(pdf_hash, page, rect)))
+
+        text_pages = len(pages) - len(scanned_pages)
+        print(f"📑 [PDF] 文字層直接使用 {text_pages} 頁，視覺 OCR: {len(scanned_pages)} 整頁 + "
+              f"{len(region_jobs)} 個區域 (另有 {sum(len(v) for v in ocr_results.values())} 個區域已辨識過)")
+
+        def _ocr(job):
+            _, region, _, img = job
+            img_base64 = base64.b64encode(img).decode("utf-8")
+            # 區域只做逐字轉錄 (不帶使用者問題)，結果才能給之後的提問重複使用
+            return _analyze_image_with_ollama(img_base64, "" if region else user_text)
+
+        descriptions = []
+        if vision_jobs:
+            with ThreadPoolExecutor(max_workers=min(PDF_VISION_WORKERS, len(vision_jobs))) as executor:
+                descriptions = list(executor.map(_ocr, vision_jobs))
+
+        for (page, region, rect, _), description in zip(vision_jobs, descriptions):
+            ocr_results.setdefault(page, []).append((region, description))
+            if region is not None and not description.startswith("Error:"):
+                pdf_store.store_region_ocr(pdf_hash, page, rect, description)
+
+        sections = []
+        for layer in layers:
+            page = layer["page"]
+            if not layer["usable"]:
+                sections.append(f"【PDF 第 {page} 頁內容分析】\n{ocr_results[page][0][1]}\n")
+                continue
+            section = f"【PDF 第 {page} 頁內容 (文字層)】\n{layer['text']}\n"
+            for region, description in sorted(ocr_results.get(page, []), key=lambda r: r[0]):
+                section += f"[第 {page} 頁區域 {region} (OCR)]\n{description}\n"
+            sections.append(section)
+
+        return (
+            "\n".join(sections) +
+            f"----------------------------------\n"
+            f"使用者問題: {user_text}\n"
+            f"(請根據以上 PDF 頁面內容進行數學解題)"
+        )
+
+    except Exception as e:
+        print(f"PDF 處理失敗: {e}")
+        return f"PDF 讀取失敗: {e}"
+
+def process_pdf_pipeline(pdf_bytes, page_num, user_text):
+    """
+    處理上傳的 PDF 檔案 (使用 PyMuPDF/fitz 引擎)
+    page_num 可以是單一頁碼或頁碼字串 ("1-3,5")；檔案以內容 hash 存檔，
+    同一份 PDF 換頁詢問時不用重新上傳或重新轉圖。
+    """
+    if pdf_store.fitz is None:
+        return "錯誤：伺服器缺少 pymupdf 套件。請執行 `pip install pymupdf`。"
+
+    try:
+        pdf_hash = pdf_store.save_pdf(pdf_bytes)
+    except Exception as e:
+        print(f"PDF 處理失敗: {e}")
+        return f"PDF 讀取失敗: {e}"
+    return process_stored_pdf(pdf_hash, page_num, user_text)
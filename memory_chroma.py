@@ -1,124 +1,411 @@
-# memory_chroma.py (Pro 加強版)
-
-import chromadb
-from chromadb.utils import embedding_functions
-import datetime
-import uuid
-import os
-
-# 💾 資料庫設定
-DB_PATH = "./chroma_db"
-
-# 建立資料夾 (如果不存在)
-if not os.path.exists(DB_PATH):
-    os.makedirs(DB_PATH)
-
-client = chromadb.PersistentClient(path=DB_PATH)
-
-# 🔥 升級 1: 使用支援多語言更強的模型
-# 如果第一次跑會下載稍微久一點 (約 400MB)，但中文效果好很多
-MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
-
-print(f"[記憶系統] 載入嵌入模型: {MODEL_NAME}...")
-emb_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name=MODEL_NAME
-)
-
-# 建立兩個集合：一個存流水帳 (Chat)，一個存重要事實 (Facts)
-collection_chat = client.get_or_create_collection(
-    name="chat_history",
-    embedding_function=emb_fn,
-    metadata={"hnsw:space": "cosine"} # 使用餘弦相似度，0~1 之間，越小越相似
-)
-
-collection_facts = client.get_or_create_collection(
-    name="core_facts",
-    embedding_function=emb_fn,
-    metadata={"hnsw:space": "cosine"}
-)
-
-def _get_timestamp():
-    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-def add_memory(text: str, speaker: str):
-    """一般對話記憶 (流水帳)"""
-    timestamp = _get_timestamp()
-    full_text = f"[{timestamp}] {speaker}: {text}"
-    
-    collection_chat.add(
-        documents=[full_text],
-        metadatas=[{"speaker": speaker, "timestamp": timestamp, "type": "chat"}],
-        ids=[str(uuid.uuid4())]
-    )
-
-def add_important_fact(text: str):
-    """
-    🔥 升級 2: 重要事實記憶 (例如：使用者名字、居住地、喜好)
-    這些記憶在搜尋時會有較高的優先級
-    """
-    timestamp = _get_timestamp()
-    # 事實不需要加 Speaker，直接存內容
-    full_text = f"[{timestamp}] 重要情報: {text}"
-    
-    collection_facts.add(
-        documents=[full_text],
-        metadatas=[{"timestamp": timestamp, "type": "fact"}],
-        ids=[str(uuid.uuid4())]
-    )
-    print(f"⭐ [記憶] 已寫入重要事實: {text}")
-
-def search_memory(query_text: str, n_results: int = 3, threshold: float = 0.4):
-    """
-    🔥 升級 3: 混合搜尋 + 品質過濾
-    threshold: 相似度門檻 (0~1)，距離大於此值(越不相關)則丟棄。
-    建議值 0.3~0.5。如果 AI 常常瞎掰無關的回憶，把這個值調低 (e.g. 0.3)。
-    """
-    
-    # 1. 先搜「重要事實」(Facts) - 權重高
-    fact_results = collection_facts.query(
-        query_texts=[query_text],
-        n_results=2 # 拿 2 個事實
-    )
-    
-    # 2. 再搜「對話歷史」(Chat)
-    chat_results = collection_chat.query(
-        query_texts=[query_text],
-        n_results=n_results + 2 # 多拿一點來過濾
-    )
-    
-    final_memories = []
-
-    # --- 處理事實 (Facts) ---
-    if fact_results['documents']:
-        for doc, dist in zip(fact_results['documents'][0], fact_results['distances'][0]):
-            # Chroma 的 cosine distance: 0 (完全一樣) ~ 1 (完全不同)
-            # 我們只要距離夠近的
-            if dist < threshold: 
-                final_memories.append(f"【重要設定】{doc}")
-
-    # --- 處理對話 (Chat) ---
-    # 我們需要把結果拿出來做「時間排序」，讓最近的對話優先級稍微高一點
-    temp_chats = []
-    if chat_results['documents']:
-        for doc, meta, dist in zip(chat_results['documents'][0], chat_results['metadatas'][0], chat_results['distances'][0]):
-            if dist < threshold:
-                temp_chats.append({
-                    "text": doc,
-                    "date": meta["timestamp"],
-                    "distance": dist
-                })
-    
-    # 🔥 升級 4: 簡單的時間加權邏輯
-    # 如果兩者相似度差不多，優先選時間比較近的
-    # 這裡簡單處理：直接按照相似度排序 (Chroma 預設已排好)，但我們只取前 N 個有效結果
-    
-    for item in temp_chats:
-        final_memories.append(item["text"])
-
-    # 限制回傳數量
-    final_memories = final_memories[:n_results]
-    
-    if not final_memories:
-        return [] # 沒相關記憶就回傳空，不要硬塞
-        
+# memory_chroma.py (Pro 加強版)
+
+import chromadb
+from chromadb.utils import embedding_functions
+import datetime
+import uuid
+import os
+import json
+import queue
+import threading
+import time
+import atexit
+from collections import OrderedDict
+
+# 💾 資料庫設定
+DB_PATH = "./chroma_db"
+
+# 建立資料夾 (如果不存在)
+if not os.path.exists(DB_PATH):
+    os.makedirs(DB_PATH)
+
+client = chromadb.PersistentClient(path=DB_PATH)
+
+# 🔥 升級 1: 使用支援多語言更強的模型
+# 如果第一次跑會下載稍微久一點 (約 400MB)，但中文效果好很多
+MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+
+print(f"[記憶系統] 載入嵌入模型: {MODEL_NAME}...")
+emb_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
+    model_name=MODEL_NAME
+)
+
+# 建立兩個集合：一個存流水帳 (Chat)，一個存重要事實 (Facts)
+collection_chat = client.get_or_create_collection(
+    name="chat_history",
+    embedding_function=emb_fn,
+    metadata={"hnsw:space": "cosine"} # 使用餘弦相似度，0~1 之間，越小越相似
+)
+
+collection_facts = client.get_or_create_collection(
+    name="core_facts",
+    embedding_function=emb_fn,
+    metadata={"hnsw:space": "cosine"}
+)
+
+def _get_timestamp():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# ==========================================
+# ✍️ 非同步寫入 (write-behind)
+# ==========================================
+# add_memory 只把資料丟進佇列就返回；背景執行緒累積一批後
+# 一次 batch 算 embedding + 一次寫入 Chroma，不佔用使用者這一輪的時間。
+MEMORY_BATCH_SIZE = 16          # 累積幾筆就寫入
+MEMORY_FLUSH_INTERVAL = 2.0     # 最多等幾秒就寫入
+# 尚未寫入 Chroma 的記憶先記在這個日誌檔，程式當掉重開也不會遺失
+PENDING_JOURNAL = os.path.join(DB_PATH, "pending_memories.jsonl")
+
+_write_queue = queue.Queue()
+_journal_lock = threading.Lock()
+_pending = {}  # id -> record (尚未寫入 Chroma)
+
+def _rewrite_journal():
+    """把目前還沒寫入的記憶重寫到日誌 (呼叫端需持有 _journal_lock)"""
+    tmp_path = PENDING_JOURNAL + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in _pending.values():
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, PENDING_JOURNAL)
+
+def _write_batch(records):
+    """一次 batch 編碼 + 寫入；用 upsert，重播日誌時不會重複"""
+    documents = [r["document"] for r in records]
+    collection_chat.upsert(
+        ids=[r["id"] for r in records],
+        documents=documents,
+        embeddings=emb_fn(documents),
+        metadatas=[r["metadata"] for r in records]
+    )
+    with _journal_lock:
+        for r in records:
+            _pending.pop(r["id"], None)
+        _rewrite_journal()
+
+def _writer_loop():
+    batch = []
+    first_at = None
+    stopping = False
+    while not stopping:
+        timeout = None if not batch else max(0.0, MEMORY_FLUSH_INTERVAL - (time.time() - first_at))
+        try:
+            record = _write_queue.get(timeout=timeout)
+            if record is None:
+                stopping = True
+            else:
+                if not batch:
+                    first_at = time.time()
+                batch.append(record)
+        except queue.Empty:
+            pass
+
+        if batch and (stopping or len(batch) >= MEMORY_BATCH_SIZE or time.time() - first_at >= MEMORY_FLUSH_INTERVAL):
+            try:
+                _write_batch(batch)
+            except Exception as e:
+                # 寫入失敗的資料還留在日誌裡，下次啟動會重試
+                print(f"❌ [記憶] 批次寫入失敗 ({len(batch)} 筆): {e}")
+            for _ in batch:
+                _write_queue.task_done()
+            batch = []
+            _maybe_run_maintenance()
+
+        if stopping:
+            _write_queue.task_done()
+
+def _replay_journal():
+    """啟動時把上次沒寫完的記憶補寫進去"""
+    if not os.path.exists(PENDING_JOURNAL):
+        return
+    records = []
+    with open(PENDING_JOURNAL, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    if records:
+        print(f"♻️ [記憶] 補寫上次未完成的記憶: {len(records)} 筆")
+        with _journal_lock:
+            for r in records:
+                _pending[r["id"]] = r
+        _write_batch(records)
+
+def add_memory(text: str, speaker: str):
+    """一般對話記憶 (流水帳)：非同步寫入，立即返回"""
+    timestamp = _get_timestamp()
+    full_text = f"[{timestamp}] {speaker}: {text}"
+    record = {
+        "id": str(uuid.uuid4()),
+        "document": full_text,
+        "metadata": {"speaker": speaker, "timestamp": timestamp, "type": "chat", "ts": time.time()},
+    }
+
+    # 先寫日誌 (append 很快)，再交給背景執行緒
+    with _journal_lock:
+        _pending[record["id"]] = record
+        with open(PENDING_JOURNAL, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    _write_queue.put(record)
+
+def flush_memory():
+    """等待佇列中的記憶全部寫入 Chroma"""
+    _write_queue.join()
+
+def _shutdown_writer():
+    """程式結束時把剩下的記憶寫完"""
+    _write_queue.put(None)
+    _writer_thread.join(timeout=30)
+
+# ==========================================
+# 🗂️ 記憶保留策略 (時間衰減 / 壓縮 / 上限)
+# ==========================================
+# 時間衰減：排序分數 = (1 - w) * 距離 + w * 年紀懲罰，年紀懲罰每經過半衰期增加一半
+MEMORY_DECAY_WEIGHT = 0.2
+MEMORY_HALF_LIFE_DAYS = 30
+# 壓縮：超過幾天的對話，按日期每 N 句合併成一則摘要，並刪掉原文
+CHAT_COMPACT_AGE_DAYS = 7
+SUMMARY_GROUP_SIZE = 20
+SUMMARY_LINE_CHARS = 80
+SUMMARY_MAX_CHARS = 1500
+# 對話集合最多保留的向量數 (超過時刪最舊的)
+MAX_CHAT_VECTORS = 20000
+# 背景維護的間隔 (秒)，在寫入執行緒中執行，不影響查詢
+MEMORY_MAINTENANCE_INTERVAL = 60 * 60
+
+_last_maintenance = 0.0
+
+def _record_time(meta):
+    """取得記憶的時間 (epoch 秒)；舊資料沒有 ts 欄位就解析 timestamp 字串"""
+    if meta.get("ts") is not None:
+        return float(meta["ts"])
+    try:
+        return datetime.datetime.strptime(meta["timestamp"], "%Y-%m-%d %H:%M:%S").timestamp()
+    except (KeyError, ValueError):
+        return 0.0
+
+def _decayed_score(distance, meta, now):
+    age_days = max(0.0, now - _record_time(meta)) / 86400
+    age_penalty = 1 - 0.5 ** (age_days / MEMORY_HALF_LIFE_DAYS)
+    return (1 - MEMORY_DECAY_WEIGHT) * distance + MEMORY_DECAY_WEIGHT * age_penalty
+
+def _extractive_summary(documents):
+    """預設摘要方式：每句截短後串起來 (不需要呼叫 LLM)"""
+    lines = []
+    for doc in documents:
+        # 去掉 "[時間] " 前綴，只留 "說話者: 內容"
+        text = doc.split("] ", 1)[-1].replace("\n", " ")
+        if len(text) > SUMMARY_LINE_CHARS:
+            text = text[:SUMMARY_LINE_CHARS] + "…"
+        lines.append(text)
+    return "\n".join(lines)[:SUMMARY_MAX_CHARS]
+
+def compact_memory(older_than_days: float = CHAT_COMPACT_AGE_DAYS, summarizer=None):
+    """
+    把舊對話合併成摘要並刪除原文。
+    summarizer: 自訂摘要函數 (list[str] -> str)，例如交給 LLM；預設為截短串接。
+    回傳 (刪除的原文數, 新增的摘要數)
+    """
+    summarizer = summarizer or _extractive_summary
+    cutoff = time.time() - older_than_days * 86400
+
+    result = collection_chat.get(where={"type": "chat"}, include=["documents", "metadatas"])
+    old_items = [
+        (_record_time(meta), item_id, doc, meta)
+        for item_id, doc, meta in zip(result["ids"], result["documents"], result["metadatas"])
+        if _record_time(meta) < cutoff
+    ]
+    if not old_items:
+        return 0, 0
+    old_items.sort(key=lambda item: item[0])
+
+    # 依日期分組，每組最多 SUMMARY_GROUP_SIZE 句
+    groups = {}
+    for item in old_items:
+        day = item[3].get("timestamp", "")[:10]
+        groups.setdefault(day, []).append(item)
+
+    summary_ids, summary_docs, summary_metas, removed_ids = [], [], [], []
+    for day, items in groups.items():
+        for start in range(0, len(items), SUMMARY_GROUP_SIZE):
+            chunk = items[start:start + SUMMARY_GROUP_SIZE]
+            last_ts, _, _, last_meta = chunk[-1]
+            summary_ids.append(str(uuid.uuid4()))
+            summary_docs.append(f"[{last_meta.get('timestamp', day)}] 對話摘要:\n{summarizer([c[2] for c in chunk])}")
+            summary_metas.append({
+                "speaker": "summary", "timestamp": last_meta.get("timestamp", day),
+                "type": "summary", "ts": last_ts, "merged": len(chunk)
+            })
+            removed_ids.extend(c[1] for c in chunk)
+
+    # 先寫摘要再刪原文，中途失敗也不會遺失內容
+    collection_chat.upsert(
+        ids=summary_ids,
+        documents=summary_docs,
+        embeddings=emb_fn(summary_docs),
+        metadatas=summary_metas
+    )
+    collection_chat.delete(ids=removed_ids)
+    print(f"🗜️ [記憶] 壓縮舊對話: {len(removed_ids)} 句 -> {len(summary_ids)} 則摘要")
+    return len(removed_ids), len(summary_ids)
+
+def enforce_memory_cap(max_vectors: int = MAX_CHAT_VECTORS):
+    """對話集合超過上限時刪除最舊的向量，回傳刪除數量"""
+    excess = collection_chat.count() - max_vectors
+    if excess <= 0:
+        return 0
+    result = collection_chat.get(include=["metadatas"])
+    ordered = sorted(zip(result["ids"], result["metadatas"]), key=lambda item: _record_time(item[1]))
+    doomed = [item_id for item_id, _ in ordered[:excess]]
+    collection_chat.delete(ids=doomed)
+    print(f"🧹 [記憶] 超過上限 {max_vectors}，刪除最舊的 {len(doomed)} 筆")
+    return len(doomed)
+
+def run_memory_maintenance():
+    """壓縮舊對話 + 控制總量 (也可以手動呼叫)"""
+    global _last_maintenance
+    _last_maintenance = time.time()
+    try:
+        compact_memory()
+        enforce_memory_cap()
+    except Exception as e:
+        print(f"❌ [記憶] 維護失敗: {e}")
+
+def _maybe_run_maintenance():
+    if time.time() - _last_maintenance >= MEMORY_MAINTENANCE_INTERVAL:
+        run_memory_maintenance()
+
+try:
+    _replay_journal()
+except Exception as e:
+    print(f"❌ [記憶] 補寫日誌失敗: {e}")
+
+_writer_thread = threading.Thread(target=_writer_loop, daemon=True)
+_writer_thread.start()
+atexit.register(_shutdown_writer)
+
+def add_important_fact(text: str):
+    """
+    🔥 升級 2: 重要事實記憶 (例如：使用者名字、居住地、喜好)
+    這些記憶在搜尋時會有較高的優先級
+    """
+    timestamp = _get_timestamp()
+    # 事實不需要加 Speaker，直接存內容
+    full_text = f"[{timestamp}] 重要情報: {text}"
+    
+    collection_facts.add(
+        documents=[full_text],
+        metadatas=[{"timestamp": timestamp, "type": "fact"}],
+        ids=[str(uuid.uuid4())]
+    )
+    print(f"⭐ [記憶] 已寫入重要事實: {text}")
+
+# ==========================================
+# 🔍 查詢向量快取
+# ==========================================
+# 同一句話只算一次 embedding，facts / chat 兩個集合共用；最近的查詢放 LRU
+QUERY_EMBEDDING_CACHE_SIZE = 128
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+def _embed_queries(query_texts):
+    """取得多個查詢的向量：快取有的直接用，沒有的一次 batch 編碼"""
+    embeddings = [None] * len(query_texts)
+    missing = []
+    with _query_cache_lock:
+        for i, text in enumerate(query_texts):
+            if text in _query_cache:
+                _query_cache.move_to_end(text)
+                embeddings[i] = _query_cache[text]
+            else:
+                missing.append(i)
+
+    if missing:
+        unique_texts = list(dict.fromkeys(query_texts[i] for i in missing))
+        computed = {text: [float(x) for x in emb] for text, emb in zip(unique_texts, emb_fn(unique_texts))}
+        with _query_cache_lock:
+            for text, emb in computed.items():
+                _query_cache[text] = emb
+                _query_cache.move_to_end(text)
+            while len(_query_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+        for i in missing:
+            embeddings[i] = computed[query_texts[i]]
+
+    return embeddings
+
+def _collect_memories(fact_results, chat_results, idx, n_results, threshold):
+    """整理第 idx 個查詢的結果 (事實優先，再放對話)"""
+    final_memories = []
+
+    # --- 處理事實 (Facts) ---
+    if fact_results['documents']:
+        for doc, dist in zip(fact_results['documents'][idx], fact_results['distances'][idx]):
+            # Chroma 的 cosine distance: 0 (完全一樣) ~ 1 (完全不同)
+            # 我們只要距離夠近的
+            if dist < threshold: 
+                final_memories.append(f"【重要設定】{doc}")
+
+    # --- 處理對話 (Chat) ---
+    # 我們需要把結果拿出來做「時間排序」，讓最近的對話優先級稍微高一點
+    temp_chats = []
+    now = time.time()
+    if chat_results['documents']:
+        for doc, meta, dist in zip(chat_results['documents'][idx], chat_results['metadatas'][idx], chat_results['distances'][idx]):
+            if dist < threshold:
+                temp_chats.append({
+                    "text": doc,
+                    "date": meta["timestamp"],
+                    "distance": dist,
+                    "score": _decayed_score(dist, meta, now)
+                })
+    
+    # 🔥 升級 4: 時間加權
+    # 分數 = 距離與「年紀」的混合，相似度差不多時優先選時間比較近的
+    temp_chats.sort(key=lambda item: item["score"])
+    
+    for item in temp_chats:
+        final_memories.append(item["text"])
+
+    # 限制回傳數量
+    return final_memories[:n_results]
+
+def search_memory_many(query_texts, n_results: int = 3, threshold: float = 0.4):
+    """
+    一次查多句話 (每句各回傳一個記憶清單，順序對應 query_texts)
+    所有查詢 batch 編碼一次，兩個集合各只查詢一次。
+    """
+    if not query_texts:
+        return []
+    query_embeddings = _embed_queries(list(query_texts))
+
+    # 1. 先搜「重要事實」(Facts) - 權重高
+    fact_results = collection_facts.query(
+        query_embeddings=query_embeddings,
+        n_results=2 # 拿 2 個事實
+    )
+    
+    # 2. 再搜「對話歷史」(Chat)
+    chat_results = collection_chat.query(
+        query_embeddings=query_embeddings,
+        n_results=n_results + 2 # 多拿一點來過濾
+    )
+
+    return [
+        _collect_memories(fact_results, chat_results, i, n_results, threshold)
+        for i in range(len(query_texts))
+    ]
+
+def search_memory(query_text: str, n_results: int = 3, threshold: float = 0.4):
+    """
+    🔥 升級 3: 混合搜尋 + 品質過濾
+    threshold: 相似度門檻 (0~1)，距離大於此值(越不相關)則丟棄。
+    建議值 0.3~0.5。如果 AI 常常瞎掰無關的回憶，把這個值調低 (e.g. 0.3)。
+    查詢句只編碼一次 (有快取)，兩個集合共用同一個向量。
+    """
+    final_memories = search_memory_many([query_text], n_results=n_results, threshold=threshold)[0]
+    
+    if not final_memories:
+        return [] # 沒相關記憶就回傳空，不要硬塞
+        
     return final_memories
\ No newline at end of file
@@ -0,0 +1,256 @@
+# ollama_client.py (共用 Ollama 連線)
+
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ==========================================
+# 🔧 設定區
+# ==========================================
+OLLAMA_HOST = "http://127.0.0.1:11434"
+
+# 連線逾時 (本機服務，連不上就是沒開，不必久等)
+CONNECT_TIMEOUT = 3
+# 預設讀取逾時 (秒)；串流時是「兩個 chunk 之間」的最長等待
+DEFAULT_READ_TIMEOUT = 120
+# 健康狀態快取秒數，期間內不再重複打 health check
+HEALTH_CHECK_TTL = 30
+
+# --- 模型常駐管理 (工具 / 對話 / 視覺模型共用同一塊 VRAM) ---
+# 依最近 USAGE_WINDOW 秒內的使用次數決定 keep_alive：常用的留久一點，少用的早點讓出 VRAM
+USAGE_WINDOW = 30 * 60
+KEEP_ALIVE_TIERS = [(6, "30m"), (2, "10m"), (0, "3m")]
+# /api/ps (目前載入的模型) 快取秒數；請求路徑上只讀快取，過期時在背景更新
+LOADED_MODELS_TTL = 5
+# 載入時間超過這個秒數就記錄為冷載入
+COLD_LOAD_LOG_SECONDS = 1.0
+
+# 🔥 所有 Ollama 請求共用同一個 Session：keep-alive 連線池，不用每次重新建立 TCP 連線
+session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    # 只重試「連線失敗」(請求根本沒送出去)，避免重複生成
+    max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2),
+)
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
+
+_health_lock = threading.Lock()
+_health = {"ok": None, "checked_at": 0.0}
+
+
+def _mark_health(ok):
+    with _health_lock:
+        _health["ok"] = ok
+        _health["checked_at"] = time.time()
+
+
+def is_healthy(force=False):
+    """Ollama 是否在線 (結果快取 HEALTH_CHECK_TTL 秒，正常請求成功也會更新狀態)"""
+    with _health_lock:
+        fresh = time.time() - _health["checked_at"] < HEALTH_CHECK_TTL
+        if not force and fresh and _health["ok"] is not None:
+            return _health["ok"]
+
+    try:
+        ok = session.get(f"{OLLAMA_HOST}/api/version", timeout=CONNECT_TIMEOUT).status_code == 200
+    except requests.exceptions.RequestException:
+        ok = False
+    _mark_health(ok)
+    return ok
+
+
+# ==========================================
+# 🧊 模型常駐管理
+# ==========================================
+_residency_lock = threading.Lock()
+_usage = {}                       # model -> deque[使用時間]
+_loaded = {"models": set(), "checked_at": 0.0, "refreshing": False}
+_cold_loads = {}                  # model -> 冷載入次數
+_prewarming = set()
+
+
+def loaded_models(force=False):
+    """目前 Ollama 已載入 VRAM 的模型 (查 /api/ps，結果快取 LOADED_MODELS_TTL 秒)"""
+    with _residency_lock:
+        if not force and time.time() - _loaded["checked_at"] < LOADED_MODELS_TTL:
+            return set(_loaded["models"])
+    try:
+        response = session.get(f"{OLLAMA_HOST}/api/ps", timeout=CONNECT_TIMEOUT)
+        models = {m.get("name") or m.get("model") for m in response.json().get("models", [])}
+    except (requests.exceptions.RequestException, ValueError):
+        return set()
+    with _residency_lock:
+        _loaded["models"] = models
+        _loaded["checked_at"] = time.time()
+    return set(models)
+
+
+def _refresh_loaded_models():
+    """快取過期時在背景查一次 /api/ps (同時只跑一個)，呼叫端不用等"""
+    with _residency_lock:
+        if _loaded["refreshing"] or time.time() - _loaded["checked_at"] < LOADED_MODELS_TTL:
+            return
+        _loaded["refreshing"] = True
+
+    def _run():
+        try:
+            loaded_models(force=True)
+        finally:
+            with _residency_lock:
+                _loaded["refreshing"] = False
+
+    threading.Thread(target=_run, daemon=True).start()
+
+
+def keep_alive_for(model):
+    """依最近的使用頻率決定這個模型的 keep_alive"""
+    now = time.time()
+    with _residency_lock:
+        uses = _usage.get(model)
+        count = 0
+        if uses:
+            while uses and now - uses[0] > USAGE_WINDOW:
+                uses.popleft()
+            count = len(uses)
+    for min_uses, keep_alive in KEEP_ALIVE_TIERS:
+        if count >= min_uses:
+            return keep_alive
+    return KEEP_ALIVE_TIERS[-1][1]
+
+
+def _note_use(model):
+    with _residency_lock:
+        _usage.setdefault(model, deque()).append(time.time())
+
+
+def _note_loaded(model, load_seconds):
+    with _residency_lock:
+        _loaded["models"].add(model)
+        if load_seconds >= COLD_LOAD_LOG_SECONDS:
+            _cold_loads[model] = _cold_loads.get(model, 0) + 1
+    if load_seconds >= COLD_LOAD_LOG_SECONDS:
+        print(f"🥶 [模型] {model} 冷載入 {load_seconds:.1f} 秒")
+
+
+def prewarm(model):
+    """背景預先載入模型 (例如使用者一上傳圖片就先載視覺模型)；已載入或正在載入就不動作"""
+    with _residency_lock:
+        if model in _prewarming:
+            return
+        _prewarming.add(model)
+
+    def _run():
+        try:
+            if model in loaded_models():
+                return
+            print(f"🔥 [模型] 背景預熱 {model}")
+            # 沒有 prompt 的 generate 只會載入模型；自己帶 keep_alive，不算一次使用
+            response = generate({"model": model, "keep_alive": keep_alive_for(model)}, timeout=DEFAULT_READ_TIMEOUT)
+            if response.status_code == 200:
+                with _residency_lock:
+                    _loaded["models"].add(model)
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️ [模型] 預熱 {model} 失敗: {e}")
+        finally:
+            with _residency_lock:
+                _prewarming.discard(model)
+
+    threading.Thread(target=_run, daemon=True).start()
+
+
+def get_residency_stats():
+    """各模型的使用次數 (USAGE_WINDOW 內)、目前 keep_alive 與冷載入次數"""
+    with _residency_lock:
+        models = set(_usage) | set(_cold_loads)
+        cold_loads = dict(_cold_loads)
+        loaded = set(_loaded["models"])
+    stats = {}
+    for model in models:
+        keep_alive = keep_alive_for(model)
+        with _residency_lock:
+            uses = len(_usage.get(model, ()))
+        stats[model] = {
+            "uses": uses,
+            "keep_alive": keep_alive,
+            "cold_loads": cold_loads.get(model, 0),
+            "loaded": model in loaded,
+        }
+    return stats
+
+
+def post(path, payload, stream=False, timeout=DEFAULT_READ_TIMEOUT):
+    """
+    發送請求給 Ollama (path 例如 "/api/chat")，回傳 requests.Response。
+    timeout=None 代表不限制讀取時間 (連線逾時仍然是 CONNECT_TIMEOUT)。
+    chat / generate 沒有指定 keep_alive 時，會依使用頻率自動帶入。
+    """
+    model = payload.get("model")
+    managed = path in ("/api/chat", "/api/generate") and model and "keep_alive" not in payload
+    was_loaded = True
+    if managed:
+        _note_use(model)
+        if stream:
+            # 只有串流要用來估冷載入時間；讀快取就好，不在請求前多打一次 /api/ps
+            with _residency_lock:
+                was_loaded = model in _loaded["models"]
+        payload = dict(payload, keep_alive=keep_alive_for(model))
+
+    start_time = time.time()
+    try:
+        response = session.post(
+            f"{OLLAMA_HOST}{path}",
+            json=payload,
+            stream=stream,
+            timeout=(CONNECT_TIMEOUT, timeout),
+        )
+    except requests.exceptions.ConnectionError:
+        _mark_health(False)
+        raise
+    # 只有成功的回應才算在線；5xx 代表 Ollama 本身出問題，4xx (例如模型不存在) 是請求的問題，不更新狀態
+    if response.ok:
+        _mark_health(True)
+    elif response.status_code >= 500:
+        _mark_health(False)
+
+    if managed and response.status_code == 200:
+        if not stream:
+            # 非串流回應有 load_duration (奈秒)
+            try:
+                _note_loaded(model, response.json().get("load_duration", 0) / 1e9)
+            except ValueError:
+                pass
+        elif not was_loaded:
+            # 串流時 Ollama 要等模型載入完才送出 header，等待時間約等於載入時間
+            _note_loaded(model, time.time() - start_time)
+        else:
+            _note_loaded(model, 0.0)
+    if managed:
+        # 其他模型可能已經被 Ollama 換出 VRAM；回應之後才在背景更新，不佔用這次請求的時間
+        _refresh_loaded_models()
+    return response
+
+
+def chat(payload, stream=False, timeout=DEFAULT_READ_TIMEOUT):
+    """呼叫 /api/chat"""
+    return post("/api/chat", payload, stream=stream, timeout=timeout)
+
+
+def generate(payload, stream=False, timeout=DEFAULT_READ_TIMEOUT):
+    """呼叫 /api/generate"""
+    return post("/api/generate", payload, stream=stream, timeout=timeout)
+
+
+def unload(model, timeout=2):
+    """通知 Ollama 釋放指定模型的顯卡資源"""
+    try:
+        generate({"model": model, "keep_alive": 0}, timeout=timeout)
+    except requests.exceptions.RequestException:
+        pass
+    with _residency_lock:
+        _loaded["models"].discard(model)
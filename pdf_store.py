@@ -0,0 +1,484 @@
+# pdf_store.py (PDF 上傳存檔 + 頁面圖片快取)
+
+import hashlib
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from cache_store import PersistentCache
+
+# PyMuPDF 是選配：沒裝的話呼叫端會收到錯誤訊息
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+# ==========================================
+# 🔧 設定區
+# ==========================================
+# 上傳的 PDF 以內容 sha256 存檔，同一份檔案只存一次
+PDF_STORE_DIR = "./cache/pdf_uploads"
+# 轉好的頁面圖片 (JPEG)，以 (hash, 頁碼, dpi) 為 key
+PAGE_CACHE_DIR = "./cache/pdf_pages"
+# 磁碟用量上限 (bytes)：超過時刪掉最久沒用到的檔案 (PDF 會連同它的頁面圖片一起刪)
+PDF_STORE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+PAGE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# 記憶體中保留的頁面圖片數量 (300 dpi 一頁約 0.5~1 MB)
+PAGE_MEMORY_CACHE_SIZE = 32
+PDF_RENDER_DPI = 300
+# 多頁同時轉圖時最多開幾個子行程
+PDF_RENDER_WORKERS = 4
+PDF_RENDER_TIMEOUT = 120
+# 一次請求最多處理幾頁 (視覺模型一頁要好幾秒)
+MAX_PDF_PAGES_PER_REQUEST = 10
+
+# --- 文字層判斷 ---
+# 文字層至少要有幾個非空白字元才算有內容 (少於此值視為掃描頁)
+PDF_TEXT_MIN_CHARS = 20
+# 亂碼字元 (U+FFFD / 私用區，常見於數學字型缺 ToUnicode 對照) 比例上限
+PDF_TEXT_MAX_BAD_RATIO = 0.02
+# 圖片佔頁面超過這個比例就當成掃描頁，整頁交給視覺模型
+PDF_SCANNED_IMAGE_RATIO = 0.8
+# 文字頁中的圖片區塊：面積超過頁面這個比例才另外送 OCR (小 icon 略過)
+PDF_REGION_MIN_AREA_RATIO = 0.05
+PDF_REGION_DPI = 200
+# 公式密集的文字區塊：文字層會把上下標、分數攤平成一行，改送 OCR
+# 數學字型 (CMMI / Cambria Math ...) 或數學符號佔區塊字數超過這個比例，就當成算式區塊
+PDF_MATH_BLOCK_RATIO = 0.4
+# 算式區塊的字數佔整頁超過這個比例，或算式區塊太多，就整頁交給視覺模型 (比切很多小塊準)
+PDF_MATH_PAGE_RATIO = 0.35
+PDF_MAX_MATH_REGIONS = 6
+# 算式區塊轉圖時四周多留的邊 (PDF 點數)，避免切到上下標
+PDF_MATH_REGION_PADDING = 4
+# 文字層分析結果在記憶體中保留幾頁
+PDF_TEXT_LAYER_CACHE_SIZE = 256
+# 區域 OCR 結果 (同一份 PDF 的同一塊區域只辨識一次)
+PDF_REGION_OCR_TTL = 30 * 24 * 60 * 60
+
+for _dir in (PDF_STORE_DIR, PAGE_CACHE_DIR):
+    if not os.path.exists(_dir):
+        os.makedirs(_dir)
+
+_lock = threading.Lock()
+_page_memory = OrderedDict()  # (hash, page, dpi) -> jpeg bytes
+_page_counts = {}             # hash -> 總頁數
+_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+_text_layers = OrderedDict()  # (hash, 頁碼) -> extract_page_layer 的結果 (LRU)
+_region_ocr_cache = PersistentCache("pdf_region_ocr", ttl=PDF_REGION_OCR_TTL, max_entries=5000)
+
+_MATH_CHARS = set("=+-−×÷*/^√∑∏∫∂∞≤≥≠≈±→πθαβγδλμσφω()[]{}|<>")
+# TeX (CMMI / CMSY / CMEX / MSAM / MSBM ...)、Cambria Math、STIX、Symbol 等數學字型
+_MATH_FONT_PATTERN = re.compile(r"^(cmmi|cmsy|cmex|cmbsy|msam|msbm|eufm|eusm|rsfs|stix|symbol|mt-?extra|euclid)|math", re.I)
+
+
+def _touch(path):
+    """更新修改時間，淘汰時以此判斷「最近用過」"""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _files_by_age(directory):
+    """回傳 [(mtime, 大小, 路徑)]，最舊的在前面 (暫存檔不算)"""
+    files = []
+    for name in os.listdir(directory):
+        if name.endswith(".tmp"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+    return sorted(files)
+
+
+def _forget_pdf(pdf_hash):
+    """刪掉某份 PDF 的頁面圖片與記憶體中的資料"""
+    for name in os.listdir(PAGE_CACHE_DIR):
+        if name.startswith(f"{pdf_hash}_p"):
+            try:
+                os.remove(os.path.join(PAGE_CACHE_DIR, name))
+            except OSError:
+                pass
+    with _lock:
+        _page_counts.pop(pdf_hash, None)
+        for key in [k for k in _page_memory if k[0] == pdf_hash]:
+            del _page_memory[key]
+        for key in [k for k in _text_layers if k[0] == pdf_hash]:
+            del _text_layers[key]
+
+
+def _enforce_disk_limits(keep_hash=None):
+    """PDF 存檔區 / 頁面快取超過上限時，從最久沒用到的開始刪 (正在處理的 keep_hash 不刪)"""
+    removed = 0
+    files = _files_by_age(PDF_STORE_DIR)
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= PDF_STORE_MAX_BYTES:
+            break
+        pdf_hash = os.path.splitext(os.path.basename(path))[0]
+        if pdf_hash == keep_hash:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        _forget_pdf(pdf_hash)
+        total -= size
+        removed += 1
+
+    files = _files_by_age(PAGE_CACHE_DIR)
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= PAGE_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        print(f"🧹 [PDF] 磁碟快取超過上限，已刪除 {removed} 個最久沒用的檔案")
+
+
+def save_pdf(pdf_bytes):
+    """以內容 hash 存檔並回傳 hash；已經存過就直接回傳"""
+    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    path = pdf_path(pdf_hash)
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, path)
+        _enforce_disk_limits(keep_hash=pdf_hash)
+    else:
+        _touch(path)
+    return pdf_hash
+
+
+def adopt_pdf_file(file_path, pdf_hash):
+    """把已經寫在磁碟上的 PDF (例如分段上傳完成的檔案) 直接搬進存檔區，不讀進記憶體"""
+    path = pdf_path(pdf_hash)
+    if os.path.exists(path):
+        os.remove(file_path)
+        _touch(path)
+    else:
+        os.replace(file_path, path)
+        _enforce_disk_limits(keep_hash=pdf_hash)
+    return pdf_hash
+
+
+def pdf_path(pdf_hash):
+    return os.path.join(PDF_STORE_DIR, f"{pdf_hash}.pdf")
+
+
+def has_pdf(pdf_hash):
+    return os.path.exists(pdf_path(pdf_hash))
+
+
+def get_page_count(pdf_hash):
+    """總頁數 (每次處理 PDF 都會先呼叫，順便標記這份 PDF 最近用過)"""
+    _touch(pdf_path(pdf_hash))
+    with _lock:
+        if pdf_hash in _page_counts:
+            return _page_counts[pdf_hash]
+    with fitz.open(pdf_path(pdf_hash)) as doc:
+        count = len(doc)
+    with _lock:
+        _page_counts[pdf_hash] = count
+    return count
+
+
+def parse_page_spec(spec, total_pages):
+    """
+    解析頁碼字串，回傳排序好的頁碼 list (從 1 開始)。
+    支援 "3"、"1-3"、"1,3,5-7"、"all" / "全部"；格式錯誤或超出範圍會丟 ValueError。
+    """
+    text = str(spec).strip().lower().replace("，", ",").replace("~", "-").replace(" ", "")
+    if text in ("", "all", "全部"):
+        pages = list(range(1, total_pages + 1))
+    else:
+        pages = set()
+        for part in text.split(","):
+            if not part:
+                continue
+            if "-" in part:
+                start, end = part.split("-", 1)
+                start, end = int(start), int(end)
+                if start > end:
+                    start, end = end, start
+                pages.update(range(start, end + 1))
+            else:
+                pages.add(int(part))
+        pages = sorted(pages)
+
+    if not pages:
+        raise ValueError(f"無法解析頁碼: {spec}")
+    out_of_range = [p for p in pages if p < 1 or p > total_pages]
+    if out_of_range:
+        raise ValueError(f"PDF 只有 {total_pages} 頁，您要求的第 {out_of_range[0]} 頁超出範圍。")
+    if len(pages) > MAX_PDF_PAGES_PER_REQUEST:
+        raise ValueError(f"一次最多處理 {MAX_PDF_PAGES_PER_REQUEST} 頁，您要求了 {len(pages)} 頁。")
+    return pages
+
+
+def _page_file(pdf_hash, page, dpi):
+    return os.path.join(PAGE_CACHE_DIR, f"{pdf_hash}_p{page}_{dpi}.jpg")
+
+
+def _remember(key, image_bytes):
+    """放進記憶體 LRU (呼叫端需持有 _lock)"""
+    _page_memory[key] = image_bytes
+    _page_memory.move_to_end(key)
+    while len(_page_memory) > PAGE_MEMORY_CACHE_SIZE:
+        _page_memory.popitem(last=False)
+
+
+def _render_to_files(path, dpi, pages):
+    """開一次 PDF，把指定頁面轉成 JPEG 寫進頁面快取 (主行程與子行程共用)"""
+    pdf_hash = os.path.splitext(os.path.basename(path))[0]
+    with fitz.open(path) as doc:
+        for page in pages:
+            pix = doc.load_page(page - 1).get_pixmap(dpi=dpi)
+            out_path = _page_file(pdf_hash, page, dpi)
+            tmp_path = f"{out_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(pix.tobytes("jpeg"))
+            os.replace(tmp_path, out_path)
+
+
+def _render_parallel(pdf_hash, dpi, pages):
+    """
+    多頁分給幾個子行程平行轉圖。
+    不用 multiprocessing：Windows 的 spawn 會在每個 worker 重新 import 主程式
+    (app.py -> Whisper / 嵌入模型)，所以直接用 python pdf_store.py --render 啟動輕量子行程。
+    """
+    workers = min(PDF_RENDER_WORKERS, len(pages))
+    if workers <= 1:
+        _render_to_files(pdf_path(pdf_hash), dpi, pages)
+        return
+
+    procs = []
+    try:
+        for i in range(workers):
+            chunk = pages[i::workers]
+            procs.append(subprocess.Popen(
+                [sys.executable, __file__, "--render", pdf_path(pdf_hash), str(dpi)] + [str(p) for p in chunk],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            ))
+        # 所有子行程共用同一個期限
+        deadline = time.time() + PDF_RENDER_TIMEOUT
+        for proc in procs:
+            try:
+                _, err = proc.communicate(timeout=max(0.0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                raise RuntimeError(f"PDF 轉圖超過 {PDF_RENDER_TIMEOUT} 秒")
+            if proc.returncode != 0:
+                raise RuntimeError(f"PDF 轉圖子行程失敗: {err.decode('utf-8', 'ignore').strip()[-300:]}")
+    finally:
+        # 逾時或任一個失敗時，其他還在跑的子行程也一起砍掉
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+
+def render_pages(pdf_hash, pages, dpi=PDF_RENDER_DPI):
+    """回傳各頁的 JPEG bytes (順序與 pages 相同)；快取沒有的頁面才會轉圖"""
+    results = {}
+    missing = []
+    with _lock:
+        for page in pages:
+            key = (pdf_hash, page, dpi)
+            if key in _page_memory:
+                _page_memory.move_to_end(key)
+                results[page] = _page_memory[key]
+                _stats["hits"] += 1
+
+    for page in pages:
+        if page in results:
+            continue
+        page_file = _page_file(pdf_hash, page, dpi)
+        if os.path.exists(page_file):
+            with open(page_file, "rb") as f:
+                results[page] = f.read()
+            _touch(page_file)
+            with _lock:
+                _remember((pdf_hash, page, dpi), results[page])
+                _stats["disk_hits"] += 1
+        else:
+            missing.append(page)
+
+    if missing:
+        print(f"🖨️ [PDF] 轉圖中: 第 {', '.join(map(str, missing))} 頁 ({dpi} dpi)")
+        _render_parallel(pdf_hash, dpi, missing)
+        for page in missing:
+            with open(_page_file(pdf_hash, page, dpi), "rb") as f:
+                results[page] = f.read()
+            with _lock:
+                _remember((pdf_hash, page, dpi), results[page])
+                _stats["misses"] += 1
+        _enforce_disk_limits(keep_hash=pdf_hash)
+
+    return [results[page] for page in pages]
+
+
+def _glyph_stats(text):
+    """回傳 (非空白字元數, 亂碼字元數, 數學符號/數字字元數)"""
+    chars = [c for c in text if not c.isspace()]
+    bad = sum(1 for c in chars if c == "\ufffd" or "\ue000" <= c <= "\uf8ff")
+    math = sum(1 for c in chars if c in _MATH_CHARS or c.isdigit())
+    return len(chars), bad, math
+
+
+def _is_math_font(font_name):
+    # 內嵌字型常有子集前綴，例如 "ABCDEF+CMMI10"
+    return bool(_MATH_FONT_PATTERN.search(font_name.split("+", 1)[-1]))
+
+
+def _block_math_stats(block):
+    """文字區塊 -> (文字, 非空白字元數, 數學字元數)；數學字型的字全部算數學字元"""
+    lines = []
+    chars = math = 0
+    for line in block.get("lines", []):
+        line_text = ""
+        for span in line.get("spans", []):
+            span_text = span.get("text", "")
+            line_text += span_text
+            visible = [c for c in span_text if not c.isspace()]
+            chars += len(visible)
+            if _is_math_font(span.get("font", "")):
+                math += len(visible)
+            else:
+                math += sum(1 for c in visible if c in _MATH_CHARS)
+        lines.append(line_text)
+    return "\n".join(lines).strip(), chars, math
+
+
+def _padded(rect, page_rect):
+    pad = PDF_MATH_REGION_PADDING
+    return tuple(fitz.Rect(rect[0] - pad, rect[1] - pad, rect[2] + pad, rect[3] + pad) & page_rect)
+
+
+def extract_page_layer(pdf_hash, page):
+    """
+    讀取 PDF 原生文字層並判斷能不能直接用 (不經過視覺模型)：
+    - 沒有文字 / 字太少、或圖片幾乎蓋滿整頁 -> 掃描頁，usable=False
+    - 亂碼比例過高 (數學字型沒有 Unicode 對照) -> usable=False
+    - 公式密集 (算式區塊字數佔整頁 PDF_MATH_PAGE_RATIO 以上，或算式區塊太多) -> usable=False
+    - 其他文字頁：算式區塊與較大的圖片區塊放進 regions，只把這些區域送 OCR；
+      文字中的算式區塊換成 [區域 N] 標記
+    回傳 dict: page, text, usable, regions [(x0, y0, x1, y1)], chars, bad_ratio, math_ratio
+    """
+    key = (pdf_hash, page)
+    with _lock:
+        if key in _text_layers:
+            _text_layers.move_to_end(key)
+            return _text_layers[key]
+
+    with fitz.open(pdf_path(pdf_hash)) as doc:
+        pdf_page = doc.load_page(page - 1)
+        page_rect = pdf_page.rect
+        page_area = abs(page_rect) or 1.0
+        blocks = [b for b in pdf_page.get_text("dict", sort=True)["blocks"] if b.get("type") == 0]
+
+        image_regions = []
+        image_area = 0.0
+        for info in pdf_page.get_image_info():
+            rect = fitz.Rect(info["bbox"]) & page_rect
+            area = abs(rect)
+            image_area += area
+            if area / page_area >= PDF_REGION_MIN_AREA_RATIO:
+                image_regions.append(tuple(rect))
+
+    parts = []
+    raw_parts = []
+    math_regions = []
+    chars = math = math_block_chars = 0
+    for block in blocks:
+        block_text, block_chars, block_math = _block_math_stats(block)
+        if not block_chars:
+            continue
+        chars += block_chars
+        math += block_math
+        raw_parts.append(block_text)
+        if block_math / block_chars >= PDF_MATH_BLOCK_RATIO:
+            math_block_chars += block_chars
+            math_regions.append(_padded(block["bbox"], page_rect))
+            parts.append(f"[區域 {len(math_regions)}]")
+        else:
+            parts.append(block_text)
+    text = "\n".join(parts)
+
+    _, bad, _ = _glyph_stats("\n".join(raw_parts))
+    bad_ratio = bad / chars if chars else 0.0
+    math_page_ratio = math_block_chars / chars if chars else 0.0
+    usable = (
+        chars >= PDF_TEXT_MIN_CHARS
+        and bad_ratio <= PDF_TEXT_MAX_BAD_RATIO
+        and image_area / page_area < PDF_SCANNED_IMAGE_RATIO
+        and math_page_ratio < PDF_MATH_PAGE_RATIO
+        and len(math_regions) <= PDF_MAX_MATH_REGIONS
+    )
+    layer = {
+        "page": page,
+        "text": text,
+        "usable": usable,
+        "regions": (math_regions + image_regions) if usable else [],
+        "chars": chars,
+        "bad_ratio": bad_ratio,
+        "math_ratio": math / chars if chars else 0.0,
+    }
+    print(f"📑 [PDF] 第 {page} 頁文字層: {chars} 字, 數學符號 {layer['math_ratio']:.0%}, "
+          f"算式區塊 {len(math_regions)} 個 ({math_page_ratio:.0%}), 亂碼 {bad_ratio:.0%} -> "
+          f"{'使用文字層' if usable else '交給視覺模型'}")
+    with _lock:
+        _text_layers[key] = layer
+        while len(_text_layers) > PDF_TEXT_LAYER_CACHE_SIZE:
+            _text_layers.popitem(last=False)
+    return layer
+
+
+def _region_key(pdf_hash, page, rect, dpi):
+    return f"{pdf_hash}|{page}|{dpi}|" + ",".join(f"{v:.1f}" for v in rect)
+
+
+def get_region_ocr(pdf_hash, page, rect, dpi=PDF_REGION_DPI):
+    """之前辨識過的區域文字；沒有就回傳 None"""
+    return _region_ocr_cache.get(_region_key(pdf_hash, page, rect, dpi))
+
+
+def store_region_ocr(pdf_hash, page, rect, text, dpi=PDF_REGION_DPI):
+    if text:
+        _region_ocr_cache.set(_region_key(pdf_hash, page, rect, dpi), text)
+
+
+def render_region(pdf_hash, page, rect, dpi=PDF_REGION_DPI):
+    """只把頁面中的某個區域 (例如插圖 / 貼上的算式圖片) 轉成 JPEG"""
+    with fitz.open(pdf_path(pdf_hash)) as doc:
+        pix = doc.load_page(page - 1).get_pixmap(dpi=dpi, clip=fitz.Rect(rect))
+        return pix.tobytes("jpeg")
+
+
+def get_pdf_cache_stats():
+    """頁面快取統計 (hits = 記憶體命中, disk_hits = 磁碟命中, misses = 實際轉圖)"""
+    with _lock:
+        stats = dict(_stats)
+        stats["memory_pages"] = len(_page_memory)
+    total = stats["hits"] + stats["disk_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / total if total else 0.0
+    return stats
+
+
+if __name__ == "__main__" and "--render" in sys.argv:
+    # 子行程：python pdf_store.py --render <pdf 路徑> <dpi> <頁碼...>
+    _args = sys.argv[sys.argv.index("--render") + 1:]
+    _render_to_files(_args[0], int(_args[1]), [int(p) for p in _args[2:]])
@@ -0,0 +1,303 @@
+# prompt_builder.py (Token 預算內組合 prompt + 滾動對話摘要)
+
+import threading
+
+import ollama_client
+
+# transformers 是選配：有裝就用模型自己的 tokenizer 算 token，沒有就用字數估算
+try:
+    from transformers import AutoTokenizer
+except ImportError:
+    AutoTokenizer = None
+
+# ==========================================
+# 🔧 設定區
+# ==========================================
+# 計算 token 用的 tokenizer：Ollama 模型名稱 -> Hugging Face repo (和對話模型同一個，數字才準)
+# 沒列在這裡的模型用字數估算
+PROMPT_TOKENIZERS = {
+    "qwen2.5:7b": "Qwen/Qwen2.5-7B-Instruct",
+    "qwen2.5:3b": "Qwen/Qwen2.5-3B-Instruct",
+    "hf.co/MaziyarPanahi/DeepSeek-R1-0528-Qwen3-8B-GGUF:Q4_K_M": "deepseek-ai/DeepSeek-R1-0528-Qwen3-8B",
+    "deepseek-r1:8b": "deepseek-ai/DeepSeek-R1-0528-Qwen3-8B",
+}
+PROMPT_MODEL = "qwen2.5:7b"
+# 本機沒有 tokenizer 檔案時，是否在背景下載 (下載完成前用字數估算)
+PROMPT_TOKENIZER_DOWNLOAD = True
+# 動態內容 (摘要 + 長期記憶 + 最近對話) 的 token 上限；人設 / 規則另計
+PROMPT_TOKEN_BUDGET = 1500
+# 其中固定保留給「這一輪」(身份 + 長期記憶 + 使用者訊息) 的額度；
+# 剩下的給摘要 + 歷史，歷史怎麼截只看歷史本身，不會因為這一輪記憶多寡而改變 (前綴快取才不會失效)
+TURN_TOKEN_ALLOWANCE = 400
+# 摘要 + 歷史超過歷史預算的 SUMMARY_TRIGGER_RATIO 時，才在背景把舊訊息併入摘要；
+# 一次併入一大批，只留最新、約 SUMMARY_KEEP_RATIO (扣掉摘要後的歷史預算) 的原文。
+# 每次併入都會改掉前綴 (Ollama 要整段重新 prefill)，所以要少做、一次做多一點
+SUMMARY_TRIGGER_RATIO = 0.9
+SUMMARY_KEEP_RATIO = 0.25
+# 併入摘要後至少保留最後幾則原文 (1 輪 = 使用者 + AI 兩則)
+RECENT_MESSAGES = 2
+# 摘要還沒跟上、歷史超出預算時，一次丟掉幾則最舊的訊息 (整批丟，前綴才不會每輪都變)
+HISTORY_TRIM_BATCH = 4
+SUMMARY_MAX_CHARS = 600
+SUMMARY_MODEL = "qwen2.5:7b"
+SUMMARY_TIMEOUT = 60
+
+_tokenizers = {}   # 模型名稱 -> tokenizer (None = 載入失敗 / 沒有對照，用估算)
+_tokenizer_lock = threading.Lock()
+_tokenizer_failed = False   # True = 一律用估算 (沒裝 transformers 或測試用)
+
+
+def _load_tokenizer(model):
+    repo = PROMPT_TOKENIZERS.get(model)
+    if AutoTokenizer is None or repo is None:
+        return None
+    try:
+        # 先用本機快取 (不連網)；沒有才下載
+        return AutoTokenizer.from_pretrained(repo, local_files_only=True)
+    except Exception:
+        if not PROMPT_TOKENIZER_DOWNLOAD:
+            print(f"⚠️ [Prompt] 本機沒有 {repo} 的 tokenizer，改用字數估算")
+            return None
+    try:
+        return AutoTokenizer.from_pretrained(repo)
+    except Exception as e:
+        print(f"⚠️ [Prompt] 載入 tokenizer 失敗 ({repo})，改用字數估算: {e}")
+        return None
+
+
+def warm_up(*models, wait=False):
+    """
+    程式啟動時在背景載入 tokenizer (可能要下載)，不放在回應路徑上；
+    載入完成前 count_tokens 先用字數估算。wait=True 會等載入完成 (量測腳本用)。
+    """
+    def _run(model):
+        tokenizer = _load_tokenizer(model)
+        with _tokenizer_lock:
+            _tokenizers[model] = tokenizer
+        if tokenizer is not None:
+            print(f"🔤 [Prompt] {model} 的 tokenizer 已載入")
+
+    threads = []
+    for model in models or (PROMPT_MODEL,):
+        with _tokenizer_lock:
+            if model in _tokenizers:
+                continue
+            _tokenizers[model] = None
+        thread = threading.Thread(target=_run, args=(model,), daemon=True)
+        thread.start()
+        threads.append(thread)
+    if wait:
+        for thread in threads:
+            thread.join()
+
+
+def count_tokens(text, model=None):
+    """
+    用對話模型的 tokenizer 計算 token 數；tokenizer 還沒載入 (或沒有) 時估算
+    (中日韓字約 1 token，其他約 4 字元 1 token)。不會在這裡載入 tokenizer。
+    """
+    if not text:
+        return 0
+    tokenizer = None if _tokenizer_failed else _tokenizers.get(model or PROMPT_MODEL)
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    cjk = sum(1 for c in text if "⺀" <= c <= "鿿" or "가" <= c <= "힯" or "＀" <= c <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _format_message(message):
+    return f"{message['speaker']}: {message['text']}"
+
+
+def summarize_with_llm(previous_summary, messages, model=SUMMARY_MODEL):
+    """把「舊摘要 + 新的幾則對話」合併成新的摘要；LLM 失敗時退回截短串接"""
+    dialogue = "\n".join(_format_message(m) for m in messages)
+    prompt = (
+        f"以下是到目前為止的對話摘要與接下來的對話。請合併成一份新的摘要，"
+        f"保留使用者的身分、偏好、正在解的題目與已得到的結論，使用繁體中文，不超過 {SUMMARY_MAX_CHARS} 字。\n\n"
+        f"【目前摘要】\n{previous_summary or '(無)'}\n\n【新的對話】\n{dialogue}"
+    )
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": False,
+        "options": {"temperature": 0.2, "num_predict": SUMMARY_MAX_CHARS},
+    }
+    try:
+        response = ollama_client.chat(payload, timeout=SUMMARY_TIMEOUT)
+        if response.status_code == 200:
+            summary = response.json().get("message", {}).get("content", "").strip()
+            if summary:
+                return summary[:SUMMARY_MAX_CHARS]
+    except Exception as e:
+        print(f"⚠️ [Prompt] 摘要失敗，改用截短: {e}")
+
+    # 退路：每則截短後接在舊摘要後面，超過長度就從最舊的行開始丟
+    lines = (previous_summary.splitlines() if previous_summary else []) + [_format_message(m)[:80] for m in messages]
+    while len(lines) > 1 and len("\n".join(lines)) > SUMMARY_MAX_CHARS:
+        lines.pop(0)
+    return "\n".join(lines)[-SUMMARY_MAX_CHARS:]
+
+
+class ConversationContext:
+    """
+    一段對話的 prompt 狀態：
+    - 訊息保留原文，直到摘要 + 歷史快要超出 history_budget
+    - 那時才在背景執行緒把大部分舊訊息一次併入滾動摘要 (不拖慢這一輪的回應)；
+      兩次併入之間歷史只會往後加，前綴逐字相同
+    - 每則訊息的 token 數只算一次
+    """
+
+    def __init__(self, summarizer=None, summary_model=SUMMARY_MODEL, model=PROMPT_MODEL,
+                 history_budget=PROMPT_TOKEN_BUDGET - TURN_TOKEN_ALLOWANCE):
+        self.model = model            # 對話模型 (決定用哪個 tokenizer 算 token)
+        self.history_budget = history_budget
+        self.summary = ""
+        self._summary_tokens = 0
+        self._messages = []           # 尚未併入摘要的訊息 (含 "tokens")
+        self._lock = threading.Lock()
+        self._summarizing = False
+        self._fold_thread = None
+        self._summarizer = summarizer or (lambda prev, msgs: summarize_with_llm(prev, msgs, summary_model))
+
+    def append(self, speaker, text):
+        message = {"speaker": speaker, "text": text}
+        message["tokens"] = count_tokens(_format_message(message), self.model) + 1
+        with self._lock:
+            self._messages.append(message)
+            if self._summarizing:
+                return
+            total = self._summary_tokens + sum(m["tokens"] for m in self._messages)
+            if total <= self.history_budget * SUMMARY_TRIGGER_RATIO:
+                return
+            # 從最新的往回保留原文 (至少 RECENT_MESSAGES 則)，其餘一次併入摘要；
+            # 摘要本身越長，留下的原文越少，下一次併入前才有足夠的空間
+            keep_limit = (self.history_budget - self._summary_tokens) * SUMMARY_KEEP_RATIO
+            keep = 0
+            kept_tokens = 0
+            for m in reversed(self._messages):
+                if keep >= RECENT_MESSAGES and kept_tokens + m["tokens"] > keep_limit:
+                    break
+                keep += 1
+                kept_tokens += m["tokens"]
+            foldable = len(self._messages) - keep
+            if foldable <= 0:
+                return
+            self._summarizing = True
+            batch = list(self._messages[:foldable])
+            self._fold_thread = threading.Thread(target=self._fold, args=(batch,), daemon=True)
+        self._fold_thread.start()
+
+    def wait_for_summary(self, timeout=None):
+        """等背景的摘要做完 (測試、量測用)"""
+        thread = self._fold_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _fold(self, batch):
+        try:
+            summary = self._summarizer(self.summary, batch)
+            summary_tokens = count_tokens(summary, self.model)
+            with self._lock:
+                self.summary = summary
+                self._summary_tokens = summary_tokens
+                # 只有 _fold 會從前面刪，新訊息都加在後面，所以前 len(batch) 則就是這一批
+                del self._messages[:len(batch)]
+            print(f"📝 [Prompt] 已將 {len(batch)} 則舊對話併入摘要 ({summary_tokens} tokens)")
+        except Exception as e:
+            print(f"⚠️ [Prompt] 更新摘要失敗: {e}")
+        finally:
+            with self._lock:
+                self._summarizing = False
+
+    def snapshot(self):
+        """回傳 (摘要, 摘要 token 數, 未摘要的訊息 list)"""
+        with self._lock:
+            return self.summary, self._summary_tokens, list(self._messages)
+
+
+def _role(speaker):
+    return "assistant" if speaker.lower() in ("ai", "assistant") else "user"
+
+
+def _history_start(messages, history_budget):
+    """
+    歷史訊息要從第幾則開始放：超過預算時從最舊的開始，一次丟掉整批 HISTORY_TRIM_BATCH 則。
+    只依歷史本身決定 (和這一輪的記憶無關)，而且訊息只會往後加，
+    所以起點只會在整批的邊界往前跳，兩次跳動之間前綴都逐字相同。
+    最後一則一定保留。
+    """
+    total = sum(m["tokens"] for m in messages)
+    start = 0
+    while total > history_budget and start + HISTORY_TRIM_BATCH < len(messages):
+        total -= sum(m["tokens"] for m in messages[start:start + HISTORY_TRIM_BATCH])
+        start += HISTORY_TRIM_BATCH
+    while total > history_budget and start < len(messages) - 1:
+        total -= messages[start]["tokens"]
+        start += 1
+    return start
+
+
+def build_messages(system_prompt, context, identity, memories, user_text, budget=PROMPT_TOKEN_BUDGET,
+                   turn_allowance=TURN_TOKEN_ALLOWANCE):
+    """
+    在 token 預算內組合多輪 messages，回傳 (messages, metrics)。
+
+    版面刻意讓前綴每一輪都「逐字相同」，Ollama 才能重用上一輪算好的 KV cache：
+      1. system: 人設 + 固定規則 (呼叫端傳入的常數字串，不放任何會變動的內容)
+      2. system: 先前對話摘要 (只有歷史快滿、一次併入一大批時才會變)
+      3. user / assistant: 歷史訊息原文 (只會在後面追加)
+      4. user: 這一輪的動態內容 (身份、長期記憶) + 使用者訊息，放在最後
+    每輪只需要 prefill 上一輪的回答和最後這則訊息。
+    預算分兩塊：turn_allowance 給第 4 段 (記憶放不下就少放幾則)，
+    其餘給摘要 + 歷史 (超出時整批丟掉最舊的訊息)，兩塊互不影響。
+    """
+    summary, summary_tokens, messages = context.snapshot()
+    model = context.model
+    history_budget = budget - turn_allowance
+
+    if summary and summary_tokens > history_budget:
+        summary = ""
+        summary_tokens = 0
+    kept_messages = messages[_history_start(messages, history_budget - summary_tokens):]
+
+    remaining = turn_allowance - count_tokens(identity, model) - count_tokens(user_text, model)
+    kept_memories = []
+    memory_tokens = 0
+    for memory in memories:
+        tokens = count_tokens(memory, model) + 2
+        if tokens > remaining:
+            break
+        kept_memories.append(memory)
+        memory_tokens += tokens
+        remaining -= tokens
+
+    memory_str = "\n".join(f"- {m}" for m in kept_memories) if kept_memories else "無相關回憶"
+    turn_content = (
+        f"=== 對話場景資訊 ===\n"
+        f"身份: {identity}\n"
+        f"長期記憶:\n{memory_str}\n"
+        f"=== 使用者訊息 ===\n"
+        f"{user_text}"
+    )
+
+    chat_messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        chat_messages.append({"role": "system", "content": f"先前對話摘要:\n{summary}"})
+    for message in kept_messages:
+        chat_messages.append({"role": _role(message["speaker"]), "content": message["text"]})
+    chat_messages.append({"role": "user", "content": turn_content})
+
+    metrics = {
+        "system": count_tokens(system_prompt, model),
+        "summary": summary_tokens,
+        "memory": memory_tokens,
+        "history": sum(m["tokens"] for m in kept_messages),
+        "turn": count_tokens(turn_content, model),
+        "dropped_messages": len(messages) - len(kept_messages),
+        "dropped_memories": len(memories) - len(kept_memories),
+    }
+    metrics["total"] = metrics["system"] + metrics["summary"] + metrics["history"] + metrics["turn"]
+    print(f"📏 [Prompt] {metrics['total']} tokens (固定前綴 {metrics['system']} / 摘要 {metrics['summary']} / "
+          f"歷史 {metrics['history']} / 本輪 {metrics['turn']})，略過 {metrics['dropped_messages']} 則訊息")
+    return chat_messages, metrics
@@ -0,0 +1,79 @@
+# session_store.py (網頁多使用者：每個瀏覽器一份對話狀態)
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from prompt_builder import ConversationContext, PROMPT_MODEL
+
+# ==========================================
+# 🔧 設定區
+# ==========================================
+# 同時保留幾個使用者的對話 (超過時淘汰最久沒用的)
+MAX_SESSIONS = 200
+# 每個使用者保留的最近訊息數 (網頁顯示用；prompt 另由 prompt_builder 控制長度)
+MAX_HISTORY_PER_SESSION = 100
+# 多久沒互動就丟掉 (秒)
+SESSION_IDLE_TTL = 6 * 60 * 60
+
+
+class SessionState:
+    """單一使用者的對話狀態"""
+
+    def __init__(self, session_id, prompt_model=PROMPT_MODEL):
+        self.session_id = session_id
+        self.history = []          # [{"speaker": "user" | "ai", "text": ...}] (網頁顯示用)
+        self.conversation = ConversationContext(model=prompt_model)   # prompt 用 (最近原文 + 滾動摘要)
+        self.last_seen = time.time()
+        self.lock = threading.Lock()
+
+    def append(self, speaker, text):
+        with self.lock:
+            self.history.append({"speaker": speaker, "text": text})
+            if len(self.history) > MAX_HISTORY_PER_SESSION:
+                del self.history[:-MAX_HISTORY_PER_SESSION]
+        self.conversation.append(speaker, text)
+
+    def recent(self, n=MAX_HISTORY_PER_SESSION):
+        with self.lock:
+            return list(self.history[-n:])
+
+
+class SessionStore:
+    """
+    有上限的 session 容器 (LRU)：
+    - key 是瀏覽器 cookie 裡的 session id
+    - 超過 max_sessions 或閒置超過 idle_ttl 的 session 會被丟掉
+    多執行緒共用同一個物件是安全的。
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_ttl=SESSION_IDLE_TTL, prompt_model=PROMPT_MODEL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.prompt_model = prompt_model  # 對話模型 (決定 prompt 用哪個 tokenizer 算 token)
+        self._sessions = OrderedDict()  # session_id -> SessionState
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    def get(self, session_id):
+        """取得 (必要時建立) session；session_id 無效時建立新的"""
+        now = time.time()
+        with self._lock:
+            state = self._sessions.get(session_id) if session_id else None
+            if state is None or now - state.last_seen > self.idle_ttl:
+                state = SessionState(session_id or self.new_id(), self.prompt_model)
+                self._sessions[state.session_id] = state
+            state.last_seen = now
+            self._sessions.move_to_end(state.session_id)
+
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return state
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
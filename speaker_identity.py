@@ -1,108 +1,187 @@
-# speaker_identity.py (繞過 torchaudio 讀取版)
-
-import torch
-import torchaudio
-import os
-import soundfile as sf  # 👈 直接使用 soundfile 讀取，不透過 torchaudio
-
-# =========================================================
-# 🚑 熱修復 1：解決 speechbrain 依賴問題
-if not hasattr(torchaudio, "list_audio_backends"):
-    torchaudio.list_audio_backends = lambda: ["soundfile"]
-# =========================================================
-
-from speechbrain.inference.speaker import EncoderClassifier
-
-# 💾 設定你的聲音樣本路徑
-MASTER_VOICE_FILE = "master_voice.wav" 
-
-print("⏳ [聲紋] 正在載入 SpeechBrain 模型...")
-try:
-    classifier = EncoderClassifier.from_hparams(
-        source="speechbrain/spkrec-ecapa-voxceleb",
-        savedir="pretrained_models/spkrec-ecapa-voxceleb",
-        run_opts={"device": "cuda" if torch.cuda.is_available() else "cpu"}
-    )
-except Exception as e:
-    print(f"❌ [聲紋] 模型載入失敗: {e}")
-    classifier = None
-
-def get_embedding(wav_path):
-    """將聲音檔案轉成聲紋向量"""
-    if not os.path.exists(wav_path):
-        print(f"⚠️ [聲紋] 找不到檔案: {wav_path}")
-        return None
-        
-    if classifier is None:
-        return None
-
-    try:
-        # 🚀 核彈級修復：完全繞過 torchaudio.load
-        # 1. 使用 soundfile 直接讀取 (它回傳 numpy array)
-        audio_array, sample_rate = sf.read(wav_path)
-        
-        # 2. 轉成 PyTorch Tensor
-        signal = torch.from_numpy(audio_array).float()
-        
-        # 3. 處理維度 (Soundfile 是 [時間, 聲道], PyTorch 需要 [聲道, 時間])
-        if len(signal.shape) == 1:
-            # 單聲道: [T] -> [1, T]
-            signal = signal.unsqueeze(0)
-        else:
-            # 多聲道: [T, C] -> [C, T] -> 取平均變單聲道 [1, T]
-            signal = signal.transpose(0, 1)
-            signal = signal.mean(dim=0, keepdim=True)
-            
-        # 計算聲紋
-        with torch.no_grad():
-            embeddings = classifier.encode_batch(signal)
-            
-        return embeddings
-        
-    except Exception as e:
-        print(f"❌ [聲紋] 分析音訊失敗: {e}")
-        # 印出更詳細錯誤以便除錯
-        import traceback
-        traceback.print_exc()
-        return None
-
-# 快取的聲紋
-master_embedding = None
-
-def load_master_voice():
-    """程式啟動時，先記住的聲音"""
-    global master_embedding
-    if os.path.exists(MASTER_VOICE_FILE):
-        print(f"✅ [聲紋] 讀取聲音樣本: {MASTER_VOICE_FILE}")
-        master_embedding = get_embedding(MASTER_VOICE_FILE)
-        
-        if master_embedding is not None:
-            print(f"✅ [聲紋] 聲紋註冊成功！")
-        else:
-            print(f"❌ [聲紋] 聲紋讀取失敗，請檢查 wav 檔案格式。")
-            
-    else:
-        print(f"⚠️ [聲紋] 找不到樣本 ({MASTER_VOICE_FILE})")
-
-def identify_speaker(current_audio_path, threshold=0.45):
-    """比對當前的錄音"""
-    if master_embedding is None or classifier is None:
-        return False, 0.0 
-
-    current_emb = get_embedding(current_audio_path)
-    if current_emb is None:
-        return False, 0.0
-
-    # 計算餘弦相似度
-    score = torch.nn.functional.cosine_similarity(master_embedding, current_emb, dim=-1)
-    score_val = score.mean().item()
-    
-    # print(f"🔍 [聲紋] 相似度得分: {score_val:.4f}") 
-    
-    if score_val > threshold:
-        return True, score_val
-    else:
-        return False, score_val
-
-# 啟動時自動載入
-load_master_voice()
\ No newline at end of file
+# speaker_identity.py (繞過 torchaudio 讀取版)
+
+import torch
+import torchaudio
+import os
+import threading
+import numpy as np
+import soundfile as sf  # 👈 直接使用 soundfile 讀取，不透過 torchaudio
+
+# =========================================================
+# 🚑 熱修復 1：解決 speechbrain 依賴問題
+if not hasattr(torchaudio, "list_audio_backends"):
+    torchaudio.list_audio_backends = lambda: ["soundfile"]
+# =========================================================
+
+from speechbrain.inference.speaker import EncoderClassifier
+
+# 💾 設定你的聲音樣本路徑 (第一次啟動時會自動註冊為 "master")
+MASTER_VOICE_FILE = "master_voice.wav" 
+# 💾 已註冊聲紋的資料庫 (多人，可持續累加樣本)
+SPEAKER_DB_FILE = "speaker_embeddings.npz"
+# ECAPA 模型的取樣率 (STT 給的音訊也是 16kHz)
+MODEL_SAMPLE_RATE = 16000
+
+print("⏳ [聲紋] 正在載入 SpeechBrain 模型...")
+try:
+    classifier = EncoderClassifier.from_hparams(
+        source="speechbrain/spkrec-ecapa-voxceleb",
+        savedir="pretrained_models/spkrec-ecapa-voxceleb",
+        run_opts={"device": "cuda" if torch.cuda.is_available() else "cpu"}
+    )
+except Exception as e:
+    print(f"❌ [聲紋] 模型載入失敗: {e}")
+    classifier = None
+
+def get_embedding(wav_path, sample_rate=MODEL_SAMPLE_RATE):
+    """將聲音檔案 (或已經在記憶體中的 numpy 音訊) 轉成聲紋向量"""
+    if not isinstance(wav_path, np.ndarray) and not os.path.exists(wav_path):
+        print(f"⚠️ [聲紋] 找不到檔案: {wav_path}")
+        return None
+        
+    if classifier is None:
+        return None
+
+    try:
+        # 🚀 核彈級修復：完全繞過 torchaudio.load
+        # 1. 使用 soundfile 直接讀取 (它回傳 numpy array)；STT 直接給的 array 就不用讀檔
+        if isinstance(wav_path, np.ndarray):
+            audio_array = wav_path
+        else:
+            audio_array, sample_rate = sf.read(wav_path)
+        
+        # 2. 轉成 PyTorch Tensor
+        signal = torch.from_numpy(np.asarray(audio_array)).float()
+        
+        # 3. 處理維度 (Soundfile 是 [時間, 聲道], PyTorch 需要 [聲道, 時間])
+        if len(signal.shape) == 1:
+            # 單聲道: [T] -> [1, T]
+            signal = signal.unsqueeze(0)
+        else:
+            # 多聲道: [T, C] -> [C, T] -> 取平均變單聲道 [1, T]
+            signal = signal.transpose(0, 1)
+            signal = signal.mean(dim=0, keepdim=True)
+
+        # 取樣率不是 16kHz 的檔案先重新取樣，否則聲紋會不準
+        if sample_rate != MODEL_SAMPLE_RATE:
+            signal = torchaudio.functional.resample(signal, sample_rate, MODEL_SAMPLE_RATE)
+            
+        # 計算聲紋
+        with torch.no_grad():
+            embeddings = classifier.encode_batch(signal)
+            
+        return embeddings
+        
+    except Exception as e:
+        print(f"❌ [聲紋] 分析音訊失敗: {e}")
+        # 印出更詳細錯誤以便除錯
+        import traceback
+        traceback.print_exc()
+        return None
+
+# ==========================================
+# 👥 多人聲紋資料庫
+# ==========================================
+# names[i] 的聲紋 = sums[i] / counts[i] (累加平均，方便持續補樣本)
+# 比對時用事先正規化好的矩陣 matrix，一次矩陣乘法算完所有人的相似度
+_db_lock = threading.Lock()
+_db = {"names": [], "sums": None, "counts": None, "matrix": None}
+
+def _to_vector(embedding):
+    """SpeechBrain 回傳 [1, 1, D] tensor -> 1 維 numpy 向量"""
+    return embedding.squeeze().detach().cpu().numpy().astype(np.float32)
+
+def _rebuild_matrix():
+    means = _db["sums"] / _db["counts"][:, None]
+    _db["matrix"] = means / np.maximum(np.linalg.norm(means, axis=1, keepdims=True), 1e-12)
+
+def _save_speaker_db():
+    np.savez(SPEAKER_DB_FILE, names=np.array(_db["names"]), sums=_db["sums"], counts=_db["counts"])
+
+def load_speaker_db():
+    """程式啟動時載入已註冊的聲紋；資料庫還是空的就把 master_voice.wav 註冊進去"""
+    if os.path.exists(SPEAKER_DB_FILE):
+        try:
+            data = np.load(SPEAKER_DB_FILE)
+            with _db_lock:
+                _db["names"] = [str(n) for n in data["names"]]
+                _db["sums"] = data["sums"].astype(np.float32)
+                _db["counts"] = data["counts"].astype(np.float32)
+                _rebuild_matrix()
+            print(f"✅ [聲紋] 已載入 {len(_db['names'])} 位註冊者: {', '.join(_db['names'])}")
+            return
+        except Exception as e:
+            print(f"❌ [聲紋] 聲紋資料庫讀取失敗: {e}")
+
+    if os.path.exists(MASTER_VOICE_FILE):
+        print(f"✅ [聲紋] 讀取聲音樣本: {MASTER_VOICE_FILE}")
+        audio_array, sample_rate = sf.read(MASTER_VOICE_FILE)
+        if enroll_speaker("master", audio_array, sample_rate):
+            print(f"✅ [聲紋] 聲紋註冊成功！")
+        else:
+            print(f"❌ [聲紋] 聲紋讀取失敗，請檢查 wav 檔案格式。")
+    else:
+        print(f"⚠️ [聲紋] 找不到樣本 ({MASTER_VOICE_FILE})")
+
+def enroll_speaker(name, audio, sample_rate=MODEL_SAMPLE_RATE):
+    """
+    註冊 / 補充一位說話者的聲紋 (增量：同名會累加到原本的平均裡，不用重算舊樣本)
+    audio: numpy 音訊 (例如 STT 回傳的 array)。成功回傳 True。
+    """
+    embedding = get_embedding(np.asarray(audio), sample_rate)
+    if embedding is None:
+        return False
+    vector = _to_vector(embedding)
+
+    with _db_lock:
+        if _db["sums"] is None:
+            _db["sums"] = np.zeros((0, vector.shape[0]), dtype=np.float32)
+            _db["counts"] = np.zeros((0,), dtype=np.float32)
+
+        if name in _db["names"]:
+            idx = _db["names"].index(name)
+            _db["sums"][idx] += vector
+            _db["counts"][idx] += 1
+        else:
+            _db["names"].append(name)
+            _db["sums"] = np.vstack([_db["sums"], vector[None, :]])
+            _db["counts"] = np.append(_db["counts"], 1.0).astype(np.float32)
+
+        _rebuild_matrix()
+        _save_speaker_db()
+    return True
+
+def identify(audio, sample_rate=MODEL_SAMPLE_RATE, threshold=0.45):
+    """
+    比對所有註冊者 (一次向量化的餘弦相似度)。
+    回傳 (最像的名字 或 None, 分數)；分數沒超過 threshold 時名字為 None。
+    """
+    with _db_lock:
+        matrix = _db["matrix"]
+        names = list(_db["names"])
+    if matrix is None or len(names) == 0 or classifier is None:
+        return None, 0.0
+
+    current_emb = get_embedding(np.asarray(audio), sample_rate)
+    if current_emb is None:
+        return None, 0.0
+
+    vector = _to_vector(current_emb)
+    vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+    scores = matrix @ vector
+    best = int(np.argmax(scores))
+    score_val = float(scores[best])
+
+    # print(f"🔍 [聲紋] 相似度得分: {score_val:.4f} ({names[best]})") 
+
+    if score_val > threshold:
+        return names[best], score_val
+    return None, score_val
+
+def identify_speaker(audio, threshold=0.45, sample_rate=MODEL_SAMPLE_RATE):
+    """比對當前的錄音 (直接吃 STT 給的 numpy 音訊)，回傳 (是否為已註冊的人, 分數)"""
+    name, score_val = identify(audio, sample_rate, threshold)
+    return name is not None, score_val
+
+# 啟動時自動載入
+load_speaker_db()
\ No newline at end of file
@@ -0,0 +1,127 @@
+# stream_parser.py (LLM 串流增量解析：<think> 區塊過濾 + 斷句，標籤 / 標點被切在兩個 chunk 之間也能正確處理)
+
+import re
+
+# ==========================================
+# 🔧 設定區
+# ==========================================
+THINK_OPEN_TAG = "<think>"
+THINK_CLOSE_TAG = "</think>"
+# 句尾標點 (半形 "." 不算，避免把 3.14、x.y 這類數學內容切斷)
+SENTENCE_ENDINGS = "。？！?!；;\n"
+# 緊接在句尾標點後面、仍屬於同一句的字元 (連續標點、右引號 / 右括號)
+SENTENCE_TRAILERS = SENTENCE_ENDINGS + "」』）)】\"'”’"
+# 去掉空白後短於這個字數的句子先不送出，併到下一句 (避免 TTS 唸單一個標點)
+MIN_SENTENCE_CHARS = 2
+
+
+def _partial_tag_length(text, tag):
+    """text 結尾和 tag 開頭重疊的最長長度 (例如 "abc<thi" 對 "<think>" 是 4)"""
+    if tag[0] not in text[-(len(tag) - 1):]:
+        return 0
+    for size in range(min(len(text), len(tag) - 1), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+class StreamProcessor:
+    """
+    一次只看新進來的 chunk 的增量解析器 (每個字元只掃一次)。
+    feed() / flush() 回傳事件 list，每個事件是 {"type": ..., "text": ...}：
+    - "text":     要顯示給使用者的內容 (<think> 區塊外)
+    - "think":    <think> 區塊內的推理內容
+    - "sentence": 已經完整的一句可見內容 (給 TTS；split_sentences=False 時不產生)
+    同一段內容會先出現 "text"，句子完整時再出現一次 "sentence"。
+    """
+
+    def __init__(self, split_sentences=True, min_sentence_chars=MIN_SENTENCE_CHARS):
+        self.split_sentences = split_sentences
+        self.min_sentence_chars = min_sentence_chars
+        self.in_think = False
+        self._pending = ""          # 可能是標籤開頭、還不能判斷的尾巴
+        self._sentence = ""         # 目前累積中的句子
+        self._sentence_ended = False  # 已看到句尾標點，等下一個字元確認後面沒有接續的標點
+        self._ending_re = re.compile(f"[{re.escape(SENTENCE_ENDINGS)}]")
+        self.visible_chars = 0
+        self.think_chars = 0
+
+    def feed(self, chunk):
+        events = []
+        if not chunk:
+            return events
+        text = self._pending + chunk
+        self._pending = ""
+
+        while text:
+            tag = THINK_CLOSE_TAG if self.in_think else THINK_OPEN_TAG
+            idx = text.find(tag)
+            if idx != -1:
+                self._emit(text[:idx], events)
+                self.in_think = not self.in_think
+                text = text[idx + len(tag):]
+                continue
+            # 沒找到完整標籤：結尾若可能是標籤的前半段就先留著，等下一個 chunk
+            keep = _partial_tag_length(text, tag)
+            if keep:
+                self._pending = text[-keep:]
+                text = text[:-keep]
+            self._emit(text, events)
+            break
+        return events
+
+    def flush(self):
+        """串流結束時呼叫：送出留著的尾巴與最後一句"""
+        events = []
+        pending, self._pending = self._pending, ""
+        self._emit(pending, events)
+        if self.split_sentences and self._sentence.strip():
+            events.append({"type": "sentence", "text": self._sentence})
+        self._sentence = ""
+        self._sentence_ended = False
+        return events
+
+    def _emit(self, text, events):
+        if not text:
+            return
+        if self.in_think:
+            self.think_chars += len(text)
+            events.append({"type": "think", "text": text})
+            return
+        self.visible_chars += len(text)
+        events.append({"type": "text", "text": text})
+        if self.split_sentences:
+            self._split(text, events)
+
+    def _split(self, text, events):
+        i = 0
+        n = len(text)
+        while i < n:
+            if self._sentence_ended:
+                # 句尾標點後面接續的標點 / 右引號仍算同一句
+                start = i
+                while i < n and text[i] in SENTENCE_TRAILERS:
+                    i += 1
+                self._sentence += text[start:i]
+                if i == n:
+                    return   # 還不確定這句是否結束，等下一個 chunk
+                self._sentence_ended = False
+                if len(self._sentence.strip()) >= self.min_sentence_chars:
+                    events.append({"type": "sentence", "text": self._sentence})
+                    self._sentence = ""
+                continue
+
+            match = self._ending_re.search(text, i)
+            if match is None:
+                self._sentence += text[i:]
+                return
+            self._sentence += text[i:match.end()]
+            i = match.end()
+            self._sentence_ended = True
+
+
+def split_sentences(text, min_sentence_chars=MIN_SENTENCE_CHARS):
+    """把一整段文字切成句子 (和串流斷句規則相同，保留句尾標點)"""
+    processor = StreamProcessor(min_sentence_chars=min_sentence_chars)
+    events = processor.feed(text) + processor.flush()
+    return [e["text"].strip() for e in events if e["type"] == "sentence" and e["text"].strip()]
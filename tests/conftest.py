@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# 模組都放在專案根目錄；快取 (./cache) 寫到暫存資料夾，不弄髒專案
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.chdir(tempfile.mkdtemp(prefix="ai_math_tests_"))
@@ -0,0 +1,12 @@
+from cache_store import PersistentCache
+
+
+def test_uncounted_reads_do_not_change_stats():
+    cache = PersistentCache("test_counting", memory_size=4)
+    cache.set("alias", "page")
+    assert cache.get("alias", count=False) == "page"
+    assert cache.get("missing", count=False) is None
+    assert (cache.hits, cache.misses) == (0, 0)
+    assert cache.get("alias") == "page"
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses) == (1, 1)
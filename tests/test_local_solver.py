@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip("sympy")
+import sympy
+
+import local_solver
+
+
+def _result(query):
+    solved = local_solver._solve(query)
+    assert solved is not None
+    return solved[1]
+
+
+def test_periodic_solutions_are_complete():
+    # sympy.solve 只會給 [0, pi]；完整解是 n*pi
+    n = sympy.Symbol("n", integer=True)
+    result = _result("solve sin(x)=0")
+    assert not isinstance(result, (list, sympy.FiniteSet))
+    assert result.has(sympy.ImageSet)
+    for k in range(-3, 4):
+        assert sympy.pi * k in result
+    assert sympy.pi / 2 not in result
+    assert "ImageSet" in local_solver.solve_locally("solve sin(x)=0")
+
+
+def test_polynomial_equations_still_solved():
+    assert _result("solve x^2-4=0") == sympy.FiniteSet(-2, 2)
+    assert _result("solve x^2+1=0") == sympy.FiniteSet(-sympy.I, sympy.I)
+
+
+def test_unsolvable_equations_fall_back_to_wolfram():
+    assert local_solver.solve_locally("solve x = cos(x)") is None
+    assert local_solver.solve_locally("solve sin(x)+y=0, x-y=1") is None
+
+
+@pytest.mark.parametrize("expression", [
+    "__import__('os').system('touch {marker}')",
+    "x.__class__",
+    "lambda: open('{marker}', 'w')",
+    "eval('1')",
+])
+def test_malicious_queries_are_rejected(tmp_path, expression):
+    # 算式不會被 eval：底線、引號、屬性存取、lambda 都過不了 parser
+    marker = tmp_path / "pwned"
+    query = "simplify " + expression.format(marker=marker)
+    with pytest.raises(ValueError):
+        local_solver._parse(query.split(" ", 1)[1])
+    assert local_solver.solve_locally(query) is None
+    assert not marker.exists()
@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+pytest.importorskip("pdf2image")
+pytest.importorskip("wikipedia")
+import mcp_handler
+
+
+def _slow_tool(seconds):
+    time.sleep(seconds)
+    return "done"
+
+
+@pytest.fixture
+def slow_tool(monkeypatch):
+    monkeypatch.setitem(mcp_handler.TOOLS_MAPPING, "slow_tool", _slow_tool)
+    monkeypatch.setitem(mcp_handler.TOOL_TIMEOUTS, "slow_tool", 0.5)
+
+
+def _calls(*durations):
+    return [{"function": {"name": "slow_tool", "arguments": {"seconds": d}}} for d in durations]
+
+
+def test_queued_tools_get_their_full_timeout(slow_tool):
+    # 工具數超過 TOOL_MAX_WORKERS：後面排隊的工具要等前面讓出執行緒，逾時從開始執行才起算
+    calls = _calls(*[0.3] * (mcp_handler.TOOL_MAX_WORKERS + 2))
+    results = mcp_handler.execute_tool_calls(calls)
+    assert results == [("slow_tool", "done")] * len(calls)
+
+
+def test_running_tool_times_out(slow_tool):
+    results = mcp_handler.execute_tool_calls(_calls(0.1, 2.0))
+    assert results[0] == ("slow_tool", "done")
+    assert "逾時" in results[1][1]
+
+
+def test_bad_image_returns_error_string():
+    assert mcp_handler._analyze_image_with_ollama("not base64!!!").startswith("Error:")
@@ -0,0 +1,79 @@
+import pytest
+
+import prompt_builder
+from prompt_builder import ConversationContext, build_messages
+
+SYSTEM_PROMPT = "你喜歡解數學題目\n重要：數學公式請用 LaTeX"
+LATEX_ANSWER = "推導如下：" + " ".join(f"$\\int_0^{{{i}}} x^{{{i}}} \\sin(x)\\,dx$" for i in range(12))
+MEMORIES = [
+    "[2026-10-01 20:11:02] User: 我下週要考微積分，想多練習分部積分和三角代換",
+    "[2026-10-02 19:40:55] User: 我比較喜歡用圖形理解，請多畫圖或描述圖形",
+    "[2026-09-28 21:03:12] AI: 分部積分口訣是 LIATE，先選對數、反三角、代數",
+]
+
+
+@pytest.fixture(autouse=True)
+def _estimate_tokens(monkeypatch):
+    # 不載入 tokenizer，用字數估算
+    monkeypatch.setattr(prompt_builder, "_tokenizer_failed", True)
+
+
+def _never_folds(previous_summary, messages):
+    # 摘要失敗時舊訊息留在原處：整段測試都是「沒有併入摘要」的輪次
+    raise RuntimeError("no fold in this test")
+
+
+def _truncating_summarizer(previous_summary, messages):
+    # 和 summarize_with_llm 的退路一樣：每則截短接在舊摘要後面
+    lines = previous_summary.splitlines() + [m["text"][:40] for m in messages]
+    return "\n".join(lines)[-prompt_builder.SUMMARY_MAX_CHARS // 2:]
+
+
+def _run(memories_for_turn, turns=20, summarizer=_never_folds):
+    context = ConversationContext(summarizer=summarizer)
+    rounds = []
+    for turn in range(turns):
+        user_text = f"第 {turn} 題：積分 x^{turn} sin x"
+        messages, metrics = build_messages(
+            SYSTEM_PROMPT, context, "使用者正在使用文字介面與你交談", memories_for_turn(turn), user_text,
+        )
+        rounds.append((messages, metrics))
+        context.append("user", user_text)
+        context.append("ai", LATEX_ANSWER)
+        context.wait_for_summary()
+    return rounds
+
+
+def test_history_does_not_depend_on_memories():
+    with_memories = _run(lambda turn: MEMORIES if turn % 2 else MEMORIES[:1])
+    without_memories = _run(lambda turn: [])
+    assert any(metrics["dropped_messages"] for _, metrics in with_memories), "budget should be tight"
+    for (a, _), (b, _) in zip(with_memories, without_memories):
+        assert a[:-1] == b[:-1]
+
+
+def test_prefix_is_byte_identical_between_trim_boundaries():
+    rounds = _run(lambda turn: MEMORIES[: turn % 4])
+    reused = 0
+    for (previous, previous_metrics), (current, metrics) in zip(rounds, rounds[1:]):
+        if metrics["dropped_messages"] != previous_metrics["dropped_messages"]:
+            continue   # 整批丟掉最舊訊息的那一輪，前綴本來就會變
+        prefix = previous[:-1]
+        assert current[:len(prefix)] == prefix
+        reused += 1
+    # 丟訊息是整批進行的，大部分輪次都能重用前綴
+    assert reused >= len(rounds) // 2
+
+
+def _prefix_breaks(rounds):
+    return [turn for turn, ((previous, _), (current, _)) in enumerate(zip(rounds, rounds[1:]), 1)
+            if current[:len(previous) - 1] != previous[:-1]]
+
+
+def test_summary_folds_are_rare():
+    # 真的會摘要：每次併入摘要都會改掉前綴，所以要很久才發生一次
+    rounds = _run(lambda turn: MEMORIES[: turn % 4], turns=40, summarizer=_truncating_summarizer)
+    breaks = _prefix_breaks(rounds)
+    assert any(metrics["summary"] for _, metrics in rounds), "history should have been folded"
+    assert not any(metrics["dropped_messages"] for _, metrics in rounds), "folding should keep history in budget"
+    assert len(breaks) <= len(rounds) // 5, breaks
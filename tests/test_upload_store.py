@@ -0,0 +1,44 @@
+import hashlib
+import io
+import os
+
+import upload_store
+
+
+def _png(seed, size=4096):
+    # 只需要檔頭是 PNG，內容用 seed 做出不同的 hash
+    return b"\x89PNG\r\n\x1a\n" + hashlib.sha256(str(seed).encode()).digest() * (size // 32)
+
+
+def _upload(data):
+    upload_id = upload_store.init_upload("a.png", len(data))
+    upload_store.write_chunk(upload_id, 0, io.BytesIO(data), len(data))
+    return upload_store.complete_upload(upload_id)["handle"]
+
+
+def _age(handle, seconds):
+    _, path = upload_store.resolve_handle(handle)
+    st = os.stat(path)
+    os.utime(path, (st.st_atime - seconds, st.st_mtime - seconds))
+
+
+def test_image_store_evicts_least_recently_used(monkeypatch):
+    size = len(_png(0))
+    monkeypatch.setattr(upload_store, "IMAGE_STORE_MAX_BYTES", size * 2)
+    for name in os.listdir(upload_store.IMAGE_STORE_DIR):
+        os.remove(os.path.join(upload_store.IMAGE_STORE_DIR, name))
+
+    first = _upload(_png(1))
+    _age(first, 30)
+    second = _upload(_png(2))
+    _age(second, 20)
+    # 用過的圖片算最近使用，不會先被刪
+    assert upload_store.resolve_handle(first)[0] == "image"
+    third = _upload(_png(3))
+
+    assert upload_store.resolve_handle(second) == (None, None)
+    assert upload_store.resolve_handle(first)[0] == "image"
+    assert upload_store.resolve_handle(third)[0] == "image"
+    total = sum(os.path.getsize(os.path.join(upload_store.IMAGE_STORE_DIR, n))
+                for n in os.listdir(upload_store.IMAGE_STORE_DIR))
+    assert total <= upload_store.IMAGE_STORE_MAX_BYTES
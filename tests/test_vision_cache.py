@@ -0,0 +1,85 @@
+import base64
+import io
+
+import pytest
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image, ImageDraw, ImageFont
+
+import image_prep
+import vision_cache
+
+
+def _worksheet(digit):
+    img = Image.new("RGB", (800, 600), "white")
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=22)
+    lines = [
+        "Worksheet 3",
+        "1. Solve x^2 + 5x + 6 = 0",
+        "2. Integrate x sin(x) dx",
+        f"3. Find the limit of (x^2 - {digit}) / (x - 2)",
+        "4. det [[1,2],[3,4]]",
+        "5. Factor x^3 - 8",
+    ]
+    for i, line in enumerate(lines):
+        draw.text((40, 40 + i * 60), line, fill="black", font=font)
+    return img
+
+
+def _full_page(digit):
+    # 300 dpi 的 A4/Letter 掃描：image_prep 會把整頁縮小，一個數字只佔很小一塊
+    img = Image.new("RGB", (2550, 3300), "white")
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=30)
+    for i in range(40):
+        value = digit if i == 17 else str(i % 10)
+        draw.text((150, 150 + i * 75), f"{i + 1}. Find the limit of (x^2 - {value}) / (x - 2) and integrate x sin(x) dx",
+                  fill="black", font=font)
+    return img
+
+
+def _b64(img, fmt="PNG", **kwargs):
+    buffered = io.BytesIO()
+    img.save(buffered, format=fmt, **kwargs)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def _hash(image_base64):
+    return vision_cache.image_hash(image_prep.prepare_image(image_base64))
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    vision_cache._entries.clear()
+    yield
+    vision_cache._entries.clear()
+
+
+def test_same_image_hits_exact():
+    key = "test|exact"
+    vision_cache.store(_hash(_b64(_worksheet("7"))), key, "limit of (x^2 - 7)")
+    assert vision_cache.lookup(_hash(_b64(_worksheet("7"))), key) == "limit of (x^2 - 7)"
+
+
+def test_one_digit_edit_does_not_hit():
+    key = "test|edit"
+    vision_cache.store(_hash(_b64(_worksheet("7"))), key, "limit of (x^2 - 7)")
+    for digit in "1234568":
+        assert vision_cache.lookup(_hash(_b64(_worksheet(digit))), key) is None
+        assert vision_cache.lookup(_hash(_b64(_worksheet(digit), "JPEG", quality=95)), key) is None
+
+
+def test_high_quality_reencode_hits_near():
+    key = "test|reencode"
+    vision_cache.store(_hash(_b64(_worksheet("7"))), key, "limit of (x^2 - 7)")
+    for quality in (95, 85):
+        assert vision_cache.lookup(_hash(_b64(_worksheet("7"), "JPEG", quality=quality)), key) == "limit of (x^2 - 7)"
+
+
+def test_full_page_one_digit_edit_does_not_hit():
+    key = "test|page"
+    vision_cache.store(_hash(_b64(_full_page("7"))), key, "problem 18: limit of (x^2 - 7)")
+    for digit in "138":
+        assert vision_cache.lookup(_hash(_b64(_full_page(digit))), key) is None
+    assert vision_cache.lookup(_hash(_b64(_full_page("7"), "JPEG", quality=90)), key) == "problem 18: limit of (x^2 - 7)"
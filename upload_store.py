@@ -0,0 +1,307 @@
+# upload_store.py (分段上傳：直接寫磁碟、可續傳、完成後以內容 hash 當作檔案代號)
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import pdf_store
+
+# ==========================================
+# 🔧 設定區
+# ==========================================
+UPLOAD_DIR = "./cache/uploads"            # 上傳中的暫存檔 (.part + .json)
+IMAGE_STORE_DIR = "./cache/upload_images"  # 上傳完成的圖片 (PDF 交給 pdf_store)
+# 單一檔案上限
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+MAX_IMAGE_BYTES = 30 * 1024 * 1024
+# 上傳完成的圖片總容量上限；超過時從最久沒用到的開始刪 (PDF 的上限在 pdf_store)
+IMAGE_STORE_MAX_BYTES = 1024 * 1024 * 1024
+# 每一段的大小上限 (前端建議用 CHUNK_SIZE 切)
+CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_BYTES = 8 * 1024 * 1024
+# 沒有完成的上傳保留多久 (秒)
+UPLOAD_TTL = 24 * 60 * 60
+# 從 request stream 一次讀多少 (不會整段讀進記憶體)
+READ_BLOCK = 64 * 1024
+# 判斷檔案類型要看的檔頭長度
+HEAD_BYTES = 16
+
+_IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": ".jpg",
+    b"\x89PNG\r\n\x1a\n": ".png",
+    b"GIF87a": ".gif",
+    b"GIF89a": ".gif",
+    b"RIFF": ".webp",
+    b"BM": ".bmp",
+}
+
+for _dir in (UPLOAD_DIR, IMAGE_STORE_DIR):
+    if not os.path.exists(_dir):
+        os.makedirs(_dir)
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class UploadError(Exception):
+    """上傳流程錯誤；status 對應要回給前端的 HTTP 狀態碼"""
+
+    def __init__(self, message, status=400, received=None):
+        super().__init__(message)
+        self.status = status
+        self.received = received
+
+
+def _upload_lock(upload_id):
+    with _locks_guard:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+def _part_path(upload_id):
+    return os.path.join(UPLOAD_DIR, f"{upload_id}.part")
+
+
+def _meta_path(upload_id):
+    return os.path.join(UPLOAD_DIR, f"{upload_id}.json")
+
+
+def _load_meta(upload_id):
+    # upload_id 來自網址，只接受 init_upload 產生的格式，避免路徑穿越
+    if len(upload_id) != 32 or not all(c in "0123456789abcdef" for c in upload_id):
+        raise UploadError("無效的上傳代號", status=404)
+    try:
+        with open(_meta_path(upload_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadError("找不到這個上傳 (可能已過期)", status=404)
+
+
+def _save_meta(upload_id, meta):
+    tmp_path = _meta_path(upload_id) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, _meta_path(upload_id))
+
+
+def _remove_upload(upload_id):
+    for path in (_part_path(upload_id), _meta_path(upload_id)):
+        if os.path.exists(path):
+            os.remove(path)
+    with _locks_guard:
+        _locks.pop(upload_id, None)
+
+
+def cleanup_stale_uploads():
+    """刪掉超過 UPLOAD_TTL 還沒完成的上傳"""
+    now = time.time()
+    for name in os.listdir(UPLOAD_DIR):
+        if name.endswith(".json"):
+            upload_id = name[:-5]
+            if now - os.path.getmtime(os.path.join(UPLOAD_DIR, name)) > UPLOAD_TTL:
+                _remove_upload(upload_id)
+
+
+def init_upload(filename, size):
+    """開始一個上傳，回傳 upload_id"""
+    if not isinstance(size, int) or size <= 0:
+        raise UploadError("請提供檔案大小 (bytes)")
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadError(f"檔案太大 (上限 {MAX_UPLOAD_BYTES // 1024 // 1024} MB)", status=413)
+
+    cleanup_stale_uploads()
+    upload_id = uuid.uuid4().hex
+    open(_part_path(upload_id), "wb").close()
+    _save_meta(upload_id, {"filename": filename, "size": size, "received": 0, "created": time.time()})
+    return upload_id
+
+
+def get_status(upload_id):
+    """續傳用：回傳目前已收到的 bytes 數"""
+    meta = _load_meta(upload_id)
+    return {"upload_id": upload_id, "size": meta["size"], "received": meta["received"],
+            "complete": meta["received"] >= meta["size"]}
+
+
+def write_chunk(upload_id, offset, stream, length):
+    """
+    從 stream (例如 request.stream) 讀取一段寫進暫存檔，回傳目前已收到的 bytes 數。
+    offset 必須等於已收到的大小 (斷線後先查 get_status 再從那裡繼續)。
+    """
+    if length is None or length <= 0:
+        raise UploadError("缺少 Content-Length")
+    if length > MAX_CHUNK_BYTES:
+        raise UploadError(f"單段太大 (上限 {MAX_CHUNK_BYTES // 1024 // 1024} MB)", status=413)
+
+    with _upload_lock(upload_id):
+        meta = _load_meta(upload_id)
+        if offset != meta["received"]:
+            raise UploadError("offset 不符，請從 received 繼續上傳", status=409, received=meta["received"])
+        if offset + length > meta["size"]:
+            raise UploadError("超過宣告的檔案大小", status=413, received=meta["received"])
+
+        head = b""
+        if offset == 0:
+            # 第一段：先看檔頭，不支援的格式 / 太大的圖片不用等整個檔案傳完才拒絕
+            head_size = min(HEAD_BYTES, length)
+            head = _read_exactly(stream, head_size)
+            if len(head) < head_size:
+                raise UploadError("連線中斷，這一段沒有收完整", status=400, received=offset)
+            if len(head) == HEAD_BYTES or length == meta["size"]:
+                _check_kind(upload_id, meta, head)
+
+        written = 0
+        with open(_part_path(upload_id), "r+b") as f:
+            f.seek(offset)
+            if head:
+                f.write(head)
+                written = len(head)
+            while written < length:
+                block = stream.read(min(READ_BLOCK, length - written))
+                if not block:
+                    break
+                f.write(block)
+                written += len(block)
+            # 連線中斷只收到一部分：丟掉不完整的尾巴，下次從原本的 offset 重傳
+            if written < length:
+                f.truncate(offset)
+                raise UploadError("連線中斷，這一段沒有收完整", status=400, received=offset)
+
+        meta["received"] = offset + written
+        _save_meta(upload_id, meta)
+        return meta["received"]
+
+
+def _read_exactly(stream, size):
+    data = b""
+    while len(data) < size:
+        block = stream.read(size - len(data))
+        if not block:
+            break
+        data += block
+    return data
+
+
+def _check_kind(upload_id, meta, head):
+    """由檔頭判斷類型並記進 meta；不支援的格式或超過上限的圖片直接取消這個上傳"""
+    kind, _ = _detect_kind_head(head)
+    if kind is None:
+        _remove_upload(upload_id)
+        raise UploadError("只支援 PDF 與圖片檔", status=415)
+    if kind == "image" and meta["size"] > MAX_IMAGE_BYTES:
+        _remove_upload(upload_id)
+        raise UploadError(f"圖片太大 (上限 {MAX_IMAGE_BYTES // 1024 // 1024} MB)", status=413)
+    meta["kind"] = kind
+
+
+def _detect_kind(path):
+    with open(path, "rb") as f:
+        return _detect_kind_head(f.read(HEAD_BYTES))
+
+
+def _detect_kind_head(head):
+    if head.startswith(b"%PDF"):
+        return "pdf", ".pdf"
+    for signature, ext in _IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            if ext == ".webp" and head[8:12] != b"WEBP":
+                continue
+            return "image", ext
+    return None, None
+
+
+def _enforce_image_limit(keep_handle=None):
+    """圖片存檔區超過 IMAGE_STORE_MAX_BYTES 時，依修改時間 (最近使用) 從最舊的開始刪"""
+    files = []
+    for name in os.listdir(IMAGE_STORE_DIR):
+        path = os.path.join(IMAGE_STORE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in files:
+        if total <= IMAGE_STORE_MAX_BYTES:
+            break
+        if os.path.splitext(os.path.basename(path))[0] == keep_handle:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        print(f"🧹 [上傳] 圖片存檔區超過上限，刪除 {removed} 張最久沒用的圖片")
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete_upload(upload_id, expected_sha256=None):
+    """
+    收完所有段落後呼叫：驗證大小 / hash、判斷檔案類型，搬進內容定址的存檔區。
+    回傳 {"handle": sha256, "kind": "pdf" | "image", "size": bytes}
+    """
+    with _upload_lock(upload_id):
+        meta = _load_meta(upload_id)
+        if meta["received"] != meta["size"]:
+            raise UploadError("檔案還沒上傳完成", status=409, received=meta["received"])
+
+        part_path = _part_path(upload_id)
+        handle = _sha256_file(part_path)
+        if expected_sha256 and expected_sha256.lower() != handle:
+            _remove_upload(upload_id)
+            raise UploadError("檔案 hash 不符，請重新上傳")
+
+        kind, ext = _detect_kind(part_path)
+        if kind is None:
+            _remove_upload(upload_id)
+            raise UploadError("只支援 PDF 與圖片檔", status=415)
+        if kind == "image" and meta["size"] > MAX_IMAGE_BYTES:
+            _remove_upload(upload_id)
+            raise UploadError(f"圖片太大 (上限 {MAX_IMAGE_BYTES // 1024 // 1024} MB)", status=413)
+
+        if kind == "pdf":
+            # PDF 直接交給 pdf_store (之後換頁詢問也會用到它的頁面快取)
+            pdf_store.adopt_pdf_file(part_path, handle)
+        else:
+            image_path = os.path.join(IMAGE_STORE_DIR, handle + ext)
+            if os.path.exists(image_path):
+                os.remove(part_path)
+                os.utime(image_path, None)
+            else:
+                os.replace(part_path, image_path)
+            _enforce_image_limit(keep_handle=handle)
+        _remove_upload(upload_id)
+
+    print(f"📦 [上傳] 完成 {meta['filename']} ({meta['size'] / 1024 / 1024:.2f} MB) -> {kind}:{handle[:12]}")
+    return {"handle": handle, "kind": kind, "size": meta["size"]}
+
+
+def resolve_handle(handle):
+    """由上傳代號找出檔案：回傳 ("pdf" | "image", 路徑)，找不到回傳 (None, None)"""
+    handle = (handle or "").strip().lower()
+    if len(handle) != 64 or not all(c in "0123456789abcdef" for c in handle):
+        return None, None
+    if pdf_store.has_pdf(handle):
+        return "pdf", pdf_store.pdf_path(handle)
+    for ext in set(_IMAGE_SIGNATURES.values()):
+        image_path = os.path.join(IMAGE_STORE_DIR, handle + ext)
+        if os.path.exists(image_path):
+            try:
+                os.utime(image_path, None)  # 記錄「最近用過」，淘汰時最後才刪
+            except OSError:
+                pass
+            return "image", image_path
+    return None, None
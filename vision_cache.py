@@ -0,0 +1,186 @@
+# vision_cache.py (視覺描述快取：內容 hash + 感知雜湊 dHash)
+
+import base64
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from cache_store import PersistentCache
+
+# Pillow 是選配：沒裝就不做快取，每張圖照常送視覺模型
+try:
+    from PIL import Image, ImageChops
+except ImportError:
+    Image = None
+
+# ==========================================
+# 🔧 設定區
+# ==========================================
+# 雜湊的對象是 image_prep 處理後的圖片 (已裁白邊、縮放)，分兩層：
+# 1. 像素內容 sha256：完全相同才命中 (重新上傳同一張圖、PNG 重新存檔)
+# 2. 近似比對：16x16 dHash 只用來挑候選，真正決定的是縮圖的逐區塊比對
+#
+# 實測 (經過 image_prep；區塊 = 處理後圖片的 12x12 像素)：
+#                     dHash 距離    區塊最大差異
+#                                   800x600 講義   2550x3300 整頁 (字高 24~42 px)
+#   改一個數字          0~5 bit       42~67          18~67
+#   JPEG q95 重新壓縮   0~2 bit         1              1
+#   JPEG q85~q90        5 bit           2              2
+#   JPEG q75 / q60      9~11 bit      61~74        (大小不同，不比對)
+# 改題目的 dHash 距離比重新壓縮還小 (整頁時甚至是 0)，只靠 dHash 一定會把別題的描述拿來用。
+# 區塊用「固定像素大小」而不是固定格數：整頁講義縮成固定格數時一格涵蓋好幾個字，
+# 改一個數字會被平均掉 (舊做法 128x128 / 4 格在整頁上只剩 4，比門檻還小)。
+# 門檻放在遠低於改題目的位置；壓縮得比較重或縮放過的圖寧可重新問一次視覺模型。
+VISION_HASH_SIZE = 16
+VISION_HASH_THRESHOLD = 6
+# 區塊比對：兩張圖各縮小 VISION_THUMB_SCALE 倍 (灰階、保持比例)，每 VISION_BLOCK_SIZE 格取平均，
+# 任何一格的平均差異超過這個值就不算同一張；處理後大小不同的圖不比對
+VISION_THUMB_SCALE = 4
+VISION_BLOCK_SIZE = 3
+VISION_BLOCK_MAX_DIFF = 6
+# 記憶體中保留幾筆 (每筆含一張縮圖，image_prep 上限 1.25 MP 時約 80 KB)
+VISION_CACHE_SIZE = 256
+VISION_CACHE_TTL = 24 * 60 * 60
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # (key, 內容 sha256) -> (描述, 建立時間, ImageHash)
+# 完全相同的圖片在重啟後也能命中
+_disk_cache = PersistentCache("vision", ttl=VISION_CACHE_TTL, max_entries=2000)
+_stats = {"exact": 0, "near": 0, "misses": 0}
+
+# digest: 像素內容 sha256 / dhash: 感知雜湊 (int) / thumb: 區塊比對用的灰階縮圖
+ImageHash = namedtuple("ImageHash", ["digest", "dhash", "thumb"])
+
+
+def dhash(img, size=VISION_HASH_SIZE):
+    """差異雜湊：縮成 (size+1) x size 灰階，比較左右相鄰像素的明暗"""
+    small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def _content_digest(img):
+    """像素內容的 sha256 (和檔案格式 / metadata 無關)"""
+    digest = hashlib.sha256(f"{img.mode}|{img.size[0]}x{img.size[1]}|".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def _thumbnail(img):
+    w, h = img.size
+    size = (max(1, w // VISION_THUMB_SCALE), max(1, h // VISION_THUMB_SCALE))
+    return img.convert("L").resize(size, Image.BOX)
+
+
+def _block_diff(thumb_a, thumb_b):
+    """兩張縮圖逐區塊平均後的最大差異 (局部改動會集中在某一格，壓縮雜訊會被平均掉)"""
+    if thumb_a.size != thumb_b.size:
+        return 255
+    w, h = thumb_a.size
+    blocks = (-(-w // VISION_BLOCK_SIZE), -(-h // VISION_BLOCK_SIZE))
+    diff = ImageChops.difference(thumb_a, thumb_b).resize(blocks, Image.BOX)
+    return max(diff.tobytes())
+
+
+def image_hash(image_base64):
+    """Base64 圖片 (請先經過 image_prep) -> ImageHash；無法解碼或沒有 Pillow 時回傳 None"""
+    if Image is None or not image_base64:
+        return None
+    try:
+        # 網頁上傳的可能是 data URL ("data:image/png;base64,....")
+        if image_base64.startswith("data:"):
+            image_base64 = image_base64.split(",", 1)[1]
+        with Image.open(io.BytesIO(base64.b64decode(image_base64))) as img:
+            img = img.convert("RGB")
+            return ImageHash(_content_digest(img), dhash(img), _thumbnail(img))
+    except Exception:
+        return None
+
+
+def _disk_key(key, img_hash):
+    # 磁碟只做完全比對
+    return f"{key}|{img_hash.digest}"
+
+
+def lookup(img_hash, key, threshold=None):
+    """
+    找出同一個 key (模型 + 指令) 下同一張圖的描述。
+    完全相同 -> 記憶體 / 磁碟；近似 -> dHash 距離 <= threshold 的候選中，區塊比對通過的那一筆。
+    """
+    if img_hash is None:
+        return None
+    if threshold is None:
+        threshold = VISION_HASH_THRESHOLD
+    now = time.time()
+
+    with _lock:
+        entry = _entries.get((key, img_hash.digest))
+        if entry is not None and now - entry[1] <= VISION_CACHE_TTL:
+            _entries.move_to_end((key, img_hash.digest))
+            _stats["exact"] += 1
+            return entry[0]
+
+    description = _disk_cache.get(_disk_key(key, img_hash))
+    with _lock:
+        if description is not None:
+            _remember(key, img_hash, description, now)
+            _stats["exact"] += 1
+            return description
+
+        candidates = []
+        for entry_id, (entry_description, created, entry_hash) in _entries.items():
+            if entry_id[0] != key or now - created > VISION_CACHE_TTL:
+                continue
+            distance = bin(img_hash.dhash ^ entry_hash.dhash).count("1")
+            if distance <= threshold:
+                candidates.append((distance, entry_id, entry_hash))
+
+    for distance, entry_id, entry_hash in sorted(candidates, key=lambda c: c[0]):
+        if _block_diff(img_hash.thumb, entry_hash.thumb) > VISION_BLOCK_MAX_DIFF:
+            continue
+        with _lock:
+            entry = _entries.get(entry_id)
+            if entry is None:
+                continue
+            _entries.move_to_end(entry_id)
+            _stats["near"] += 1
+            return entry[0]
+
+    with _lock:
+        _stats["misses"] += 1
+    return None
+
+
+def store(img_hash, key, description):
+    """記住這張圖的描述 (錯誤訊息不要存)"""
+    if img_hash is None or not description:
+        return
+    with _lock:
+        _remember(key, img_hash, description, time.time())
+    _disk_cache.set(_disk_key(key, img_hash), description)
+
+
+def _remember(key, img_hash, description, created):
+    """放進記憶體 LRU (呼叫端需持有 _lock)"""
+    entry_id = (key, img_hash.digest)
+    _entries[entry_id] = (description, created, img_hash)
+    _entries.move_to_end(entry_id)
+    while len(_entries) > VISION_CACHE_SIZE:
+        _entries.popitem(last=False)
+
+
+def get_vision_cache_stats():
+    """exact = 完全相同命中, near = 近似命中, misses = 實際呼叫視覺模型"""
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_entries)
+    total = stats["exact"] + stats["near"] + stats["misses"]
+    stats["hit_rate"] = (stats["exact"] + stats["near"]) / total if total else 0.0
+    return stats